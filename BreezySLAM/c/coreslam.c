@@ -35,12 +35,18 @@
 #include <time.h>
 #include <string.h>
 #include <math.h>
+#include <limits.h>
 
 #include "coreslam.h"
 #include "coreslam_internals.h"
 
 #include "random.h"
 
+#ifndef _WIN32
+#define BREEZYSLAM_PTHREADS
+#include <pthread.h>
+#endif
+
 /* For angle/distance interpolation ------------------------------- */
 
 typedef struct angle_distance_pair {
@@ -163,6 +169,16 @@ static int
     return value  < 0 || value >= bound;
 }
 
+static int int_min(int a, int b)
+{
+    return a < b ? a : b;
+}
+
+static int int_max(int a, int b)
+{
+    return a > b ? a : b;
+}
+
 
 
 static int
@@ -304,339 +320,2254 @@ static void
 
 
 static void
-        scan_update_xy(
-        scan_t * scan,
-        int offset,
-        int distance,
-        int scanval,
-        double horz_mm,
-        double rotation)
+        map_mark_dirty(
+        map_t * map,
+        int x_min,
+        int y_min,
+        int x_max,
+        int y_max)
 {
-    int j;
-    for (j=0; j<scan->span; ++j)
-    {
-        double k = (double)(offset*scan->span+j) * scan->detection_angle_degrees / (scan->size * scan->span - 1);
-        double angle = radians(-scan->detection_angle_degrees/2 + k * rotation);
-        double x = distance * cos(angle) - k * horz_mm;
-        double y = distance * sin(angle);
-        
-        scan->value[scan->npoints] = scanval;
-        
-        scan->x_mm[scan->npoints] = x;
-        scan->y_mm[scan->npoints] = y;
-        scan->npoints++;
-    }
+    if (x_min < map->dirty_x_min) map->dirty_x_min = x_min;
+    if (y_min < map->dirty_y_min) map->dirty_y_min = y_min;
+    if (x_max > map->dirty_x_max) map->dirty_x_max = x_max;
+    if (y_max > map->dirty_y_max) map->dirty_y_max = y_max;
 }
 
-
-/* Exported functions --------------------------------------------------------*/
-
-int *
-        int_alloc(
-        int size)
+static void
+        map_clear_dirty(
+        map_t * map)
 {
-    return (int *)safe_malloc(size * sizeof(int));
+    map->dirty_x_min = map->dirty_y_min = INT_MAX;
+    map->dirty_x_max = map->dirty_y_max = INT_MIN;
 }
 
-float *
-        float_alloc(
-        int size)
+/* Tiled maps ------------------------------------------------------------------------------------- */
+
+/* Value of pixels no scan has touched: (OBSTACLE + NO_OBSTACLE) / 2 */
+static const pixel_t UNKNOWN = 32750;
+
+static pixel_t *
+        tile_alloc(
+        map_t * map)
 {
-    return (float *)safe_malloc(size * sizeof(float));
+    int npix = 1 << (2 * map->tile_bits);
+    
+    /* plus a spare pixel, see map_t */
+    pixel_t * tile = (pixel_t *)safe_malloc((npix + 1) * sizeof(pixel_t));
+    
+    int k = 0;
+    for (k=0; k<=npix; ++k)
+    {
+        tile[k] = UNKNOWN;
+    }
+    
+    return tile;
 }
 
-void
-        map_init(
+/* Grows the tile directory to cover tile (tx, ty), by at least its current size on that side, so that
+   a robot driving off the map reallocates it a logarithmic number of times */
+static void
+        map_tiles_grow(
         map_t * map,
-        int size_pixels,
-        double size_meters)
+        int tx,
+        int ty)
 {
-    int npix = size_pixels * size_pixels;
-
-    int k = 0;
+    int x0 = map->tiles_x0;
+    int y0 = map->tiles_y0;
+    int x1 = x0 + map->tiles_nx;
+    int y1 = y0 + map->tiles_ny;
     
-    map->pixels = (pixel_t *)safe_malloc(npix * sizeof(pixel_t));
+    if (tx < x0) x0 = int_min(tx, x0 - map->tiles_nx);
+    if (ty < y0) y0 = int_min(ty, y0 - map->tiles_ny);
+    if (tx >= x1) x1 = int_max(tx + 1, x1 + map->tiles_nx);
+    if (ty >= y1) y1 = int_max(ty + 1, y1 + map->tiles_ny);
     
-    for (k=0; k<npix; ++k)
+    int nx = x1 - x0;
+    int ny = y1 - y0;
+    
+    pixel_t ** tiles = (pixel_t **)safe_malloc(nx * ny * sizeof(pixel_t *));
+    
+    int k = 0;
+    for (k=0; k<nx*ny; ++k)
     {
-        map->pixels[k] = (OBSTACLE + NO_OBSTACLE) / 2;
+        tiles[k] = map->blank_tile;
     }
     
-    map->size_pixels = size_pixels;
-    map->size_meters = size_meters;
+    int j = 0;
+    for (j=0; j<map->tiles_ny; ++j)
+    {
+        memcpy(tiles + (j + map->tiles_y0 - y0) * nx + map->tiles_x0 - x0, 
+               map->tiles + j * map->tiles_nx, 
+               map->tiles_nx * sizeof(pixel_t *));
+    }
     
-    /* precompute scale for efficiency */
-    map->scale_pixels_per_mm =  size_pixels / (size_meters * 1000);
+    free(map->tiles);
+    
+    map->tiles = tiles;
+    map->tiles_x0 = x0;
+    map->tiles_y0 = y0;
+    map->tiles_nx = nx;
+    map->tiles_ny = ny;
 }
 
-void
-        map_free(
+/* Grows the tile directory, if need be, to cover tile (tx, ty) */
+static void
+        map_tiles_cover(
+        map_t * map,
+        int tx,
+        int ty)
+{
+    if (tx < map->tiles_x0 || tx >= map->tiles_x0 + map->tiles_nx || 
+        ty < map->tiles_y0 || ty >= map->tiles_y0 + map->tiles_ny)
+    {
+        map_tiles_grow(map, tx, ty);
+    }
+}
+
+/* Whether tile (tx, ty) lies in the block */
+static int
+        map_in_block(
+        map_t * map,
+        int tx,
+        int ty)
+{
+    return tx >= map->block_x0 && tx < map->block_x0 + map->block_tiles && 
+        ty >= map->block_y0 && ty < map->block_y0 + map->block_tiles;
+}
+
+/* Pixels of the block: it is a dense map of block_tiles tiles square */
+static size_t
+        map_block_pixels(
         map_t * map)
 {
-    free(map->pixels);
+    size_t side = (size_t)map->block_tiles << map->tile_bits;
+    
+    return side * side;
 }
 
-void map_string(
-        map_t map,
-        char * str)
+/* Where tile (tx, ty), in the block, starts */
+static pixel_t *
+        map_block_tile(
+        map_t * map,
+        int tx,
+        int ty)
 {
-    sprintf(str, "size = %d x %d pixels | = %f meters",
-            map.size_pixels, map.size_pixels, map.size_meters);
+    size_t stride = (size_t)map->block_tiles << map->tile_bits;
+    
+    return map->block + ((size_t)(ty - map->block_y0) << map->tile_bits) * stride + 
+        ((size_t)(tx - map->block_x0) << map->tile_bits);
 }
 
-void
-        map_update(
+/* Whether a tile lives in the block rather than on its own */
+static int
+        map_tile_in_block(
         map_t * map,
-        scan_t * scan,
-        position_t position,
-        int map_quality,
-        double hole_width_mm)
+        const pixel_t * tile)
+{
+    return tile >= map->block && tile < map->block + map_block_pixels(map);
+}
+
+/* Pixels from one row of a tile to the next: the tile's width for a tile of its own, the block's for a tile 
+   of the block */
+static int
+        map_tile_stride(
+        map_t * map,
+        const pixel_t * tile)
+{
+    return map_tile_in_block(map, tile) ? map->block_tiles << map->tile_bits : 1 << map->tile_bits;
+}
+
+static void
+        tile_copy(
+        map_t * map,
+        pixel_t * dst,
+        const pixel_t * src)
 {
+    int size = 1 << map->tile_bits;
+    int dst_stride = map_tile_stride(map, dst);
+    int src_stride = map_tile_stride(map, src);
     
-    double position_theta_radians = radians(position.theta_degrees);
-    double costheta = cos(position_theta_radians);
-    double sintheta = sin(position_theta_radians);
+    int y = 0;
+    for (y=0; y<size; ++y)
+    {
+        memcpy(dst + y * dst_stride, src + y * src_stride, size * sizeof(pixel_t));
+    }
+}
+
+/* Moves the block to start at tile (x0, y0): tiles written in the old block move to tiles of their own, 
+   then those in the new block move into it */
+static void
+        map_block_move(
+        map_t * map,
+        int x0,
+        int y0)
+{
+    int tx = 0, ty = 0;
+    for (ty=map->block_y0; ty<map->block_y0+map->block_tiles; ++ty)
+    {
+        for (tx=map->block_x0; tx<map->block_x0+map->block_tiles; ++tx)
+        {
+            pixel_t ** slot = map->tiles + (ty - map->tiles_y0) * map->tiles_nx + tx - map->tiles_x0;
+            
+            if (*slot != map->blank_tile)
+            {
+                pixel_t * tile = tile_alloc(map);
+                tile_copy(map, tile, *slot);
+                *slot = tile;
+            }
+        }
+    }
     
-    int x1 = roundup(position.x_mm * map->scale_pixels_per_mm);
-    int y1 = roundup(position.y_mm * map->scale_pixels_per_mm);
+    size_t k = 0;
+    for (k=0; k<=map_block_pixels(map); ++k)
+    {
+        map->block[k] = UNKNOWN;
+    }
     
-    int i = 0;
-    for (i = 0; i != scan->npoints; i++)
-    {        
-        double x2p = costheta * scan->x_mm[i] - sintheta * scan->y_mm[i];
-        double y2p = sintheta * scan->x_mm[i] + costheta * scan->y_mm[i];
-        
-        int xp = roundup((position.x_mm + x2p) * map->scale_pixels_per_mm);
-        int yp = roundup((position.y_mm + y2p) * map->scale_pixels_per_mm);
-        
-        double dist = sqrt(x2p * x2p + y2p * y2p);
-        double add = hole_width_mm / 2 / dist;
-        
-        x2p *= map->scale_pixels_per_mm * (1 + add);
-        y2p *= map->scale_pixels_per_mm * (1 + add);
-        
-        {  
-            int x2 = roundup(position.x_mm * map->scale_pixels_per_mm + x2p);
-            int y2 = roundup(position.y_mm * map->scale_pixels_per_mm + y2p);
-            
-            int value = OBSTACLE;
-            int q = map_quality;
+    map->block_x0 = x0;
+    map->block_y0 = y0;
+    map->block_allocated = 0;
+    
+    /* the directory covers the block */
+    map_tiles_cover(map, x0, y0);
+    map_tiles_cover(map, x0 + map->block_tiles - 1, y0 + map->block_tiles - 1);
+    
+    for (ty=y0; ty<y0+map->block_tiles; ++ty)
+    {
+        for (tx=x0; tx<x0+map->block_tiles; ++tx)
+        {
+            pixel_t ** slot = map->tiles + (ty - map->tiles_y0) * map->tiles_nx + tx - map->tiles_x0;
             
-            if (scan->value[i] == NO_OBSTACLE)
+            if (*slot != map->blank_tile)
             {
-                q = map_quality / 4;
-                value = NO_OBSTACLE;
+                pixel_t * tile = map_block_tile(map, tx, ty);
+                tile_copy(map, tile, *slot);
+                free(*slot);
+                *slot = tile;
+                map->block_allocated++;
             }
-            
-            map_laser_ray(map->pixels, map->size_pixels, x1, y1, x2, y2, xp, yp, value, q);
         }
     }
 }
 
-void
-        map_get(
+/* Centres the block on the robot, at pixel (x, y), once it comes within an eighth of the block of its edge */
+static void
+        map_block_follow(
         map_t * map,
-        char * bytes)
+        int x,
+        int y)
 {
-    int k;
-    for (k=0; k<map->size_pixels*map->size_pixels; ++k)
+    int tx = (x >> map->tile_bits) - map->block_x0;
+    int ty = (y >> map->tile_bits) - map->block_y0;
+    int margin = int_max(1, map->block_tiles / 8);
+    
+    if (tx < margin || tx >= map->block_tiles - margin || ty < margin || ty >= map->block_tiles - margin)
     {
-        bytes[k] = map->pixels[k] >> 8;
+        int x0 = map->block_x0 + tx - map->block_tiles / 2;
+        int y0 = map->block_y0 + ty - map->block_tiles / 2;
+        
+        if (x0 != map->block_x0 || y0 != map->block_y0)
+        {
+            map_block_move(map, x0, y0);
+        }
     }
 }
 
+/* Tile (tx, ty) for reading: blank if never written */
+static const pixel_t *
+        map_tile(
+        map_t * map,
+        int tx,
+        int ty)
+{
+    tx -= map->tiles_x0;
+    ty -= map->tiles_y0;
+    
+    return (tx >= 0 && tx < map->tiles_nx && ty >= 0 && ty < map->tiles_ny) ? 
+        map->tiles[ty * map->tiles_nx + tx] : map->blank_tile;
+}
 
-void
-        map_set(
+/* Tile (tx, ty) for writing, allocated on first use */
+static pixel_t *
+        map_tile_for_write(
         map_t * map,
-        char * bytes)
+        int tx,
+        int ty)
 {
-    int k;
-    for (k=0; k<map->size_pixels*map->size_pixels; ++k)
+    map_tiles_cover(map, tx, ty);
+    
+    pixel_t ** slot = map->tiles + (ty - map->tiles_y0) * map->tiles_nx + tx - map->tiles_x0;
+    
+    if (*slot == map->blank_tile)
     {
-        map->pixels[k] = bytes[k];
-        map->pixels[k] <<= 8;
+        if (map_in_block(map, tx, ty))
+        {
+            *slot = map_block_tile(map, tx, ty);
+            map->block_allocated++;
+        }
+        else
+        {
+            *slot = tile_alloc(map);
+        }
+        
+        map->tiles_allocated++;
     }
+    
+    return *slot;
 }
 
-void scan_init(
-    scan_t * scan, 
-    int span,
-    int size,
-    double scan_rate_hz,                
-    double detection_angle_degrees,     
-    double distance_no_detection_mm,    
-    int detection_margin,               
-    double offset_mm)                  
+/* Steps of +1 or -1 (step) a tile-local coordinate can take before leaving the tile; mask, no limit, for a
+   coordinate that does not move */
+static int
+        tile_edge_steps(
+        int local,
+        int step,
+        int mask)
 {
-    scan->x_mm = double_alloc(size*span);
-    scan->y_mm = double_alloc(size*span);
-    scan->value = int_alloc(size*span);
-    scan->span = span;
-
-    scan->size = size;
-    scan->rate_hz = scan_rate_hz;
-    scan->detection_angle_degrees = detection_angle_degrees;
-    scan->distance_no_detection_mm = distance_no_detection_mm;
-    scan->detection_margin = detection_margin;
-    scan->offset_mm = offset_mm;
-    
-    scan->npoints = 0;
-    scan->obst_npoints = 0;
+    return step > 0 ? mask - local : step < 0 ? local : mask;
+}
 
-    /* for angle/distance interpolation */
-    interpolation_t * interp = (interpolation_t *)safe_malloc(sizeof(interpolation_t));
-    interp->angles = float_alloc(scan->size);
-    interp->distances = float_alloc(scan->size);
-    interp->angle_distance_pairs = (angle_distance_pair_t *)safe_malloc(size*sizeof(angle_distance_pair_t));
-    scan->interpolation = interp;
+/* Marks tile (tx, ty), in the block, as written */
+static void
+        map_block_mark(
+        map_t * map,
+        int tx,
+        int ty)
+{
+    pixel_t ** slot = map->tiles + (ty - map->tiles_y0) * map->tiles_nx + tx - map->tiles_x0;
     
-    /* assure size multiple of 4 for SSE */
-    scan->obst_x_mm = float_alloc(size*span+4);
-    scan->obst_y_mm = float_alloc(size*span+4);
+    if (*slot == map->blank_tile)
+    {
+        *slot = map_block_tile(map, tx, ty);
+        map->block_allocated++;
+        map->tiles_allocated++;
+    }
 }
 
-
-void
-        scan_free(
-        scan_t * scan)
+/* Whether every tile of the box from tile (tx1, ty1) to (tx2, ty2) is written */
+static int
+        map_tiles_written(
+        map_t * map,
+        int tx1,
+        int ty1,
+        int tx2,
+        int ty2)
 {
-    free(scan->x_mm);
-    free(scan->y_mm);
-    free(scan->value);
+    int tx = 0, ty = 0;
+    for (ty=int_min(ty1, ty2); ty<=int_max(ty1, ty2); ++ty)
+    {
+        pixel_t ** row = map->tiles + (ty - map->tiles_y0) * map->tiles_nx - map->tiles_x0;
+        
+        for (tx=int_min(tx1, tx2); tx<=int_max(tx1, tx2); ++tx)
+        {
+            if (row[tx] == map->blank_tile)
+            {
+                return 0;
+            }
+        }
+    }
     
-    free(scan->obst_x_mm);
-    free(scan->obst_y_mm);
-
-    interpolation_t * interp = (interpolation_t *)scan->interpolation;
-    free(interp->angles);
-    free(interp->distances);
-    free(interp->angle_distance_pairs);
-    free(interp);
+    return 1;
+}
+
+/* Marks the tiles a ray from (x1, y1) to (x2, y2), in the block, draws on as written. Where map_laser_ray() 
+   has taken k steps along the main axis, it has taken (2 * dy * k + dx - 1) / (2 * dx) along the side axis: 
+   the side coordinate only grows, so a ray crossing a tile along the main axis draws on every tile between 
+   those its ends are on. */
+static void
+        map_mark_ray_tiles(
+        map_t * map,
+        int x1,
+        int y1,
+        int x2,
+        int y2)
+{
+    int bits = map->tile_bits;
+    
+    /* most rays only draw on tiles drawn on before */
+    if (map_tiles_written(map, x1 >> bits, y1 >> bits, x2 >> bits, y2 >> bits))
+    {
+        return;
+    }
+    
+    int dx = abs(x2 - x1);
+    int dy = abs(y2 - y1);
+    
+    int main1 = x1, main_step = (x2 > x1) ? 1 : -1;
+    int side1 = y1, side_step = (y2 > y1) ? 1 : -1;
+    int swapped = 0;
+    
+    if (dx <= dy)
+    {
+        swap(&dx, &dy);
+        swap(&main1, &side1);
+        swap(&main_step, &side_step);
+        swapped = 1;
+    }
+    
+    int mask = (1 << bits) - 1;
+    
+    /* steps along the side axis at k, and the remainder of their division */
+    int sides = 0;
+    int remainder = dx - 1;
+    
+    int k = 0;
+    while (k <= dx)
+    {
+        int along = main1 + main_step * k;
+        int end = int_min(k + tile_edge_steps(along & mask, main_step, mask), dx);
+        
+        int first = (side1 + side_step * sides) >> bits;
+        
+        if (dx)
+        {
+            int numerator = 2 * dy * end + dx - 1;
+            sides = numerator / (2 * dx);
+            remainder = numerator - sides * 2 * dx;
+        }
+        
+        int last = (side1 + side_step * sides) >> bits;
+        
+        int t = first;
+        for (t=first; t!=last+side_step; t+=side_step)
+        {
+            if (swapped)
+            {
+                map_block_mark(map, t, along >> bits);
+            }
+            else
+            {
+                map_block_mark(map, along >> bits, t);
+            }
+        }
+        
+        /* one more step along the main axis */
+        if (remainder + 2 * dy >= 2 * dx)
+        {
+            sides++;
+            remainder -= 2 * dx;
+        }
+        
+        remainder += 2 * dy;
+        k = end + 1;
+    }
+}
+
+/* map_laser_ray() for tiled maps: nothing to clip, the ray is drawn whole. Pixel coordinates are split into
+   tile and offset with arithmetic shifts, which floor negative coordinates. */
+static void
+        map_laser_ray_tiled(
+        map_t * map,
+        int x1,
+        int y1,
+        int x2,
+        int y2,
+        int xp,
+        int yp,
+        int value,
+        int alpha)
+{
+    int block_x = map->block_x0 << map->tile_bits;
+    int block_y = map->block_y0 << map->tile_bits;
+    int block_size = map->block_tiles << map->tile_bits;
+    
+    /* in the block, the ray is drawn as on a dense map */
+    if (!out_of_bounds(x1 - block_x, block_size) && !out_of_bounds(y1 - block_y, block_size) &&
+        !out_of_bounds(x2 - block_x, block_size) && !out_of_bounds(y2 - block_y, block_size))
+    {
+        map_mark_ray_tiles(map, x1, y1, x2, y2);
+        
+        map_laser_ray(map->block, block_size, 
+            x1 - block_x, y1 - block_y, x2 - block_x, y2 - block_y, xp - block_x, yp - block_y, value, alpha);
+        
+        return;
+    }
+    
+    int dx = abs(x2 - x1);
+    int dy = abs(y2 - y1);
+    int sincv = (value > NO_OBSTACLE) ? 1 : -1;
+    
+    /* steps along the main axis and the side axis */
+    int mainx = (x2 > x1) ? 1 : -1;
+    int mainy = 0;
+    int sidex = 0;
+    int sidey = (y2 > y1) ? 1 : -1;
+    
+    int derrorv = 0;
+    
+    if (dx > dy)
+    {
+        derrorv = abs(xp - x2);
+    }
+    else
+    {
+        swap(&dx, &dy);
+        swap(&mainx, &sidex);
+        swap(&mainy, &sidey);
+        derrorv = abs(yp - y2);
+    }
+    
+    if (!derrorv)
+    {   /* XXX should probably throw an exception */
+        fprintf(stderr, "map_update: No error gradient: try increasing hole width\n");
+        exit(1);
+    }
+    
+    int error = 2 * dy - dx;
+    int horiz = 2 * dy;
+    int diago = 2 * (dy - dx);
+    int errorv = derrorv / 2;
+    
+    int incv = (value - NO_OBSTACLE) / derrorv;
+    
+    int incerrorv = value - NO_OBSTACLE - derrorv * incv;
+    
+    int pixval = NO_OBSTACLE;
+    
+    int bits = map->tile_bits;
+    int size = 1 << bits;
+    int mask = size - 1;
+    
+    /* walk the ray in runs inside one tile, with the pointer loop of map_laser_ray(), and look the tile up 
+       again between runs: a run ends at the tile edge along the main axis, or when a step along the side 
+       axis crosses one */
+    int tx = x1 >> bits;
+    int ty = y1 >> bits;
+    int lx = x1 & mask;
+    int ly = y1 & mask;
+    
+    int k = 0;
+    while (k <= dx)
+    {
+        if ((lx | ly) & ~mask)
+        {
+            tx += lx >> bits;
+            ty += ly >> bits;
+            lx &= mask;
+            ly &= mask;
+        }
+        
+        int main_room = int_min(tile_edge_steps(lx, mainx, mask), tile_edge_steps(ly, mainy, mask));
+        int side_room = int_min(tile_edge_steps(lx, sidex, mask), tile_edge_steps(ly, sidey, mask));
+        
+        int start = k;
+        int end = int_min(k + main_room + 1, dx + 1);
+        int sides = 0;
+        
+        pixel_t * tile = map_tile_for_write(map, tx, ty);
+        int stride = map_tile_stride(map, tile);
+        int main_step = mainy * stride + mainx;
+        int side_step = sidey * stride + sidex;
+        
+        pixel_t * ptr = tile + ly * stride + lx;
+        
+        while (k < end)
+        {
+            if (k > dx - 2 * derrorv)
+            {
+                if (k <= dx - derrorv)
+                {
+                    pixval += incv;
+                    errorv += incerrorv;
+                    if (errorv > derrorv)
+                    {
+                        pixval += sincv;
+                        errorv -= derrorv;
+                    }
+                }
+                else
+                {
+                    pixval -= incv;
+                    errorv -= incerrorv;
+                    if (errorv < 0)
+                    {
+                        pixval -= sincv;
+                        errorv += derrorv;
+                    }
+                }
+            }
+            
+            /* Integration into the map */
+            *ptr = ((256 - alpha) * (*ptr) + alpha * pixval) >> 8;
+            
+            k++;
+            ptr += main_step;
+            
+            if (error > 0)
+            {
+                ptr += side_step;
+                error += diago;
+                
+                if (++sides > side_room)
+                {
+                    break;
+                }
+            } else
+            {
+                error += horiz;
+            }
+        }
+        
+        lx += mainx * (k - start) + sidex * sides;
+        ly += mainy * (k - start) + sidey * sides;
+    }
+}
+
+/* Copies row y of pixels x to x + width - 1 from a tiled map */
+static void
+        map_get_row_tiled(
+        map_t * map,
+        int x,
+        int y,
+        int width,
+        pixel_t * row)
+{
+    int bits = map->tile_bits;
+    int size = 1 << bits;
+    int mask = size - 1;
+    
+    while (width > 0)
+    {
+        int n = int_min(size - (x & mask), width);
+        
+        const pixel_t * tile = map_tile(map, x >> bits, y >> bits);
+        
+        memcpy(row, tile + (y & mask) * map_tile_stride(map, tile) + (x & mask), n * sizeof(pixel_t));
+        
+        x += n;
+        row += n;
+        width -= n;
+    }
+}
+
+/* Writes the size_pixels-square window of a tiled map, leaving tiles blank where pixels are all unknown */
+static void
+        map_set_pixels_tiled(
+        map_t * map,
+        const pixel_t * pixels)
+{
+    int bits = map->tile_bits;
+    int size = 1 << bits;
+    int ntiles = (map->size_pixels + size - 1) >> bits;
+    
+    int tx = 0, ty = 0;
+    for (ty=0; ty<ntiles; ++ty)
+    {
+        for (tx=0; tx<ntiles; ++tx)
+        {
+            int x0 = tx * size;
+            int y0 = ty * size;
+            int width = int_min(size, map->size_pixels - x0);
+            int height = int_min(size, map->size_pixels - y0);
+            
+            int known = map_tile(map, tx, ty) != map->blank_tile;
+            
+            int x = 0, y = 0;
+            for (y=y0; y<y0+height && !known; ++y)
+            {
+                for (x=x0; x<x0+width && !known; ++x)
+                {
+                    known = pixels[y * map->size_pixels + x] != UNKNOWN;
+                }
+            }
+            
+            if (known)
+            {
+                pixel_t * tile = map_tile_for_write(map, tx, ty);
+                int stride = map_tile_stride(map, tile);
+                
+                for (y=0; y<height; ++y)
+                {
+                    memcpy(tile + y * stride, pixels + (y0 + y) * map->size_pixels + x0, width * sizeof(pixel_t));
+                }
+            }
+        }
+    }
+}
+
+static int
+        rect_from_bounds(
+        int * rect,
+        int x_min,
+        int y_min,
+        int x_max,
+        int y_max)
+{
+    if (x_min > x_max || y_min > y_max)
+    {
+        return 0;
+    }
+    
+    rect[0] = x_min;
+    rect[1] = y_min;
+    rect[2] = x_max - x_min + 1;
+    rect[3] = y_max - y_min + 1;
+    
+    return 1;
+}
+
+static int
+        clamp(int value, int bound)
+{
+    return value < 0 ? 0 : (value >= bound ? bound - 1 : value);
+}
+
+static void
+        scan_update_xy(
+        scan_t * scan,
+        int offset,
+        int distance,
+        int scanval,
+        double horz_mm,
+        double rotation)
+{
+    int j;
+    for (j=0; j<scan->span; ++j)
+    {
+        double k = (double)(offset*scan->span+j) * scan->detection_angle_degrees / (scan->size * scan->span - 1);
+        double angle = radians(-scan->detection_angle_degrees/2 + k * rotation);
+        double x = distance * cos(angle) - k * horz_mm;
+        double y = distance * sin(angle);
+        
+        scan->value[scan->npoints] = scanval;
+        
+        scan->x_mm[scan->npoints] = x;
+        scan->y_mm[scan->npoints] = y;
+        scan->npoints++;
+    }
+}
+
+
+/* Exported functions --------------------------------------------------------*/
+
+int *
+        int_alloc(
+        int size)
+{
+    return (int *)safe_malloc(size * sizeof(int));
+}
+
+float *
+        float_alloc(
+        int size)
+{
+    return (float *)safe_malloc(size * sizeof(float));
+}
+
+void
+        map_init(
+        map_t * map,
+        int size_pixels,
+        double size_meters)
+{
+    int npix = size_pixels * size_pixels;
+
+    int k = 0;
+    
+    map_clear_dirty(map);
+    
+    map->pixels = (pixel_t *)safe_malloc(npix * sizeof(pixel_t));
+    
+    for (k=0; k<npix; ++k)
+    {
+        map->pixels[k] = (OBSTACLE + NO_OBSTACLE) / 2;
+    }
+    
+    map->external_pixels = 0;
+    
+    map->tiles = NULL;
+    map->blank_tile = NULL;
+    map->tile_bits = 0;
+    map->tiles_x0 = map->tiles_y0 = map->tiles_nx = map->tiles_ny = 0;
+    map->tiles_allocated = 0;
+    map->block = NULL;
+    map->block_tiles = map->block_x0 = map->block_y0 = map->block_allocated = 0;
+    
+    map->size_pixels = size_pixels;
+    map->size_meters = size_meters;
+    
+    /* a new map is entirely dirty */
+    map_mark_dirty(map, 0, 0, size_pixels - 1, size_pixels - 1);
+    
+    /* precompute scale for efficiency */
+    map->scale_pixels_per_mm =  size_pixels / (size_meters * 1000);
+}
+
+void
+        map_init_external(
+        map_t * map,
+        int size_pixels,
+        double size_meters,
+        pixel_t * pixels)
+{
+    map_clear_dirty(map);
+    
+    map->pixels = pixels;
+    map->external_pixels = 1;
+    
+    map->tiles = NULL;
+    map->blank_tile = NULL;
+    map->tile_bits = 0;
+    map->tiles_x0 = map->tiles_y0 = map->tiles_nx = map->tiles_ny = 0;
+    map->tiles_allocated = 0;
+    map->block = NULL;
+    map->block_tiles = map->block_x0 = map->block_y0 = map->block_allocated = 0;
+    
+    map->size_pixels = size_pixels;
+    map->size_meters = size_meters;
+    
+    /* new to whoever displays it */
+    map_mark_dirty(map, 0, 0, size_pixels - 1, size_pixels - 1);
+    
+    map->scale_pixels_per_mm =  size_pixels / (size_meters * 1000);
+}
+
+void
+        map_init_tiled(
+        map_t * map,
+        int size_pixels,
+        double size_meters,
+        int tile_bits)
+{
+    map_clear_dirty(map);
+    
+    map->pixels = NULL;
+    map->external_pixels = 0;
+    map->tile_bits = tile_bits;
+    map->blank_tile = tile_alloc(map);
+    map->tiles_allocated = 0;
+    
+    /* the directory starts over the window */
+    map->tiles_x0 = map->tiles_y0 = 0;
+    map->tiles_nx = map->tiles_ny = (size_pixels + (1 << tile_bits) - 1) >> tile_bits;
+    map->tiles = (pixel_t **)safe_malloc(map->tiles_nx * map->tiles_ny * sizeof(pixel_t *));
+    
+    int k = 0;
+    for (k=0; k<map->tiles_nx*map->tiles_ny; ++k)
+    {
+        map->tiles[k] = map->blank_tile;
+    }
+    
+    /* so does the block, about as many pixels as a dense map, plus a spare one */
+    map->block_tiles = map->tiles_nx;
+    map->block_x0 = map->block_y0 = 0;
+    map->block_allocated = 0;
+    map->block = (pixel_t *)safe_malloc((map_block_pixels(map) + 1) * sizeof(pixel_t));
+    
+    size_t j = 0;
+    for (j=0; j<=map_block_pixels(map); ++j)
+    {
+        map->block[j] = UNKNOWN;
+    }
+    
+    map->size_pixels = size_pixels;
+    map->size_meters = size_meters;
+    
+    /* a new map is entirely dirty */
+    map_mark_dirty(map, 0, 0, size_pixels - 1, size_pixels - 1);
+    
+    map->scale_pixels_per_mm =  size_pixels / (size_meters * 1000);
+}
+
+void
+        map_free(
+        map_t * map)
+{
+    if (!map->external_pixels)
+    {
+        free(map->pixels);
+    }
+    
+    if (map->tiles)
+    {
+        int k = 0;
+        for (k=0; k<map->tiles_nx*map->tiles_ny; ++k)
+        {
+            /* tiles of the block live in it */
+            if (map->tiles[k] != map->blank_tile && !map_tile_in_block(map, map->tiles[k]))
+            {
+                free(map->tiles[k]);
+            }
+        }
+        
+        free(map->tiles);
+        free(map->blank_tile);
+        free(map->block);
+    }
+}
+
+void map_string(
+        map_t map,
+        char * str)
+{
+    if (map.tiles)
+    {
+        sprintf(str, "size = %d x %d pixels | = %f meters | %d tiles of %d x %d pixels",
+                map.size_pixels, map.size_pixels, map.size_meters, 
+                map.tiles_allocated, 1 << map.tile_bits, 1 << map.tile_bits);
+        return;
+    }
+    
+    sprintf(str, "size = %d x %d pixels | = %f meters",
+            map.size_pixels, map.size_pixels, map.size_meters);
+}
+
+void
+        map_update(
+        map_t * map,
+        scan_t * scan,
+        position_t position,
+        int map_quality,
+        double hole_width_mm)
+{
+    int rect[4];
+    
+    map_update_rect(map, scan, position, map_quality, hole_width_mm, rect);
+}
+
+int
+        map_update_rect(
+        map_t * map,
+        scan_t * scan,
+        position_t position,
+        int map_quality,
+        double hole_width_mm,
+        int * rect)
+{
+    
+    double position_theta_radians = radians(position.theta_degrees);
+    double costheta = cos(position_theta_radians);
+    double sintheta = sin(position_theta_radians);
+    
+    int x1 = roundup(position.x_mm * map->scale_pixels_per_mm);
+    int y1 = roundup(position.y_mm * map->scale_pixels_per_mm);
+    
+    if (map->tiles)
+    {
+        map_block_follow(map, x1, y1);
+    }
+    
+    /* rays starting outside a dense map are not drawn */
+    int x_min = INT_MAX;
+    int y_min = INT_MAX;
+    int x_max = INT_MIN;
+    int y_max = INT_MIN;
+    
+    int i = 0;
+    for (i = 0; i != scan->npoints; i++)
+    {        
+        double x2p = costheta * scan->x_mm[i] - sintheta * scan->y_mm[i];
+        double y2p = sintheta * scan->x_mm[i] + costheta * scan->y_mm[i];
+        
+        int xp = roundup((position.x_mm + x2p) * map->scale_pixels_per_mm);
+        int yp = roundup((position.y_mm + y2p) * map->scale_pixels_per_mm);
+        
+        double dist = sqrt(x2p * x2p + y2p * y2p);
+        double add = hole_width_mm / 2 / dist;
+        
+        x2p *= map->scale_pixels_per_mm * (1 + add);
+        y2p *= map->scale_pixels_per_mm * (1 + add);
+        
+        {  
+            int x2 = roundup(position.x_mm * map->scale_pixels_per_mm + x2p);
+            int y2 = roundup(position.y_mm * map->scale_pixels_per_mm + y2p);
+            
+            int value = OBSTACLE;
+            int q = map_quality;
+            
+            if (scan->value[i] == NO_OBSTACLE)
+            {
+                q = map_quality / 4;
+                value = NO_OBSTACLE;
+            }
+            
+            if (map->tiles)
+            {
+                map_laser_ray_tiled(map, x1, y1, x2, y2, xp, yp, value, q);
+                
+                if (x2 < x_min) x_min = x2;
+                if (y2 < y_min) y_min = y2;
+                if (x2 > x_max) x_max = x2;
+                if (y2 > y_max) y_max = y2;
+                
+                continue;
+            }
+            
+            map_laser_ray(map->pixels, map->size_pixels, x1, y1, x2, y2, xp, yp, value, q);
+            
+            /* the ray is clipped to the map, so its clamped end points bound the pixels it touched */
+            if (!out_of_bounds(x1, map->size_pixels) && !out_of_bounds(y1, map->size_pixels))
+            {
+                int x2c = clamp(x2, map->size_pixels);
+                int y2c = clamp(y2, map->size_pixels);
+                
+                if (x2c < x_min) x_min = x2c;
+                if (y2c < y_min) y_min = y2c;
+                if (x2c > x_max) x_max = x2c;
+                if (y2c > y_max) y_max = y2c;
+            }
+        }
+    }
+    
+    if (x_min <= x_max)
+    {
+        if (x1 < x_min) x_min = x1;
+        if (y1 < y_min) y_min = y1;
+        if (x1 > x_max) x_max = x1;
+        if (y1 > y_max) y_max = y1;
+        
+        map_mark_dirty(map, x_min, y_min, x_max, y_max);
+    }
+    
+    return rect_from_bounds(rect, x_min, y_min, x_max, y_max);
+}
+
+int
+        map_take_dirty(
+        map_t * map,
+        int * rect)
+{
+    int changed = rect_from_bounds(rect, map->dirty_x_min, map->dirty_y_min, map->dirty_x_max, map->dirty_y_max);
+    
+    map_clear_dirty(map);
+    
+    return changed;
+}
+
+void
+        map_get_rect(
+        map_t * map,
+        const int * rect,
+        pixel_t * pixels)
+{
+    int x = rect[0], width = rect[2];
+    
+    int y = 0;
+    for (y=rect[1]; y<rect[1]+rect[3]; ++y, pixels += width)
+    {
+        if (map->tiles)
+        {
+            map_get_row_tiled(map, x, y, width, pixels);
+            continue;
+        }
+        
+        /* the part of the row on the map */
+        int x0 = int_max(x, 0);
+        int x1 = int_min(x + width, map->size_pixels);
+        
+        if (out_of_bounds(y, map->size_pixels))
+        {
+            x1 = x0;
+        }
+        
+        int k = 0;
+        for (k=0; k<width; ++k)
+        {
+            pixels[k] = UNKNOWN;
+        }
+        
+        if (x0 < x1)
+        {
+            memcpy(pixels + x0 - x, map->pixels + y * map->size_pixels + x0, (x1 - x0) * sizeof(pixel_t));
+        }
+    }
+}
+
+int
+        map_bounds(
+        map_t * map,
+        int * rect)
+{
+    if (!map->tiles)
+    {
+        return rect_from_bounds(rect, 0, 0, map->size_pixels - 1, map->size_pixels - 1);
+    }
+    
+    int x_min = INT_MAX, y_min = INT_MAX, x_max = INT_MIN, y_max = INT_MIN;
+    
+    int tx = 0, ty = 0;
+    for (ty=0; ty<map->tiles_ny; ++ty)
+    {
+        for (tx=0; tx<map->tiles_nx; ++tx)
+        {
+            if (map->tiles[ty * map->tiles_nx + tx] != map->blank_tile)
+            {
+                x_min = int_min(x_min, tx);
+                y_min = int_min(y_min, ty);
+                x_max = int_max(x_max, tx);
+                y_max = int_max(y_max, ty);
+            }
+        }
+    }
+    
+    if (x_min > x_max)
+    {
+        return 0;
+    }
+    
+    int size = 1 << map->tile_bits;
+    
+    return rect_from_bounds(rect, 
+        (x_min + map->tiles_x0) * size, 
+        (y_min + map->tiles_y0) * size, 
+        (x_max + map->tiles_x0 + 1) * size - 1, 
+        (y_max + map->tiles_y0 + 1) * size - 1);
+}
+
+void
+        map_get(
+        map_t * map,
+        char * bytes)
+{
+    int k;
+    
+    if (map->tiles)
+    {
+        int rect[4] = {0, 0, map->size_pixels, map->size_pixels};
+        pixel_t * pixels = (pixel_t *)safe_malloc(map->size_pixels * map->size_pixels * sizeof(pixel_t));
+        
+        map_get_rect(map, rect, pixels);
+        
+        for (k=0; k<map->size_pixels*map->size_pixels; ++k)
+        {
+            bytes[k] = pixels[k] >> 8;
+        }
+        
+        free(pixels);
+        return;
+    }
+
+    for (k=0; k<map->size_pixels*map->size_pixels; ++k)
+    {
+        bytes[k] = map->pixels[k] >> 8;
+    }
+}
+
+
+void
+        map_set(
+        map_t * map,
+        char * bytes)
+{
+    int k;
+    
+    if (map->tiles)
+    {
+        pixel_t * pixels = (pixel_t *)safe_malloc(map->size_pixels * map->size_pixels * sizeof(pixel_t));
+        
+        for (k=0; k<map->size_pixels*map->size_pixels; ++k)
+        {
+            pixels[k] = bytes[k];
+            pixels[k] <<= 8;
+        }
+        
+        map_set_pixels(map, pixels);
+        
+        free(pixels);
+        return;
+    }
+    
+    for (k=0; k<map->size_pixels*map->size_pixels; ++k)
+    {
+        map->pixels[k] = bytes[k];
+        map->pixels[k] <<= 8;
+    }
+    
+    map_mark_dirty(map, 0, 0, map->size_pixels - 1, map->size_pixels - 1);
+}
+
+void
+        map_get_pixels(
+        map_t * map,
+        pixel_t * pixels)
+{
+    if (map->tiles)
+    {
+        int rect[4] = {0, 0, map->size_pixels, map->size_pixels};
+        map_get_rect(map, rect, pixels);
+        return;
+    }
+    
+    memcpy(pixels, map->pixels, map->size_pixels * map->size_pixels * sizeof(pixel_t));
+}
+
+void
+        map_set_pixels(
+        map_t * map,
+        const pixel_t * pixels)
+{
+    if (map->tiles)
+    {
+        map_set_pixels_tiled(map, pixels);
+    }
+    else
+    {
+        memcpy(map->pixels, pixels, map->size_pixels * map->size_pixels * sizeof(pixel_t));
+    }
+    
+    map_mark_dirty(map, 0, 0, map->size_pixels - 1, map->size_pixels - 1);
+}
+
+int 
+distance_scan_to_map_tiled(
+    map_t *  map,
+    scan_t * scan,
+    position_t position)
+{    
+    /* Pixel coordinates as in coreslam_sisd.c */
+    double position_theta_radians = radians(position.theta_degrees);
+    double costheta = cos(position_theta_radians) * map->scale_pixels_per_mm;
+    double sintheta = sin(position_theta_radians) * map->scale_pixels_per_mm;
+    
+    double pos_x_pix = position.x_mm * map->scale_pixels_per_mm;
+    double pos_y_pix = position.y_mm * map->scale_pixels_per_mm;
+    
+    int bits = map->tile_bits;
+    int mask = (1 << bits) - 1;
+    
+    int block_x = map->block_x0 << bits;
+    int block_y = map->block_y0 << bits;
+    int block_size = map->block_tiles << bits;
+    
+    int64_t sum = 0;
+    int npoints = 0;
+    
+    int i = 0;
+    for (i=0; i<scan->npoints; i++) 
+    {        
+        if (scan->value[i] == OBSTACLE)
+        {
+            int x = floor(pos_x_pix + costheta * scan->x_mm[i] - sintheta * scan->y_mm[i] + 0.5);
+            int y = floor(pos_y_pix + sintheta * scan->x_mm[i] + costheta * scan->y_mm[i] + 0.5);
+            
+            /* every point falls on the map, on unknown pixels outside the directory */
+            int bx = x - block_x;
+            int by = y - block_y;
+            int tx = (x >> bits) - map->tiles_x0;
+            int ty = (y >> bits) - map->tiles_y0;
+            
+            if (bx >= 0 && bx < block_size && by >= 0 && by < block_size)
+            {
+                sum += map->block[by * block_size + bx];
+            }
+            else
+            {
+                /* off the block, tiles are their own */
+                sum += (tx >= 0 && tx < map->tiles_nx && ty >= 0 && ty < map->tiles_ny) ?
+                    map->tiles[ty * map->tiles_nx + tx][((y & mask) << bits) + (x & mask)] : UNKNOWN;
+            }
+            
+            npoints++;
+        }
+    } 
+    
+    return npoints ? (int)(sum * 1024 / npoints) : -1;  
+}
+
+void scan_init(
+    scan_t * scan, 
+    int span,
+    int size,
+    double scan_rate_hz,                
+    double detection_angle_degrees,     
+    double distance_no_detection_mm,    
+    int detection_margin,               
+    double offset_mm)                  
+{
+    scan->x_mm = double_alloc(size*span);
+    scan->y_mm = double_alloc(size*span);
+    scan->value = int_alloc(size*span);
+    scan->span = span;
+
+    scan->size = size;
+    scan->rate_hz = scan_rate_hz;
+    scan->detection_angle_degrees = detection_angle_degrees;
+    scan->distance_no_detection_mm = distance_no_detection_mm;
+    scan->detection_margin = detection_margin;
+    scan->offset_mm = offset_mm;
+    
+    scan->npoints = 0;
+    scan->obst_npoints = 0;
+
+    /* for angle/distance interpolation */
+    interpolation_t * interp = (interpolation_t *)safe_malloc(sizeof(interpolation_t));
+    interp->angles = float_alloc(scan->size);
+    interp->distances = float_alloc(scan->size);
+    interp->angle_distance_pairs = (angle_distance_pair_t *)safe_malloc(size*sizeof(angle_distance_pair_t));
+    scan->interpolation = interp;
+    
+    /* assure size multiple of 4 for SSE */
+    scan->obst_x_mm = float_alloc(size*span+4);
+    scan->obst_y_mm = float_alloc(size*span+4);
+}
+
+
+void
+        scan_free(
+        scan_t * scan)
+{
+    free(scan->x_mm);
+    free(scan->y_mm);
+    free(scan->value);
+    
+    free(scan->obst_x_mm);
+    free(scan->obst_y_mm);
+
+    interpolation_t * interp = (interpolation_t *)scan->interpolation;
+    free(interp->angles);
+    free(interp->distances);
+    free(interp->angle_distance_pairs);
+    free(interp);
 }
 
 void scan_string(
         scan_t scan,
         char * str)
 {
-    sprintf(str, "%d obstacle points | %d free points", scan.obst_npoints, scan.npoints-scan.obst_npoints);
+    sprintf(str, "%d obstacle points | %d free points", scan.obst_npoints, scan.npoints-scan.obst_npoints);
+}
+
+void
+scan_update(
+        scan_t * scan,
+        float * lidar_angles_deg,
+        int *   lidar_distances_mm,
+        int     scan_size,
+        double  hole_width_mm,
+        double  velocities_dxy_mm,
+        double  velocities_dtheta_degrees)
+{    
+    /* interpolate scan distances by angles if indicated */
+    if (lidar_angles_deg) 
+    {
+        interpolate_scan(scan, lidar_angles_deg, lidar_distances_mm, scan_size);
+    }
+
+    /* Take velocity into account */
+    int degrees_per_second = (int)(scan->rate_hz * 360);
+    double horz_mm = velocities_dxy_mm / degrees_per_second;
+    double rotation = 1 + velocities_dtheta_degrees / degrees_per_second;
+    
+    /* Span the laser scans to better cover the space */
+    int i = 0;
+    
+    scan->npoints = 0;
+    scan->obst_npoints = 0;
+    
+    for (i=scan->detection_margin+1; i<scan->size-scan->detection_margin; ++i)
+    {
+        int lidar_value_mm = lidar_distances_mm[i];
+        
+        /* No obstacle */
+        if (lidar_value_mm == 0)
+        {
+            scan_update_xy(scan, i, (int)scan->distance_no_detection_mm, NO_OBSTACLE, horz_mm, rotation);
+        }
+        
+        /* Obstacle */
+        else if (lidar_value_mm > hole_width_mm / 2)
+        {
+            int oldstart = scan->npoints;
+         
+            int j = 0;
+            
+            scan_update_xy(scan, i, lidar_value_mm, OBSTACLE, horz_mm, rotation);
+            
+            /* Store obstacles separately for SSE */
+            for (j=oldstart; j<scan->npoints; ++j)
+            {
+                if (scan->value[j] == OBSTACLE)
+                {
+                    scan->obst_x_mm[scan->obst_npoints] = (float)scan->x_mm[j];
+                    scan->obst_y_mm[scan->obst_npoints] = (float)scan->y_mm[j];
+                    scan->obst_npoints++;
+                }
+            }
+        }
+    }
+}
+
+static position_t
+        rmhc_search_chain(
+        position_t start_pos,
+        map_t * map,
+        scan_t * scan,
+        double sigma_xy_mm,
+        double sigma_theta_degrees,
+        int max_search_iter,
+        void * randomizer,
+        int * best_distance)
+{
+    position_t currentpos = start_pos;
+    position_t bestpos = start_pos;
+    position_t lastbestpos = start_pos;
+    
+    int current_distance = distance_scan_to_map(map, scan, currentpos);
+    
+    int lowest_distance =  current_distance;
+    int last_lowest_distance = current_distance;
+    
+    int counter = 0;
+    
+    while (counter < max_search_iter)
+    {
+        currentpos = lastbestpos;
+        
+        currentpos.x_mm = random_normal(randomizer, currentpos.x_mm, sigma_xy_mm);
+        currentpos.y_mm = random_normal(randomizer, currentpos.y_mm, sigma_xy_mm);
+        currentpos.theta_degrees = random_normal(randomizer, currentpos.theta_degrees, sigma_theta_degrees);
+        
+        current_distance = distance_scan_to_map(map, scan, currentpos);
+        
+        /* -1 indicates infinity */
+        if ((current_distance > -1) && (current_distance < lowest_distance))
+        {
+            lowest_distance = current_distance;
+            bestpos = currentpos;
+        }
+        else
+        {
+            counter++;
+        }
+        
+        if (counter > max_search_iter / 3)
+        {
+            if (lowest_distance < last_lowest_distance)
+            {
+                lastbestpos = bestpos;
+                last_lowest_distance = lowest_distance;
+                counter = 0;
+                sigma_xy_mm *= 0.5;
+                sigma_theta_degrees *= 0.5;
+            }
+        }
+        
+    }
+    
+    *best_distance = lowest_distance;
+    
+    return bestpos;
+}
+
+position_t
+        rmhc_position_search(
+        position_t start_pos,
+        map_t * map,
+        scan_t * scan,
+        double sigma_xy_mm,
+        double sigma_theta_degrees,
+        int max_search_iter,
+        void * randomizer)
+{
+    int lowest_distance = 0;
+    
+    return rmhc_search_chain(start_pos, map, scan, sigma_xy_mm, sigma_theta_degrees, max_search_iter, 
+            randomizer, &lowest_distance);
+}
+
+/* Batch scoring: contiguous chunks of positions, one per thread ---------------------------------- */
+
+typedef struct distance_batch
+{
+    map_t * map;
+    scan_t * scan;
+    const double * positions;
+    int count;
+    int * distances;
+    
+} distance_batch_t;
+
+static void * distance_run_batch(void * arg)
+{
+    distance_batch_t * batch = (distance_batch_t *)arg;
+    
+    int k = 0;
+    for (k=0; k<batch->count; ++k)
+    {
+        position_t position;
+        
+        position.x_mm = batch->positions[3*k];
+        position.y_mm = batch->positions[3*k+1];
+        position.theta_degrees = batch->positions[3*k+2];
+        
+        batch->distances[k] = distance_scan_to_map(batch->map, batch->scan, position);
+    }
+    
+    return NULL;
+}
+
+void
+        distance_scan_to_map_batch(
+        map_t *  map,
+        scan_t * scan,
+        const double * positions,
+        int count,
+        int * distances,
+        int num_threads)
+{
+    if (num_threads > count)
+    {
+        num_threads = count;
+    }
+    
+    if (num_threads < 1)
+    {
+        num_threads = 1;
+    }
+    
+    distance_batch_t * batches = (distance_batch_t *)safe_malloc(num_threads * sizeof(distance_batch_t));
+    
+    int chunk = count / num_threads;
+    int extra = count % num_threads;
+    int first = 0;
+    
+    int k = 0;
+    for (k=0; k<num_threads; ++k)
+    {
+        distance_batch_t * batch = &batches[k];
+        
+        batch->map = map;
+        batch->scan = scan;
+        batch->count = chunk + (k < extra);
+        batch->positions = positions + 3 * first;
+        batch->distances = distances + first;
+        
+        first += batch->count;
+    }
+    
+#ifdef BREEZYSLAM_PTHREADS
+    pthread_t * threads = (pthread_t *)safe_malloc(num_threads * sizeof(pthread_t));
+    int * started = int_alloc(num_threads);
+    
+    /* As for RMHC chains: the calling thread scores the first chunk, and any it could not start a thread for */
+    for (k=1; k<num_threads; ++k)
+    {
+        started[k] = !pthread_create(&threads[k], NULL, distance_run_batch, &batches[k]);
+    }
+    
+    distance_run_batch(&batches[0]);
+    
+    for (k=1; k<num_threads; ++k)
+    {
+        if (started[k])
+        {
+            pthread_join(threads[k], NULL);
+        }
+        else
+        {
+            distance_run_batch(&batches[k]);
+        }
+    }
+    
+    free(started);
+    free(threads);
+#else
+    for (k=0; k<num_threads; ++k)
+    {
+        distance_run_batch(&batches[k]);
+    }
+#endif
+    
+    free(batches);
+}
+
+/* Parallel RMHC: independent chains, one per thread ---------------------------------------------- */
+
+typedef struct rmhc_chain
+{
+    position_t start_pos;
+    map_t * map;
+    scan_t * scan;
+    double sigma_xy_mm;
+    double sigma_theta_degrees;
+    int max_search_iter;
+    void * randomizer;
+    
+    position_t bestpos;
+    int lowest_distance;
+    
+} rmhc_chain_t;
+
+static void * rmhc_run_chain(void * arg)
+{
+    rmhc_chain_t * chain = (rmhc_chain_t *)arg;
+    
+    chain->bestpos = rmhc_search_chain(chain->start_pos, chain->map, chain->scan, 
+            chain->sigma_xy_mm, chain->sigma_theta_degrees, chain->max_search_iter, 
+            chain->randomizer, &chain->lowest_distance);
+    
+    return NULL;
+}
+
+position_t
+        rmhc_position_search_parallel(
+        position_t start_pos,
+        map_t * map,
+        scan_t * scan,
+        double sigma_xy_mm,
+        double sigma_theta_degrees,
+        int max_search_iter,
+        void * randomizer,
+        int num_threads)
+{
+    if (num_threads <= 1)
+    {
+        return rmhc_position_search(start_pos, map, scan, sigma_xy_mm, sigma_theta_degrees, 
+                max_search_iter, randomizer);
+    }
+    
+    rmhc_chain_t * chains = (rmhc_chain_t *)safe_malloc(num_threads * sizeof(rmhc_chain_t));
+    
+    /* Split the iteration budget so a search costs the same total work as a single chain */
+    int chain_iter = (max_search_iter + num_threads - 1) / num_threads;
+    
+    int k = 0;
+    for (k=0; k<num_threads; ++k)
+    {
+        rmhc_chain_t * chain = &chains[k];
+        
+        chain->start_pos = start_pos;
+        chain->map = map;
+        chain->scan = scan;
+        chain->sigma_xy_mm = sigma_xy_mm;
+        chain->sigma_theta_degrees = sigma_theta_degrees;
+        chain->max_search_iter = chain_iter;
+        
+        /* Seeds are drawn in order from the caller's generator, so results depend only on its seed 
+           and on the number of threads */
+        chain->randomizer = random_new((int)random_uint(randomizer));
+    }
+    
+#ifdef BREEZYSLAM_PTHREADS
+    pthread_t * threads = (pthread_t *)safe_malloc(num_threads * sizeof(pthread_t));
+    int * started = int_alloc(num_threads);
+    
+    /* The calling thread runs the first chain itself, and any chain it could not start a thread for */
+    for (k=1; k<num_threads; ++k)
+    {
+        started[k] = !pthread_create(&threads[k], NULL, rmhc_run_chain, &chains[k]);
+    }
+    
+    rmhc_run_chain(&chains[0]);
+    
+    for (k=1; k<num_threads; ++k)
+    {
+        if (started[k])
+        {
+            pthread_join(threads[k], NULL);
+        }
+        else
+        {
+            rmhc_run_chain(&chains[k]);
+        }
+    }
+    
+    free(started);
+    free(threads);
+#else
+    for (k=0; k<num_threads; ++k)
+    {
+        rmhc_run_chain(&chains[k]);
+    }
+#endif
+    
+    /* Keep the best chain; ties go to the lowest chain index */
+    int best = 0;
+    for (k=0; k<num_threads; ++k)
+    {
+        int distance = chains[k].lowest_distance;
+        int best_distance = chains[best].lowest_distance;
+        
+        if (distance > -1 && (best_distance == -1 || distance < best_distance))
+        {
+            best = k;
+        }
+        
+        random_free(chains[k].randomizer);
+    }
+    
+    position_t bestpos = chains[best].bestpos;
+    
+    free(chains);
+    
+    return bestpos;
+}
+
+/* Map pyramid ------------------------------------------------------------------------------------ */
+
+/* Value of pixels off the map: worse than any map pixel */
+static const int PYRAMID_OUTSIDE = 65535;
+
+static int pyramid_get(map_pyramid_t * pyramid, map_t * map, int level, int x, int y)
+{
+    if (level == 0)
+    {
+        return (x >= 0 && x < map->size_pixels && y >= 0 && y < map->size_pixels) ? 
+            map->pixels[y * map->size_pixels + x] : PYRAMID_OUTSIDE;
+    }
+    
+    if (x < -pyramid->padding || x >= pyramid->size_pixels || y < -pyramid->padding || y >= pyramid->size_pixels)
+    {
+        return PYRAMID_OUTSIDE;
+    }
+    
+    return pyramid->levels[level][(y + pyramid->padding) * pyramid->stride + x + pyramid->padding];
+}
+
+/* Row y of a level, indexed by x from -padding to size_pixels + padding - 1; rows off the map, and the 
+   padding around map rows, are PYRAMID_OUTSIDE. Map rows are copied into buffer for that. */
+static const pixel_t * pyramid_row(map_pyramid_t * pyramid, map_t * map, int level, int y, pixel_t * buffer)
+{
+    if (y < -pyramid->padding || y >= pyramid->size_pixels || (level == 0 && y < 0))
+    {
+        return pyramid->outside + pyramid->padding;
+    }
+    
+    if (level == 0)
+    {
+        memcpy(buffer + pyramid->padding, map->pixels + y * map->size_pixels, map->size_pixels * sizeof(pixel_t));
+        return buffer + pyramid->padding;
+    }
+    
+    return pyramid->levels[level] + (y + pyramid->padding) * pyramid->stride + pyramid->padding;
+}
+
+/* out[i] = min(a[i], b[i]): a loop the compiler vectorizes */
+static void pixel_min(pixel_t * restrict out, const pixel_t * restrict a, const pixel_t * restrict b, int count)
+{
+    int i = 0;
+    for (i=0; i<count; ++i)
+    {
+        out[i] = a[i] < b[i] ? a[i] : b[i];
+    }
+}
+
+static pixel_t * pyramid_row_alloc(map_pyramid_t * pyramid)
+{
+    pixel_t * row = (pixel_t *)safe_malloc(pyramid->stride * sizeof(pixel_t));
+    
+    int x = 0;
+    for (x=0; x<pyramid->stride; ++x)
+    {
+        row[x] = PYRAMID_OUTSIDE;
+    }
+    
+    return row;
+}
+
+void
+        map_pyramid_init(
+        map_pyramid_t * pyramid,
+        map_t * map,
+        int nlevels)
+{
+    pyramid->nlevels = nlevels < 1 ? 1 : nlevels;
+    pyramid->size_pixels = map->size_pixels;
+    pyramid->padding = (1 << (pyramid->nlevels - 1)) - 1;
+    pyramid->stride = pyramid->padding + pyramid->size_pixels + pyramid->padding;
+    
+    pyramid->levels = (pixel_t **)safe_malloc(pyramid->nlevels * sizeof(pixel_t *));
+    pyramid->levels[0] = NULL;
+    
+    int npix = (pyramid->padding + pyramid->size_pixels) * pyramid->stride;
+    
+    int k = 0;
+    for (k=1; k<pyramid->nlevels; ++k)
+    {
+        pyramid->levels[k] = (pixel_t *)safe_malloc(npix * sizeof(pixel_t));
+        
+        /* pixels whose window lies entirely off the map are never written */
+        int j = 0;
+        for (j=0; j<npix; ++j)
+        {
+            pyramid->levels[k][j] = PYRAMID_OUTSIDE;
+        }
+    }
+    
+    pyramid->outside = pyramid_row_alloc(pyramid);
+    
+    int j = 0;
+    for (j=0; j<3; ++j)
+    {
+        pyramid->rows[j] = pyramid_row_alloc(pyramid);
+    }
+    
+    int rect[4] = {0, 0, map->size_pixels, map->size_pixels};
+    map_pyramid_update(pyramid, map, rect);
 }
 
 void
-scan_update(
-        scan_t * scan,
-        float * lidar_angles_deg,
-        int *   lidar_distances_mm,
-        int     scan_size,
-        double  hole_width_mm,
-        double  velocities_dxy_mm,
-        double  velocities_dtheta_degrees)
-{    
-    /* interpolate scan distances by angles if indicated */
-    if (lidar_angles_deg) 
+        map_pyramid_free(
+        map_pyramid_t * pyramid)
+{
+    int k = 0;
+    for (k=1; k<pyramid->nlevels; ++k)
     {
-        interpolate_scan(scan, lidar_angles_deg, lidar_distances_mm, scan_size);
+        free(pyramid->levels[k]);
     }
-
-    /* Take velocity into account */
-    int degrees_per_second = (int)(scan->rate_hz * 360);
-    double horz_mm = velocities_dxy_mm / degrees_per_second;
-    double rotation = 1 + velocities_dtheta_degrees / degrees_per_second;
     
-    /* Span the laser scans to better cover the space */
-    int i = 0;
+    for (k=0; k<3; ++k)
+    {
+        free(pyramid->rows[k]);
+    }
     
-    scan->npoints = 0;
-    scan->obst_npoints = 0;
+    free(pyramid->outside);
+    free(pyramid->levels);
+}
+
+void
+        map_pyramid_update(
+        map_pyramid_t * pyramid,
+        map_t * map,
+        const int * rect)
+{
+    pixel_t * column_min = pyramid->rows[2] + pyramid->padding;
     
-    for (i=scan->detection_margin+1; i<scan->size-scan->detection_margin; ++i)
+    int k = 0;
+    for (k=1; k<pyramid->nlevels; ++k)
     {
-        int lidar_value_mm = lidar_distances_mm[i];
+        /* window of level k is two windows of level k-1 wide, so a pixel changes with any of the 
+           pixels up to 2^k - 1 to its right and below */
+        int half = 1 << (k - 1);
+        int reach = 2 * half - 1;
         
-        /* No obstacle */
-        if (lidar_value_mm == 0)
+        int x_min = int_max(rect[0] - reach, -reach);
+        int y_min = int_max(rect[1] - reach, -reach);
+        int x_max = int_min(rect[0] + rect[2], pyramid->size_pixels);
+        int y_max = int_min(rect[1] + rect[3], pyramid->size_pixels);
+        
+        /* min-pooling is separable: the lowest of each pair of rows half apart, then of each pair of those 
+           columns, a whole row at a time */
+        int y = 0;
+        for (y=y_min; y<y_max; ++y)
         {
-            scan_update_xy(scan, i, (int)scan->distance_no_detection_mm, NO_OBSTACLE, horz_mm, rotation);
+            const pixel_t * top = pyramid_row(pyramid, map, k-1, y, pyramid->rows[0]);
+            const pixel_t * bottom = pyramid_row(pyramid, map, k-1, y + half, pyramid->rows[1]);
+            pixel_t * level = pyramid->levels[k] + (y + pyramid->padding) * pyramid->stride + pyramid->padding;
+            
+            pixel_min(column_min + x_min, top + x_min, bottom + x_min, x_max + half - x_min);
+            pixel_min(level + x_min, column_min + x_min, column_min + x_min + half, x_max - x_min);
         }
-        
-        /* Obstacle */
-        else if (lidar_value_mm > hole_width_mm / 2)
+    }
+}
+
+/* Branch-and-bound search ------------------------------------------------------------------------ */
+
+typedef struct bnb_candidate
+{
+    int angle;
+    int dx;
+    int dy;
+    int64_t score;
+    
+} bnb_candidate_t;
+
+typedef struct bnb_search
+{
+    map_t * map;
+    map_pyramid_t * pyramid;
+    
+    /* scan obstacle points in map pixels, npoints per angle, for the start translation */
+    int * x;
+    int * y;
+    int npoints;
+    
+    int window;
+    
+    bnb_candidate_t best;
+    int scored;
+    
+} bnb_search_t;
+
+/* Sum of the level's values under the points: a lower bound of the map score for every translation 
+   (dx .. dx + 2^level - 1, dy .. dy + 2^level - 1) */
+static int64_t bnb_score(bnb_search_t * search, int level, int angle, int dx, int dy)
+{
+    int * x = search->x + angle * search->npoints;
+    int * y = search->y + angle * search->npoints;
+    
+    int64_t sum = 0;
+    
+    int i = 0;
+    for (i=0; i<search->npoints; ++i)
+    {
+        sum += pyramid_get(search->pyramid, search->map, level, x[i] + dx, y[i] + dy);
+    }
+    
+    search->scored++;
+    
+    return sum;
+}
+
+static int bnb_candidate_compar(const void * v1, const void * v2)
+{
+    const bnb_candidate_t * c1 = (const bnb_candidate_t *)v1;
+    const bnb_candidate_t * c2 = (const bnb_candidate_t *)v2;
+    
+    if (c1->score != c2->score)
+    {
+        return c1->score < c2->score ? -1 : +1;
+    }
+    
+    /* deterministic order for ties */
+    if (c1->angle != c2->angle)
+    {
+        return c1->angle - c2->angle;
+    }
+    
+    return c1->dy != c2->dy ? c1->dy - c2->dy : c1->dx - c2->dx;
+}
+
+static void bnb_branch(bnb_search_t * search, bnb_candidate_t candidate, int level)
+{
+    /* bound: nothing under this candidate can beat the best position so far */
+    if (candidate.score >= search->best.score)
+    {
+        return;
+    }
+    
+    if (level == 0)
+    {
+        search->best = candidate;
+        return;
+    }
+    
+    int half = 1 << (level - 1);
+    
+    bnb_candidate_t children[4];
+    int nchildren = 0;
+    
+    int i = 0, j = 0;
+    for (j=0; j<2; ++j)
+    {
+        for (i=0; i<2; ++i)
         {
-            int oldstart = scan->npoints;
-         
-            int j = 0;
+            bnb_candidate_t child = candidate;
             
-            scan_update_xy(scan, i, lidar_value_mm, OBSTACLE, horz_mm, rotation);
+            child.dx += i * half;
+            child.dy += j * half;
             
-            /* Store obstacles separately for SSE */
-            for (j=oldstart; j<scan->npoints; ++j)
+            if (child.dx <= search->window && child.dy <= search->window)
             {
-                if (scan->value[j] == OBSTACLE)
-                {
-                    scan->obst_x_mm[scan->obst_npoints] = (float)scan->x_mm[j];
-                    scan->obst_y_mm[scan->obst_npoints] = (float)scan->y_mm[j];
-                    scan->obst_npoints++;
-                }
+                child.score = bnb_score(search, level-1, child.angle, child.dx, child.dy);
+                children[nchildren++] = child;
             }
         }
     }
+    
+    qsort(children, nchildren, sizeof(bnb_candidate_t), bnb_candidate_compar);
+    
+    for (i=0; i<nchildren; ++i)
+    {
+        bnb_branch(search, children[i], level-1);
+    }
 }
 
 position_t
-        rmhc_position_search(
+        bnb_position_search(
         position_t start_pos,
         map_t * map,
+        map_pyramid_t * pyramid,
         scan_t * scan,
-        double sigma_xy_mm,
-        double sigma_theta_degrees,
-        int max_search_iter,
-        void * randomizer)
+        double window_xy_mm,
+        double window_theta_degrees,
+        double step_theta_degrees,
+        int * candidates_scored)
 {
-    position_t currentpos = start_pos;
-    position_t bestpos = start_pos;
-    position_t lastbestpos = start_pos;
+    bnb_search_t search;
     
-    int current_distance = distance_scan_to_map(map, scan, currentpos);
+    search.map = map;
+    search.pyramid = pyramid;
+    search.window = (int)(window_xy_mm * map->scale_pixels_per_mm);
+    search.scored = 0;
     
-    int lowest_distance =  current_distance;
-    int last_lowest_distance = current_distance;
+    /* Obstacle points, and the farthest one for the default angular step */
+    double * obst_x_mm = double_alloc(scan->npoints);
+    double * obst_y_mm = double_alloc(scan->npoints);
+    double max_distance_mm = 0;
     
-    int counter = 0;
+    search.npoints = 0;
     
-    while (counter < max_search_iter)
+    int i = 0;
+    for (i=0; i<scan->npoints; ++i)
     {
-        currentpos = lastbestpos;
+        if (scan->value[i] == OBSTACLE)
+        {
+            obst_x_mm[search.npoints] = scan->x_mm[i];
+            obst_y_mm[search.npoints] = scan->y_mm[i];
+            search.npoints++;
+            
+            max_distance_mm = fmax(max_distance_mm, hypot(scan->x_mm[i], scan->y_mm[i]));
+        }
+    }
+    
+    if (step_theta_degrees <= 0)
+    {
+        double pixel_mm = 1 / map->scale_pixels_per_mm;
         
-        currentpos.x_mm = random_normal(randomizer, currentpos.x_mm, sigma_xy_mm);
-        currentpos.y_mm = random_normal(randomizer, currentpos.y_mm, sigma_xy_mm);
-        currentpos.theta_degrees = random_normal(randomizer, currentpos.theta_degrees, sigma_theta_degrees);
+        step_theta_degrees = max_distance_mm > pixel_mm ? 
+            acos(1 - pixel_mm * pixel_mm / (2 * max_distance_mm * max_distance_mm)) * 180 / M_PI : 
+            window_theta_degrees;
+    }
+    
+    int angle_steps = step_theta_degrees > 0 ? (int)(window_theta_degrees / step_theta_degrees) : 0;
+    int nangles = 2 * angle_steps + 1;
+    
+    /* Discretize the scan once per angle, as distance_scan_to_map() does for a position; translating by 
+       whole pixels then just offsets these */
+    search.x = int_alloc(nangles * search.npoints);
+    search.y = int_alloc(nangles * search.npoints);
+    
+    double pos_x_pix = start_pos.x_mm * map->scale_pixels_per_mm;
+    double pos_y_pix = start_pos.y_mm * map->scale_pixels_per_mm;
+    
+    int a = 0;
+    for (a=0; a<nangles; ++a)
+    {
+        double theta_radians = radians(start_pos.theta_degrees + (a - angle_steps) * step_theta_degrees);
+        double costheta = cos(theta_radians) * map->scale_pixels_per_mm;
+        double sintheta = sin(theta_radians) * map->scale_pixels_per_mm;
         
-        current_distance = distance_scan_to_map(map, scan, currentpos);
+        for (i=0; i<search.npoints; ++i)
+        {
+            search.x[a * search.npoints + i] = 
+                floor(pos_x_pix + costheta * obst_x_mm[i] - sintheta * obst_y_mm[i] + 0.5);
+            search.y[a * search.npoints + i] = 
+                floor(pos_y_pix + sintheta * obst_x_mm[i] + costheta * obst_y_mm[i] + 0.5);
+        }
+    }
+    
+    free(obst_x_mm);
+    free(obst_y_mm);
+    
+    /* Start from the starting position, so only strictly better positions replace it */
+    search.best.angle = angle_steps;
+    search.best.dx = 0;
+    search.best.dy = 0;
+    search.best.score = bnb_score(&search, 0, angle_steps, 0, 0);
+    
+    /* Coarsest level whose windows still cover the search window in a few steps */
+    int level = 0;
+    while (level < pyramid->nlevels - 1 && (1 << level) < 2 * search.window + 1)
+    {
+        level++;
+    }
+    
+    int size = 1 << level;
+    int per_angle = (2 * search.window) / size + 1;
+    int ncandidates = nangles * per_angle * per_angle;
+    
+    bnb_candidate_t * candidates = (bnb_candidate_t *)safe_malloc(ncandidates * sizeof(bnb_candidate_t));
+    
+    int k = 0;
+    for (a=0; a<nangles; ++a)
+    {
+        int dx = 0, dy = 0;
+        for (dy=-search.window; dy<=search.window; dy+=size)
+        {
+            for (dx=-search.window; dx<=search.window; dx+=size)
+            {
+                candidates[k].angle = a;
+                candidates[k].dx = dx;
+                candidates[k].dy = dy;
+                candidates[k].score = bnb_score(&search, level, a, dx, dy);
+                k++;
+            }
+        }
+    }
+    
+    qsort(candidates, ncandidates, sizeof(bnb_candidate_t), bnb_candidate_compar);
+    
+    for (k=0; k<ncandidates; ++k)
+    {
+        bnb_branch(&search, candidates[k], level);
+    }
+    
+    free(candidates);
+    free(search.x);
+    free(search.y);
+    
+    if (candidates_scored)
+    {
+        *candidates_scored = search.scored;
+    }
+    
+    position_t bestpos = start_pos;
+    
+    bestpos.x_mm += search.best.dx / map->scale_pixels_per_mm;
+    bestpos.y_mm += search.best.dy / map->scale_pixels_per_mm;
+    bestpos.theta_degrees += (search.best.angle - angle_steps) * step_theta_degrees;
+    
+    return bestpos;
+}
+
+/* Particle sets ---------------------------------------------------------------------------------- */
+
+void
+        particles_predict(
+        double * particles,
+        int count,
+        double dxy_mm,
+        double dtheta_degrees,
+        double offset_mm,
+        double sigma_xy_mm,
+        double sigma_theta_degrees,
+        void * randomizer)
+{
+    int k = 0;
+    for (k=0; k<count; ++k)
+    {
+        double * particle = particles + 3 * k;
         
-        /* -1 indicates infinity */
-        if ((current_distance > -1) && (current_distance < lowest_distance))
+        double theta_radians = radians(particle[2]);
+        
+        /* laser -> center of rotation, motion, then back to the laser */
+        double x_mm = particle[0] - offset_mm * cos(theta_radians);
+        double y_mm = particle[1] - offset_mm * sin(theta_radians);
+        
+        x_mm += dxy_mm * cos(theta_radians);
+        y_mm += dxy_mm * sin(theta_radians);
+        
+        double theta_degrees = random_normal(randomizer, particle[2] + dtheta_degrees, sigma_theta_degrees);
+        theta_radians = radians(theta_degrees);
+        
+        particle[0] = random_normal(randomizer, x_mm + offset_mm * cos(theta_radians), sigma_xy_mm);
+        particle[1] = random_normal(randomizer, y_mm + offset_mm * sin(theta_radians), sigma_xy_mm);
+        particle[2] = theta_degrees;
+    }
+}
+
+double
+        particles_weigh(
+        const int * distances,
+        double * weights,
+        int count,
+        double temperature)
+{
+    int lowest = -1;
+    
+    int k = 0;
+    for (k=0; k<count; ++k)
+    {
+        if (distances[k] > -1 && (lowest == -1 || distances[k] < lowest))
         {
-            lowest_distance = current_distance;
-            bestpos = currentpos;
+            lowest = distances[k];
         }
-        else
+    }
+    
+    double total = 0;
+    
+    for (k=0; k<count; ++k)
+    {
+        /* relative to the best particle, so the best likelihood is 1 and nothing underflows all at once */
+        weights[k] *= distances[k] > -1 ? exp(-(distances[k] - lowest) / temperature) : 0;
+        total += weights[k];
+    }
+    
+    double sum_squares = 0;
+    
+    for (k=0; k<count; ++k)
+    {
+        weights[k] = total > 0 ? weights[k] / total : 1. / count;
+        sum_squares += weights[k] * weights[k];
+    }
+    
+    return sum_squares > 0 ? 1 / sum_squares : 0;
+}
+
+void
+        particles_resample(
+        double * particles,
+        double * weights,
+        int count,
+        void * randomizer)
+{
+    if (count < 1)
+    {
+        return;
+    }
+    
+    double * resampled = double_alloc(3 * count);
+    
+    double step = 1. / count;
+    double target = random_uniform(randomizer) * step;
+    double cumulative = weights[0];
+    
+    int source = 0;
+    int k = 0;
+    for (k=0; k<count; ++k)
+    {
+        while (target > cumulative && source < count - 1)
         {
-            counter++;
+            source++;
+            cumulative += weights[source];
         }
         
-        if (counter > max_search_iter / 3)
+        memcpy(resampled + 3 * k, particles + 3 * source, 3 * sizeof(double));
+        
+        target += step;
+    }
+    
+    memcpy(particles, resampled, 3 * count * sizeof(double));
+    
+    for (k=0; k<count; ++k)
+    {
+        weights[k] = step;
+    }
+    
+    free(resampled);
+}
+
+position_t
+        particles_estimate(
+        const double * particles,
+        const double * weights,
+        int count,
+        int mean)
+{
+    position_t estimate = {0, 0, 0};
+    
+    if (count < 1)
+    {
+        return estimate;
+    }
+    
+    int k = 0;
+    
+    if (!mean)
+    {
+        int best = 0;
+        for (k=1; k<count; ++k)
         {
-            if (lowest_distance < last_lowest_distance)
+            if (weights[k] > weights[best])
             {
-                lastbestpos = bestpos;
-                last_lowest_distance = lowest_distance;
-                counter = 0;
-                sigma_xy_mm *= 0.5;
-                sigma_theta_degrees *= 0.5;
+                best = k;
             }
         }
         
+        estimate.x_mm = particles[3 * best];
+        estimate.y_mm = particles[3 * best + 1];
+        estimate.theta_degrees = particles[3 * best + 2];
+        
+        return estimate;
     }
     
-    return bestpos;
+    double cos_sum = 0, sin_sum = 0;
+    
+    for (k=0; k<count; ++k)
+    {
+        const double * particle = particles + 3 * k;
+        
+        estimate.x_mm += weights[k] * particle[0];
+        estimate.y_mm += weights[k] * particle[1];
+        
+        cos_sum += weights[k] * cos(radians(particle[2]));
+        sin_sum += weights[k] * sin(radians(particle[2]));
+    }
+    
+    /* keep theta near the first particle's, since headings accumulate past +/-180 */
+    double theta_degrees = atan2(sin_sum, cos_sum) * 180 / M_PI;
+    estimate.theta_degrees = theta_degrees + 360 * floor((particles[2] - theta_degrees) / 360 + 0.5);
+    
+    return estimate;
 }
@@ -48,8 +48,40 @@ typedef struct map_t {
     int size_pixels;
     double size_meters;
     
+    /* the pixels belong to the caller (see map_init_external()), map_free() leaves them */
+    int external_pixels;
+    
     double scale_pixels_per_mm;
     
+    /* bounding box of pixels changed since the last map_take_dirty(); empty when min > max */
+    int dirty_x_min;
+    int dirty_y_min;
+    int dirty_x_max;
+    int dirty_y_max;
+    
+    /* Tiled maps (see map_init_tiled()) have no pixels array but a directory of tiles, 2^tile_bits pixels
+       square, covering tiles [tiles_x0, tiles_x0 + tiles_nx) x [tiles_y0, tiles_y0 + tiles_ny). Tiles never
+       written point to blank_tile, whose pixels are all unknown; tiles is NULL for dense maps. Each tile has
+       one spare pixel at its end, so that kernels may read 32 bits at its last pixel. */
+    pixel_t ** tiles;
+    pixel_t * blank_tile;
+    int tile_bits;
+    int tiles_x0;
+    int tiles_y0;
+    int tiles_nx;
+    int tiles_ny;
+    int tiles_allocated;
+    
+    /* Written tiles from tile (block_x0, block_y0) to block_tiles tiles on live in the block, pixels laid out
+       as in a dense map, with one spare pixel at its end, instead of on their own: kernels index them there as
+       they index a dense map. Unwritten tiles of the block read as unknown there too. map_update() moves the
+       block to keep the robot near its middle; block_allocated of the written tiles are in it. */
+    pixel_t * block;
+    int block_tiles;
+    int block_x0;
+    int block_y0;
+    int block_allocated;
+    
 } map_t;
 
 
@@ -78,6 +110,24 @@ typedef struct scan_t
         
 } scan_t;
 
+/* Map pyramid for branch-and-bound search: level k holds, for each pixel (x, y), the lowest (best-matching)
+   map value over the 2^k x 2^k pixels starting there. Levels are padded by 2^(nlevels-1) - 1 pixels before
+   the first row and column, for windows that start outside the map, and after the last column, for windows 
+   that end outside it; level 0 is the map itself. */
+typedef struct map_pyramid_t
+{
+    pixel_t ** levels;
+    int nlevels;
+    int size_pixels;
+    int padding;
+    int stride;
+    
+    /* a row of pixels off the map, and row buffers for map_pyramid_update() */
+    pixel_t * outside;
+    pixel_t * rows[3];
+
+} map_pyramid_t;
+
 /* Exported functions ------------------------------------------------------- */
 
 #ifdef __cplusplus 
@@ -99,6 +149,26 @@ map_init(
     int size_pixels, 
     double size_meters);
 
+/* A map whose pixels are allocated one tile at a time, when a scan first touches them: it covers any pixel
+   coordinate, negative or beyond size_pixels, which then only sets the scale and the window that map_get()
+   and map_set() use. Pixels never written read as unknown, (OBSTACLE + NO_OBSTACLE) / 2, and
+   distance_scan_to_map() counts scan points on them as it does for unknown pixels of a dense map. */
+void 
+map_init_tiled(
+    map_t * map, 
+    int size_pixels, 
+    double size_meters,
+    int tile_bits);
+
+/* A dense map working directly on size_pixels * size_pixels pixels the caller owns, e.g. a memory-mapped file,
+   without initializing or copying them. They must outlive the map. */
+void 
+map_init_external(
+    map_t * map, 
+    int size_pixels, 
+    double size_meters,
+    pixel_t * pixels);
+
 void
 map_free(
     map_t * map);
@@ -115,6 +185,24 @@ map_update(
     int map_quality, 
     double hole_width_mm);
 
+/* Like map_update(), also filling rect with the (x, y, width, height) box of pixels this update touched.
+   Returns 0 if the update touched no pixels. */
+int
+map_update_rect(
+    map_t * map, 
+    scan_t * scan, 
+    position_t position,
+    int map_quality, 
+    double hole_width_mm,
+    int * rect);
+
+/* Fills rect with the (x, y, width, height) box of pixels changed since the previous call and clears it.
+   Returns 0 if no pixels changed. */
+int
+map_take_dirty(
+    map_t * map,
+    int * rect);
+
 void scan_init(
     scan_t * scan, 
     int span,
@@ -152,6 +240,32 @@ void
 map_set(
     map_t * map, 
     char * bytes);
+
+/* Copies the raw pixels of the (x, y, width, height) box rect, row by row, into pixels; pixels off a dense
+   map, or never written in a tiled one, read as unknown */
+void
+map_get_rect(
+    map_t * map, 
+    const int * rect,
+    pixel_t * pixels);
+
+/* Fills rect with the (x, y, width, height) box of tiles allocated so far, in pixels, or of the whole map
+   for a dense map. Returns 0 for a tiled map that has no tiles yet. */
+int
+map_bounds(
+    map_t * map,
+    int * rect);
+
+/* Copies the raw pixels, size_pixels * size_pixels of them */
+void
+map_get_pixels(
+    map_t * map, 
+    pixel_t * pixels);
+
+void
+map_set_pixels(
+    map_t * map, 
+    const pixel_t * pixels);
     
 /* Returns -1 for infinity */
 int 
@@ -160,6 +274,45 @@ distance_scan_to_map(
     scan_t * scan,
     position_t position);
 
+/* The portable kernel behind distance_scan_to_map() for tiled maps, in coreslam.c */
+int 
+distance_scan_to_map_tiled(
+    map_t *  map,
+    scan_t * scan,
+    position_t position);
+
+/* The portable kernel behind distance_scan_to_map(), in coreslam_sisd.c */
+int 
+distance_scan_to_map_sisd(
+    map_t *  map,
+    scan_t * scan,
+    position_t position);
+
+/* Builds compiled with BREEZYSLAM_KERNEL_DISPATCH (coreslam_x86_64.c) pick the distance_scan_to_map() kernel
+   at run time. Returns the names of the kernels this CPU can run, slowest first, NULL-terminated */
+const char ** 
+distance_kernels(void);
+
+/* Selects a kernel by name, or the fastest one for NULL; returns 0 if this CPU cannot run it. Not thread-safe:
+   select before scoring positions */
+int 
+distance_kernel_select(
+    const char * name);
+
+const char * 
+distance_kernel(void);
+
+/* Scores count positions, given as consecutive (x_mm, y_mm, theta_degrees) triples, into distances
+   (-1 for infinity), splitting them into contiguous chunks over num_threads threads */
+void
+distance_scan_to_map_batch(
+    map_t *  map,
+    scan_t * scan,
+    const double * positions,
+    int count,
+    int * distances,
+    int num_threads);
+
 
 /* Random-Mutation Hill-Climbing search */
 position_t 
@@ -172,6 +325,95 @@ rmhc_position_search(
 	int max_search_iter,
 	void * randomizer);
 
+/* Runs num_threads independent RMHC chains in parallel, each with its own generator seeded from
+   randomizer and an equal share of max_search_iter, and returns the best position found.
+   Deterministic for a given randomizer seed and num_threads; num_threads <= 1 is rmhc_position_search(). */
+position_t 
+rmhc_position_search_parallel(
+    position_t start_pos,
+	map_t * map,
+    scan_t * scan,
+	double sigma_xy_mm,
+	double sigma_theta_degrees,
+	int max_search_iter,
+	void * randomizer,
+    int num_threads);
+
+void
+map_pyramid_init(
+    map_pyramid_t * pyramid,
+    map_t * map,
+    int nlevels);
+
+void
+map_pyramid_free(
+    map_pyramid_t * pyramid);
+
+/* Brings the pyramid up to date after the map changed inside rect (x, y, width, height) */
+void
+map_pyramid_update(
+    map_pyramid_t * pyramid,
+    map_t * map,
+    const int * rect);
+
+/* Exact branch-and-bound search for the position minimizing the summed map values under the scan's
+   obstacle points (points off the map count as 65535), over translations of whole pixels up to
+   window_xy_mm and rotations by multiples of step_theta_degrees up to window_theta_degrees.
+   step_theta_degrees <= 0 picks the step that moves the farthest point by one pixel.
+   Keeps start_pos unless a strictly better position is found; candidates_scored may be NULL. */
+position_t
+bnb_position_search(
+    position_t start_pos,
+    map_t * map,
+    map_pyramid_t * pyramid,
+    scan_t * scan,
+    double window_xy_mm,
+    double window_theta_degrees,
+    double step_theta_degrees,
+    int * candidates_scored);
+
+/* Particle sets: count (x_mm, y_mm, theta_degrees) triples, each a laser position, with one weight each */
+
+/* Moves every particle by the odometry (dxy_mm forward, then dtheta_degrees) of a robot whose laser is 
+   offset_mm ahead of its center of rotation, plus normal noise of sigma_xy_mm and sigma_theta_degrees */
+void
+particles_predict(
+    double * particles,
+    int count,
+    double dxy_mm,
+    double dtheta_degrees,
+    double offset_mm,
+    double sigma_xy_mm,
+    double sigma_theta_degrees,
+    void * randomizer);
+
+/* Multiplies the weights by the likelihoods exp(-(distance - lowest distance) / temperature), a distance
+   of -1 giving 0, and normalizes them; starts over from equal weights if all become 0. 
+   Returns the effective number of particles, 1 / sum of squared weights. */
+double
+particles_weigh(
+    const int * distances,
+    double * weights,
+    int count,
+    double temperature);
+
+/* Low-variance (systematic) resampling: draws count particles in proportion to their weights using a 
+   single random number, and resets the weights to 1 / count */
+void
+particles_resample(
+    double * particles,
+    double * weights,
+    int count,
+    void * randomizer);
+
+/* Weighted mean of the particles (circular mean for theta) if mean is true, else the heaviest particle */
+position_t
+particles_estimate(
+    const double * particles,
+    const double * weights,
+    int count,
+    int mean);
+
 #ifdef __cplusplus 
 }
 #endif
@@ -59,6 +59,11 @@ distance_scan_to_map(
 		scan_t * scan,
 		position_t position)
 {    
+    if (map->tiles)
+    {
+        return distance_scan_to_map_tiled(map, scan, position);
+    }
+    
     /* Pre-compute sine and cosine of angle for rotation */
     double position_theta_radians = radians(position.theta_degrees);
     double costheta = cos(position_theta_radians) * map->scale_pixels_per_mm;
@@ -66,6 +66,11 @@ distance_scan_to_map(
     scan_t * scan,
     position_t position)
 {    
+    if (map->tiles)
+    {
+        return distance_scan_to_map_tiled(map, scan, position);
+    }
+    
     int npoints = 0; /* number of points where scan matches map */
     int64_t sum = 0; /* sum of map values at those points */
     
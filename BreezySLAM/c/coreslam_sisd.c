@@ -28,8 +28,9 @@ along with this code.  If not, see <http:#www.gnu.org/licenses/>.
 #include "coreslam.h"
 #include "coreslam_internals.h"
 
+/* The reference kernel: the other kernels of a build with runtime dispatch must return the same scores */
 int 
-distance_scan_to_map(
+distance_scan_to_map_sisd(
     map_t *  map,
     scan_t * scan,
     position_t position)
@@ -68,3 +69,18 @@ distance_scan_to_map(
     /* Return sum scaled by number of points, or -1 if none */
     return npoints ? (int)(sum * 1024 / npoints) : -1;  
 }
+
+#ifndef BREEZYSLAM_KERNEL_DISPATCH
+
+int 
+distance_scan_to_map(
+    map_t *  map,
+    scan_t * scan,
+    position_t position)
+{
+    return map->tiles ? 
+        distance_scan_to_map_tiled(map, scan, position) : 
+        distance_scan_to_map_sisd(map, scan, position);
+}
+
+#endif
@@ -0,0 +1,583 @@
+/*
+coreslam_x86_64.c AVX2 and AVX-512 kernels for CoreSLAM, picked at run time
+
+Each kernel computes pixel coordinates exactly as coreslam_sisd.c does, in double precision and with the same
+order of operations, so all kernels return identical scores. Map pixels are fetched with gathers of 32-bit
+words at 16-bit steps, keeping the low half. Tiled maps gather from their block as from a dense map, and
+take one more gather, of tile pointers, off it.
+
+Copyright (C) 2014 Simon D. Levy
+
+This code is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This code is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this code.  If not, see <http:#www.gnu.org/licenses/>.
+
+*/
+
+
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include <immintrin.h>
+
+#include "coreslam.h"
+#include "coreslam_internals.h"
+
+typedef int (*distance_kernel_t)(map_t *, scan_t *, position_t);
+
+/* Adds the scan point at i to sum and npoints, as coreslam_sisd.c does */
+static void
+add_point(
+    map_t * map,
+    scan_t * scan,
+    int i,
+    double pos_x_pix,
+    double pos_y_pix,
+    double costheta,
+    double sintheta,
+    int64_t * sum,
+    int * npoints)
+{
+    if (scan->value[i] == OBSTACLE)
+    {
+        int x = floor(pos_x_pix + costheta * scan->x_mm[i] - sintheta * scan->y_mm[i] + 0.5);
+        int y = floor(pos_y_pix + sintheta * scan->x_mm[i] + costheta * scan->y_mm[i] + 0.5);
+
+        if (x >= 0 && x < map->size_pixels && y >= 0 && y < map->size_pixels)
+        {
+            *sum += map->pixels[y * map->size_pixels + x];
+            (*npoints)++;
+        }
+    }
+}
+
+/* The kernels are compiled for their own instruction sets only, without FMA, so that the compiler cannot fuse
+   the multiplies and additions and round differently from coreslam_sisd.c */
+
+__attribute__((target("avx2")))
+static int
+distance_scan_to_map_avx2(
+    map_t *  map,
+    scan_t * scan,
+    position_t position)
+{
+    double position_theta_radians = radians(position.theta_degrees);
+    double costheta = cos(position_theta_radians) * map->scale_pixels_per_mm;
+    double sintheta = sin(position_theta_radians) * map->scale_pixels_per_mm;
+
+    double pos_x_pix = position.x_mm * map->scale_pixels_per_mm;
+    double pos_y_pix = position.y_mm * map->scale_pixels_per_mm;
+
+    __m256d pos_x = _mm256_set1_pd(pos_x_pix);
+    __m256d pos_y = _mm256_set1_pd(pos_y_pix);
+    __m256d cos4 = _mm256_set1_pd(costheta);
+    __m256d sin4 = _mm256_set1_pd(sintheta);
+    __m256d half = _mm256_set1_pd(0.5);
+
+    __m128i size = _mm_set1_epi32(map->size_pixels);
+    __m128i minus_one = _mm_set1_epi32(-1);
+    __m128i obstacle = _mm_set1_epi32(OBSTACLE);
+    __m128i low_half = _mm_set1_epi32(0xFFFF);
+
+    /* A 32-bit gather at the last pixel would read past the map: that one is added separately */
+    int last = map->size_pixels * map->size_pixels - 1;
+    __m128i last4 = _mm_set1_epi32(last);
+    int nlast = 0;
+
+    __m256i sum4 = _mm256_setzero_si256();
+    int64_t sum = 0;
+    int npoints = 0;
+
+    int i = 0;
+    for (i=0; i+4<=scan->npoints; i+=4)
+    {
+        __m256d x_mm = _mm256_loadu_pd(scan->x_mm + i);
+        __m256d y_mm = _mm256_loadu_pd(scan->y_mm + i);
+
+        __m256d x_pix = _mm256_add_pd(
+            _mm256_sub_pd(_mm256_add_pd(pos_x, _mm256_mul_pd(cos4, x_mm)), _mm256_mul_pd(sin4, y_mm)), half);
+        __m256d y_pix = _mm256_add_pd(
+            _mm256_add_pd(_mm256_add_pd(pos_y, _mm256_mul_pd(sin4, x_mm)), _mm256_mul_pd(cos4, y_mm)), half);
+
+        __m128i x = _mm256_cvttpd_epi32(_mm256_floor_pd(x_pix));
+        __m128i y = _mm256_cvttpd_epi32(_mm256_floor_pd(y_pix));
+
+        __m128i valid = _mm_cmpeq_epi32(_mm_loadu_si128((const __m128i *)(scan->value + i)), obstacle);
+        valid = _mm_and_si128(valid, _mm_and_si128(_mm_cmpgt_epi32(x, minus_one), _mm_cmpgt_epi32(size, x)));
+        valid = _mm_and_si128(valid, _mm_and_si128(_mm_cmpgt_epi32(y, minus_one), _mm_cmpgt_epi32(size, y)));
+
+        __m128i index = _mm_add_epi32(_mm_mullo_epi32(y, size), x);
+        __m128i at_last = _mm_and_si128(valid, _mm_cmpeq_epi32(index, last4));
+
+        __m128i pixels = _mm_mask_i32gather_epi32(
+            _mm_setzero_si128(), (const int *)map->pixels, index, _mm_andnot_si128(at_last, valid), 2);
+
+        sum4 = _mm256_add_epi64(sum4, _mm256_cvtepu32_epi64(_mm_and_si128(pixels, low_half)));
+
+        npoints += __builtin_popcount(_mm_movemask_ps(_mm_castsi128_ps(valid)));
+        nlast += __builtin_popcount(_mm_movemask_ps(_mm_castsi128_ps(at_last)));
+    }
+
+    int64_t lanes[4];
+    _mm256_storeu_si256((__m256i *)lanes, sum4);
+    sum = lanes[0] + lanes[1] + lanes[2] + lanes[3] + (int64_t)nlast * map->pixels[last];
+
+    for (; i<scan->npoints; i++)
+    {
+        add_point(map, scan, i, pos_x_pix, pos_y_pix, costheta, sintheta, &sum, &npoints);
+    }
+
+    return npoints ? (int)(sum * 1024 / npoints) : -1;
+}
+
+__attribute__((target("avx512f,avx512vl")))
+static int
+distance_scan_to_map_avx512(
+    map_t *  map,
+    scan_t * scan,
+    position_t position)
+{
+    double position_theta_radians = radians(position.theta_degrees);
+    double costheta = cos(position_theta_radians) * map->scale_pixels_per_mm;
+    double sintheta = sin(position_theta_radians) * map->scale_pixels_per_mm;
+
+    double pos_x_pix = position.x_mm * map->scale_pixels_per_mm;
+    double pos_y_pix = position.y_mm * map->scale_pixels_per_mm;
+
+    __m512d pos_x = _mm512_set1_pd(pos_x_pix);
+    __m512d pos_y = _mm512_set1_pd(pos_y_pix);
+    __m512d cos8 = _mm512_set1_pd(costheta);
+    __m512d sin8 = _mm512_set1_pd(sintheta);
+    __m512d half = _mm512_set1_pd(0.5);
+
+    __m256i size = _mm256_set1_epi32(map->size_pixels);
+    __m256i zero = _mm256_setzero_si256();
+    __m256i obstacle = _mm256_set1_epi32(OBSTACLE);
+    __m256i low_half = _mm256_set1_epi32(0xFFFF);
+
+    int last = map->size_pixels * map->size_pixels - 1;
+    __m256i last8 = _mm256_set1_epi32(last);
+    int nlast = 0;
+
+    __m512i sum8 = _mm512_setzero_si512();
+    int64_t sum = 0;
+    int npoints = 0;
+
+    int i = 0;
+    for (i=0; i+8<=scan->npoints; i+=8)
+    {
+        __m512d x_mm = _mm512_loadu_pd(scan->x_mm + i);
+        __m512d y_mm = _mm512_loadu_pd(scan->y_mm + i);
+
+        __m512d x_pix = _mm512_add_pd(
+            _mm512_sub_pd(_mm512_add_pd(pos_x, _mm512_mul_pd(cos8, x_mm)), _mm512_mul_pd(sin8, y_mm)), half);
+        __m512d y_pix = _mm512_add_pd(
+            _mm512_add_pd(_mm512_add_pd(pos_y, _mm512_mul_pd(sin8, x_mm)), _mm512_mul_pd(cos8, y_mm)), half);
+
+        __m256i x = _mm512_cvttpd_epi32(_mm512_roundscale_pd(x_pix, _MM_FROUND_TO_NEG_INF | _MM_FROUND_NO_EXC));
+        __m256i y = _mm512_cvttpd_epi32(_mm512_roundscale_pd(y_pix, _MM_FROUND_TO_NEG_INF | _MM_FROUND_NO_EXC));
+
+        __mmask8 valid = _mm256_cmpeq_epi32_mask(_mm256_loadu_si256((const __m256i *)(scan->value + i)), obstacle);
+        valid &= _mm256_cmpge_epi32_mask(x, zero) & _mm256_cmplt_epi32_mask(x, size);
+        valid &= _mm256_cmpge_epi32_mask(y, zero) & _mm256_cmplt_epi32_mask(y, size);
+
+        __m256i index = _mm256_add_epi32(_mm256_mullo_epi32(y, size), x);
+        __mmask8 at_last = valid & _mm256_cmpeq_epi32_mask(index, last8);
+
+        __m256i pixels = _mm256_mmask_i32gather_epi32(zero, valid & ~at_last, index, map->pixels, 2);
+
+        sum8 = _mm512_add_epi64(sum8, _mm512_cvtepu32_epi64(_mm256_and_si256(pixels, low_half)));
+
+        npoints += __builtin_popcount(valid);
+        nlast += __builtin_popcount(at_last);
+    }
+
+    sum = _mm512_reduce_add_epi64(sum8) + (int64_t)nlast * map->pixels[last];
+
+    for (; i<scan->npoints; i++)
+    {
+        add_point(map, scan, i, pos_x_pix, pos_y_pix, costheta, sintheta, &sum, &npoints);
+    }
+
+    return npoints ? (int)(sum * 1024 / npoints) : -1;
+}
+
+/* Tiled maps: pixels in the block are gathered as from a dense map. Batches with points off it also gather
+   tile pointers from the directory for those, then pixels from the tiles, whose spare pixel makes the 32-bit
+   read at their last pixel safe, as the block's does. Points outside the directory count as unknown pixels. */
+
+static const int UNKNOWN = 32750;
+
+/* Adds the scan point at i to sum and npoints, as distance_scan_to_map_tiled() does */
+static void
+add_point_tiled(
+    map_t * map,
+    scan_t * scan,
+    int i,
+    double pos_x_pix,
+    double pos_y_pix,
+    double costheta,
+    double sintheta,
+    int64_t * sum,
+    int * npoints)
+{
+    if (scan->value[i] == OBSTACLE)
+    {
+        int x = floor(pos_x_pix + costheta * scan->x_mm[i] - sintheta * scan->y_mm[i] + 0.5);
+        int y = floor(pos_y_pix + sintheta * scan->x_mm[i] + costheta * scan->y_mm[i] + 0.5);
+
+        int bits = map->tile_bits;
+        int mask = (1 << bits) - 1;
+        int block_size = map->block_tiles << bits;
+        int bx = x - (map->block_x0 << bits);
+        int by = y - (map->block_y0 << bits);
+        int tx = (x >> bits) - map->tiles_x0;
+        int ty = (y >> bits) - map->tiles_y0;
+
+        if (bx >= 0 && bx < block_size && by >= 0 && by < block_size)
+        {
+            *sum += map->block[by * block_size + bx];
+        }
+        else
+        {
+            *sum += (tx >= 0 && tx < map->tiles_nx && ty >= 0 && ty < map->tiles_ny) ?
+                map->tiles[ty * map->tiles_nx + tx][((y & mask) << bits) + (x & mask)] : UNKNOWN;
+        }
+
+        (*npoints)++;
+    }
+}
+
+__attribute__((target("avx2")))
+static int
+distance_scan_to_map_tiled_avx2(
+    map_t *  map,
+    scan_t * scan,
+    position_t position)
+{
+    double position_theta_radians = radians(position.theta_degrees);
+    double costheta = cos(position_theta_radians) * map->scale_pixels_per_mm;
+    double sintheta = sin(position_theta_radians) * map->scale_pixels_per_mm;
+
+    double pos_x_pix = position.x_mm * map->scale_pixels_per_mm;
+    double pos_y_pix = position.y_mm * map->scale_pixels_per_mm;
+
+    __m256d pos_x = _mm256_set1_pd(pos_x_pix);
+    __m256d pos_y = _mm256_set1_pd(pos_y_pix);
+    __m256d cos4 = _mm256_set1_pd(costheta);
+    __m256d sin4 = _mm256_set1_pd(sintheta);
+    __m256d half = _mm256_set1_pd(0.5);
+
+    __m128i bits = _mm_cvtsi32_si128(map->tile_bits);
+    __m128i mask = _mm_set1_epi32((1 << map->tile_bits) - 1);
+    __m128i x0 = _mm_set1_epi32(map->tiles_x0);
+    __m128i y0 = _mm_set1_epi32(map->tiles_y0);
+    __m128i nx = _mm_set1_epi32(map->tiles_nx);
+    __m128i ny = _mm_set1_epi32(map->tiles_ny);
+    __m128i block_x = _mm_set1_epi32(map->block_x0 << map->tile_bits);
+    __m128i block_y = _mm_set1_epi32(map->block_y0 << map->tile_bits);
+    __m128i block_size = _mm_set1_epi32(map->block_tiles << map->tile_bits);
+    __m128i minus_one = _mm_set1_epi32(-1);
+    __m128i obstacle = _mm_set1_epi32(OBSTACLE);
+    __m128i low_half = _mm_set1_epi32(0xFFFF);
+
+    __m256i sum4 = _mm256_setzero_si256();
+    int64_t sum = 0;
+    int npoints = 0;
+    int nunknown = 0;
+
+    int i = 0;
+    for (i=0; i+4<=scan->npoints; i+=4)
+    {
+        __m256d x_mm = _mm256_loadu_pd(scan->x_mm + i);
+        __m256d y_mm = _mm256_loadu_pd(scan->y_mm + i);
+
+        __m256d x_pix = _mm256_add_pd(
+            _mm256_sub_pd(_mm256_add_pd(pos_x, _mm256_mul_pd(cos4, x_mm)), _mm256_mul_pd(sin4, y_mm)), half);
+        __m256d y_pix = _mm256_add_pd(
+            _mm256_add_pd(_mm256_add_pd(pos_y, _mm256_mul_pd(sin4, x_mm)), _mm256_mul_pd(cos4, y_mm)), half);
+
+        __m128i x = _mm256_cvttpd_epi32(_mm256_floor_pd(x_pix));
+        __m128i y = _mm256_cvttpd_epi32(_mm256_floor_pd(y_pix));
+
+        __m128i valid = _mm_cmpeq_epi32(_mm_loadu_si128((const __m128i *)(scan->value + i)), obstacle);
+
+        __m128i bx = _mm_sub_epi32(x, block_x);
+        __m128i by = _mm_sub_epi32(y, block_y);
+
+        __m128i in_block = _mm_and_si128(_mm_cmpgt_epi32(bx, minus_one), _mm_cmpgt_epi32(block_size, bx));
+        in_block = _mm_and_si128(in_block, _mm_and_si128(_mm_cmpgt_epi32(by, minus_one), _mm_cmpgt_epi32(block_size, by)));
+        in_block = _mm_and_si128(in_block, valid);
+
+        __m128i index = _mm_add_epi32(_mm_mullo_epi32(by, block_size), bx);
+        __m128i pixels = _mm_mask_i32gather_epi32(_mm_setzero_si128(), (const int *)map->block, index, in_block, 2);
+        __m128i inside = in_block;
+
+        __m128i off_block = _mm_andnot_si128(in_block, valid);
+
+        if (_mm_movemask_ps(_mm_castsi128_ps(off_block)))
+        {
+            __m128i tx = _mm_sub_epi32(_mm_sra_epi32(x, bits), x0);
+            __m128i ty = _mm_sub_epi32(_mm_sra_epi32(y, bits), y0);
+
+            __m128i in_tiles = _mm_and_si128(_mm_cmpgt_epi32(tx, minus_one), _mm_cmpgt_epi32(nx, tx));
+            in_tiles = _mm_and_si128(in_tiles, _mm_and_si128(_mm_cmpgt_epi32(ty, minus_one), _mm_cmpgt_epi32(ny, ty)));
+            in_tiles = _mm_and_si128(in_tiles, off_block);
+
+            __m128i tile_index = _mm_add_epi32(_mm_mullo_epi32(ty, nx), tx);
+            __m256i tiles = _mm256_mask_i32gather_epi64(
+                _mm256_setzero_si256(), (const long long *)map->tiles, tile_index, _mm256_cvtepi32_epi64(in_tiles), 8);
+
+            __m128i offset = _mm_add_epi32(_mm_sll_epi32(_mm_and_si128(y, mask), bits), _mm_and_si128(x, mask));
+            __m256i address = _mm256_add_epi64(tiles, _mm256_slli_epi64(_mm256_cvtepi32_epi64(offset), 1));
+
+            pixels = _mm256_mask_i64gather_epi32(pixels, (const int *)0, address, in_tiles, 1);
+            inside = _mm_or_si128(inside, in_tiles);
+        }
+
+        sum4 = _mm256_add_epi64(sum4, _mm256_cvtepu32_epi64(_mm_and_si128(pixels, low_half)));
+
+        int nvalid = __builtin_popcount(_mm_movemask_ps(_mm_castsi128_ps(valid)));
+        npoints += nvalid;
+        nunknown += nvalid - __builtin_popcount(_mm_movemask_ps(_mm_castsi128_ps(inside)));
+    }
+
+    int64_t lanes[4];
+    _mm256_storeu_si256((__m256i *)lanes, sum4);
+    sum = lanes[0] + lanes[1] + lanes[2] + lanes[3] + (int64_t)nunknown * UNKNOWN;
+
+    for (; i<scan->npoints; i++)
+    {
+        add_point_tiled(map, scan, i, pos_x_pix, pos_y_pix, costheta, sintheta, &sum, &npoints);
+    }
+
+    return npoints ? (int)(sum * 1024 / npoints) : -1;
+}
+
+__attribute__((target("avx512f,avx512vl")))
+static int
+distance_scan_to_map_tiled_avx512(
+    map_t *  map,
+    scan_t * scan,
+    position_t position)
+{
+    double position_theta_radians = radians(position.theta_degrees);
+    double costheta = cos(position_theta_radians) * map->scale_pixels_per_mm;
+    double sintheta = sin(position_theta_radians) * map->scale_pixels_per_mm;
+
+    double pos_x_pix = position.x_mm * map->scale_pixels_per_mm;
+    double pos_y_pix = position.y_mm * map->scale_pixels_per_mm;
+
+    __m512d pos_x = _mm512_set1_pd(pos_x_pix);
+    __m512d pos_y = _mm512_set1_pd(pos_y_pix);
+    __m512d cos8 = _mm512_set1_pd(costheta);
+    __m512d sin8 = _mm512_set1_pd(sintheta);
+    __m512d half = _mm512_set1_pd(0.5);
+
+    __m128i bits = _mm_cvtsi32_si128(map->tile_bits);
+    __m256i mask = _mm256_set1_epi32((1 << map->tile_bits) - 1);
+    __m256i x0 = _mm256_set1_epi32(map->tiles_x0);
+    __m256i y0 = _mm256_set1_epi32(map->tiles_y0);
+    __m256i nx = _mm256_set1_epi32(map->tiles_nx);
+    __m256i ny = _mm256_set1_epi32(map->tiles_ny);
+    __m256i block_x = _mm256_set1_epi32(map->block_x0 << map->tile_bits);
+    __m256i block_y = _mm256_set1_epi32(map->block_y0 << map->tile_bits);
+    __m256i block_size = _mm256_set1_epi32(map->block_tiles << map->tile_bits);
+    __m256i zero = _mm256_setzero_si256();
+    __m256i obstacle = _mm256_set1_epi32(OBSTACLE);
+    __m256i low_half = _mm256_set1_epi32(0xFFFF);
+
+    __m512i sum8 = _mm512_setzero_si512();
+    int64_t sum = 0;
+    int npoints = 0;
+    int nunknown = 0;
+
+    int i = 0;
+    for (i=0; i+8<=scan->npoints; i+=8)
+    {
+        __m512d x_mm = _mm512_loadu_pd(scan->x_mm + i);
+        __m512d y_mm = _mm512_loadu_pd(scan->y_mm + i);
+
+        __m512d x_pix = _mm512_add_pd(
+            _mm512_sub_pd(_mm512_add_pd(pos_x, _mm512_mul_pd(cos8, x_mm)), _mm512_mul_pd(sin8, y_mm)), half);
+        __m512d y_pix = _mm512_add_pd(
+            _mm512_add_pd(_mm512_add_pd(pos_y, _mm512_mul_pd(sin8, x_mm)), _mm512_mul_pd(cos8, y_mm)), half);
+
+        __m256i x = _mm512_cvttpd_epi32(_mm512_roundscale_pd(x_pix, _MM_FROUND_TO_NEG_INF | _MM_FROUND_NO_EXC));
+        __m256i y = _mm512_cvttpd_epi32(_mm512_roundscale_pd(y_pix, _MM_FROUND_TO_NEG_INF | _MM_FROUND_NO_EXC));
+
+        __mmask8 valid = _mm256_cmpeq_epi32_mask(_mm256_loadu_si256((const __m256i *)(scan->value + i)), obstacle);
+
+        __m256i bx = _mm256_sub_epi32(x, block_x);
+        __m256i by = _mm256_sub_epi32(y, block_y);
+
+        __mmask8 in_block = valid;
+        in_block &= _mm256_cmpge_epi32_mask(bx, zero) & _mm256_cmplt_epi32_mask(bx, block_size);
+        in_block &= _mm256_cmpge_epi32_mask(by, zero) & _mm256_cmplt_epi32_mask(by, block_size);
+
+        __m256i index = _mm256_add_epi32(_mm256_mullo_epi32(by, block_size), bx);
+        __m256i pixels = _mm256_mmask_i32gather_epi32(zero, in_block, index, map->block, 2);
+        __mmask8 inside = in_block;
+
+        __mmask8 off_block = valid & ~in_block;
+
+        if (off_block)
+        {
+            __m256i tx = _mm256_sub_epi32(_mm256_sra_epi32(x, bits), x0);
+            __m256i ty = _mm256_sub_epi32(_mm256_sra_epi32(y, bits), y0);
+
+            __mmask8 in_tiles = off_block;
+            in_tiles &= _mm256_cmpge_epi32_mask(tx, zero) & _mm256_cmplt_epi32_mask(tx, nx);
+            in_tiles &= _mm256_cmpge_epi32_mask(ty, zero) & _mm256_cmplt_epi32_mask(ty, ny);
+
+            __m256i tile_index = _mm256_add_epi32(_mm256_mullo_epi32(ty, nx), tx);
+            __m256i offset = _mm256_add_epi32(_mm256_sll_epi32(_mm256_and_si256(y, mask), bits), _mm256_and_si256(x, mask));
+
+            __m512i tiles = _mm512_mask_i32gather_epi64(_mm512_setzero_si512(), in_tiles, tile_index, map->tiles, 8);
+            __m512i address = _mm512_add_epi64(tiles, _mm512_slli_epi64(_mm512_cvtepi32_epi64(offset), 1));
+
+            pixels = _mm512_mask_i64gather_epi32(pixels, in_tiles, address, (const void *)0, 1);
+            inside |= in_tiles;
+        }
+
+        sum8 = _mm512_add_epi64(sum8, _mm512_cvtepu32_epi64(_mm256_and_si256(pixels, low_half)));
+
+        npoints += __builtin_popcount(valid);
+        nunknown += __builtin_popcount(valid & ~inside);
+    }
+
+    sum = _mm512_reduce_add_epi64(sum8) + (int64_t)nunknown * UNKNOWN;
+
+    for (; i<scan->npoints; i++)
+    {
+        add_point_tiled(map, scan, i, pos_x_pix, pos_y_pix, costheta, sintheta, &sum, &npoints);
+    }
+
+    return npoints ? (int)(sum * 1024 / npoints) : -1;
+}
+
+/* Runtime dispatch ------------------------------------------------------------------------------------------ */
+
+static int supports_sisd(void)
+{
+    return 1;
+}
+
+static int supports_avx2(void)
+{
+    __builtin_cpu_init();
+    return __builtin_cpu_supports("avx2");
+}
+
+static int supports_avx512(void)
+{
+    __builtin_cpu_init();
+    return __builtin_cpu_supports("avx512f") && __builtin_cpu_supports("avx512vl");
+}
+
+typedef struct kernel_t
+{
+    const char * name;
+    distance_kernel_t distance;
+    distance_kernel_t distance_tiled;
+    int (*supported)(void);
+
+} kernel_t;
+
+/* Slowest first */
+static const kernel_t KERNELS[] =
+{
+    {"sisd",   distance_scan_to_map_sisd,   distance_scan_to_map_tiled,        supports_sisd},
+    {"avx2",   distance_scan_to_map_avx2,   distance_scan_to_map_tiled_avx2,   supports_avx2},
+    {"avx512", distance_scan_to_map_avx512, distance_scan_to_map_tiled_avx512, supports_avx512}
+};
+
+#define NKERNELS ((int)(sizeof(KERNELS) / sizeof(KERNELS[0])))
+
+static int distance_scan_to_map_first(map_t * map, scan_t * scan, position_t position);
+
+static const kernel_t * current_kernel = NULL;
+static distance_kernel_t current_distance = distance_scan_to_map_first;
+static distance_kernel_t current_distance_tiled = distance_scan_to_map_first;
+
+/* C callers that never select a kernel get the fastest one */
+static int
+distance_scan_to_map_first(
+    map_t *  map,
+    scan_t * scan,
+    position_t position)
+{
+    distance_kernel_select(NULL);
+
+    return distance_scan_to_map(map, scan, position);
+}
+
+const char **
+distance_kernels(void)
+{
+    static const char * names[NKERNELS+1];
+
+    int k = 0, n = 0;
+    for (k=0; k<NKERNELS; ++k)
+    {
+        if (KERNELS[k].supported())
+        {
+            names[n++] = KERNELS[k].name;
+        }
+    }
+    names[n] = NULL;
+
+    return names;
+}
+
+int
+distance_kernel_select(
+    const char * name)
+{
+    int k = 0;
+    for (k=NKERNELS-1; k>=0; --k)
+    {
+        if ((!name || !strcmp(name, KERNELS[k].name)) && KERNELS[k].supported())
+        {
+            current_kernel = &KERNELS[k];
+            current_distance = KERNELS[k].distance;
+            current_distance_tiled = KERNELS[k].distance_tiled;
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
+const char *
+distance_kernel(void)
+{
+    if (!current_kernel)
+    {
+        distance_kernel_select(NULL);
+    }
+
+    return current_kernel->name;
+}
+
+int
+distance_scan_to_map(
+    map_t *  map,
+    scan_t * scan,
+    position_t position)
+{
+    return map->tiles ? 
+        current_distance_tiled(map, scan, position) : 
+        current_distance(map, scan, position);
+}
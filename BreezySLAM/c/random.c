@@ -60,6 +60,13 @@ void random_init(void * v, int seed)
 }
 
 
+unsigned int random_state(void * v)
+{
+    random_t * r = (random_t *)v;
+    
+    return r->seed;
+}
+
 double random_normal(void * v, double mu, double sigma)
 {
     random_t * r = (random_t *)v;
@@ -67,6 +74,18 @@ double random_normal(void * v, double mu, double sigma)
     return mu + sigma * r4_nor ( &r->seed, r->kn, r->fn, r->wn );
 }
 
+unsigned int random_uint(void * v)
+{
+    random_t * r = (random_t *)v;
+    
+    return shr3_seeded ( &r->seed );
+}
+
+double random_uniform(void * v)
+{
+    return random_uint(v) / 4294967296.0;
+}
+
 void random_free(void * v)
 {
     free(v);
@@ -35,12 +35,21 @@ void * random_new(int seed);
 /* Initializes a random-number generator */
 void random_init(void * r, int seed);
 
+/* Returns the state of a random-number generator, which random_init() restores */
+unsigned int random_state(void * v);
+
 /* Make a copy of the specified random-number generator */
 void * random_copy(void * r);
 
 /* Deallocates memory for a random-number generator */
 void random_free(void * v);
 
+/* Returns a uniformly distributed 32-bit unsigned integer */
+unsigned int random_uint(void * v);
+
+/* Returns a uniformly distributed variate in [0, 1) */
+double random_uniform(void * v);
+
 /* Returns a  standard normal variate with mean mu, variance sigma */
 double random_normal(void * v, double mu, double sigma);
 
@@ -21,7 +21,17 @@ along with this code.  If not, see <http:#www.gnu.org/licenses/>.
 
 import pybreezyslam
 
+from breezyslam.sensors import Laser
+
+import array
+import inspect
+import json
 import math
+import mmap
+import os
+import struct
+import sys
+import threading
 import time
 
 # Basic params
@@ -33,6 +43,31 @@ _DEFAULT_SIGMA_XY_MM         = 100
 _DEFAULT_SIGMA_THETA_DEGREES = 20
 _DEFAULT_MAX_SEARCH_ITER     = 1000
 
+# Branch-and-bound search params
+_DEFAULT_WINDOW_XY_MM         = 300
+_DEFAULT_WINDOW_THETA_DEGREES = 20
+_DEFAULT_STEP_THETA_DEGREES   = 2
+_DEFAULT_PYRAMID_LEVELS       = 7
+
+# Particle filter params
+_DEFAULT_NUM_PARTICLES          = 1000
+_DEFAULT_PARTICLE_SIGMA_XY_MM   = 20
+_DEFAULT_PARTICLE_SIGMA_THETA_DEGREES = 2
+_DEFAULT_LIKELIHOOD_TEMPERATURE = 100000
+_DEFAULT_RESAMPLE_THRESHOLD     = 0.5
+
+# Map files (see CoreSLAM.save()): a header page, then the map pixels
+_MAP_FILE_MAGIC                 = b'BRZYSLAM'
+_MAP_FILE_VERSION               = 1
+_MAP_FILE_HEADER                = struct.Struct('<8sII')  # magic, version, length of the JSON description
+_MAP_FILE_STATE                 = struct.Struct('<dddII') # position, whether there is a randomizer, its state
+_MAP_FILE_DESCRIPTION_OFFSET    = 64
+_MAP_FILE_PIXELS_OFFSET         = 4096
+_DEFAULT_FLUSH_INTERVAL_SECONDS = 1
+
+# Constructor parameters that map files record otherwise, or not at all
+_UNSAVED_PARAMS = ('self', 'laser', 'map_size_pixels', 'map_size_meters', 'map_tile_size_pixels', 'random_seed')
+
 # CoreSLAM class ------------------------------------------------------------------------------------------------------
 
 class CoreSLAM(object):
@@ -60,7 +95,7 @@ class CoreSLAM(object):
     '''
     
     def __init__(self, laser, map_size_pixels, map_size_meters, 
-        map_quality=_DEFAULT_MAP_QUALITY, hole_width_mm=_DEFAULT_HOLE_WIDTH_MM):
+        map_quality=_DEFAULT_MAP_QUALITY, hole_width_mm=_DEFAULT_HOLE_WIDTH_MM, map_tile_size_pixels=0):
         '''
         Creates a CoreSLAM object suitable for updating with new Lidar and odometry data.
         laser is a Laser object representing the specifications of your Lidar unit
@@ -68,6 +103,8 @@ class CoreSLAM(object):
         map_size_meters is the size of the square map in meters
         quality from 0 through 255 determines integration speed of scan into map
         hole_width_mm determines width of obstacles (walls)
+        map_tile_size_pixels, a power of two, makes a tiled map that grows past map_size_meters in every direction,
+           in tiles of that size allocated as the robot explores; 0 for a dense map
         '''
     
         # Initialize parameters
@@ -77,25 +114,37 @@ class CoreSLAM(object):
         # Store laser for later
         self.laser = laser
         
+        self.map_size_pixels = map_size_pixels
+        self.map_size_meters = map_size_meters
+        
         # Initialize a scan for computing distance to map, and one for updating map
         self.scan_for_distance = pybreezyslam.Scan(laser, 1)
         self.scan_for_mapbuild = pybreezyslam.Scan(laser, 3)
                 
-        # Initialize the map 
-        self.map = pybreezyslam.Map(map_size_pixels, map_size_meters)
+        # Initialize the map, or use the one in the file load() is reading
+        self._mapfile = getattr(self, '_mapfile', None)
+        
+        if self._mapfile:
+            self.map = self._mapfile.map
+        else:
+            self.map = pybreezyslam.Map(map_size_pixels, map_size_meters, tile_size_pixels=map_tile_size_pixels)
                 
-    def update(self, scans_mm, pose_change, scan_angles_degrees=None, should_update_map=True):
+    def update(self, scans_mm, pose_change, scan_angles_degrees=None, should_update_map=True, distance_scale=1):
         '''
         Updates the scan and odometry, and calls the the implementing class's _updateMapAndPointcloud method with
         the specified pose change.
          
         scan_mm is a list of Lidar scan values, whose count is specified in the scan_size 
-        attribute of the Laser object passed to the CoreSlam constructor
+        attribute of the Laser object passed to the CoreSlam constructor; any one-dimensional buffer of
+        floats or integers (numpy array, array.array, memoryview) is also accepted and read without copying
         pose_change is a tuple (dxy_mm, dtheta_degrees, dt_seconds) computed from odometry
-        scan_angles_degrees is an optional list of angles corresponding to the distances in scans_mm
+        scan_angles_degrees is an optional list or buffer of angles corresponding to the distances in scans_mm
         should_update_map flags for whether you want to update the map
+        distance_scale multiplies each scan value to get millimeters, e.g. 1000 for scan values in meters
         '''
 
+        self._checkopen()
+        
         # Convert pose change (dxy,dtheta,dt) to velocities (dxy/dt, dtheta/dt) for scan update
         velocity_factor = (1 / pose_change[2])  if (pose_change[2] > 0) else 0 # units => units/sec
         dxy_mm_dt = pose_change[0] * velocity_factor  
@@ -103,26 +152,154 @@ class CoreSLAM(object):
         velocities = (dxy_mm_dt, dtheta_degrees_dt)
 
         # Build a scan for computing distance to map, and one for updating map 
-        self._scan_update(self.scan_for_mapbuild, scans_mm, velocities, scan_angles_degrees)
-        self._scan_update(self.scan_for_distance, scans_mm, velocities, scan_angles_degrees)
+        self._scan_update(self.scan_for_mapbuild, scans_mm, velocities, scan_angles_degrees, distance_scale)
+        self._scan_update(self.scan_for_distance, scans_mm, velocities, scan_angles_degrees, distance_scale)
 
         # Implementing class updates map and pointcloud
         self._updateMapAndPointcloud(pose_change[0], pose_change[1], should_update_map)
         
+        if self._mapfile and self._mapfile.persistent:
+            self._mapfile.write_state(self)
+        
     def getmap(self, mapbytes):
         '''
         Fills bytearray mapbytes with current map pixels, where bytearray length is square of map size passed
-        to CoreSLAM.__init__().
+        to CoreSLAM.__init__(). mapbytes may also be a caller-provided numpy array: uint8 receives the same bytes,
+        uint16 receives the raw pixels. For read-only access without any copy, use numpy.asarray(slam.map).
+        A tiled map fills the map_size_pixels-square window its positions start in the middle of; use
+        slam.map.get_rect() for the rest.
         '''
+        self._checkopen()
         self.map.get(mapbytes)
         
         
     def setmap(self, mapbytes):
         '''
         Sets current map pixels to values in bytearray, where bytearray length is square of map size passed
-        to CoreSLAM.__init__().
+        to CoreSLAM.__init__(). Accepts the same buffers as getmap().
         '''
+        self._checkopen()
         self.map.set(mapbytes)
+        self._mapChanged(None)
+
+    def getdirty(self):
+        '''
+        Returns the box (x, y, width, height) of map pixels changed since the previous call, or None if the map
+        has not changed. On a tiled map, the box may lie partly outside the window getmap() fills.
+        '''
+        self._checkopen()
+        return self.map.take_dirty()
+
+    def save(self, path):
+        '''
+        Saves the map, position, parameters, laser and random-number generator state to the file path, which
+        load() resumes from. The pixels are written straight from the map, as 16-bit values; only dense maps
+        can be saved. On the file a persistent object was loaded from, just flushes it.
+        '''
+        self._checkopen()
+        
+        if self._mapfile and self._mapfile.persistent and os.path.abspath(path) == self._mapfile.path:
+            self._mapfile.write_state(self)
+            self._mapfile.flush()
+        else:
+            _MapFile.write(path, self)
+        
+    @classmethod
+    def load(cls, path, persistent=False, flush_interval_seconds=_DEFAULT_FLUSH_INTERVAL_SECONDS, any_class=False,
+             **params):
+        '''
+        Creates an object of this class from a file written by save(): same laser, parameters, map, position and
+        random-number generator state. params override saved constructor parameters, e.g. num_threads.
+        The map pixels are memory-mapped from the file, not read, so that any map loads in about a millisecond.
+        By default the mapping is copy-on-write, and the file never changes. persistent makes the file the map:
+        updates write their pixels and the position to it, and a background thread flushes it to disk every
+        flush_interval_seconds, so that a new process loading it after a crash resumes where this one stopped.
+        Call close() when done to stop flushing. Pages a copy-on-write object has not changed yet still show the
+        file, so do not load a file copy-on-write while a persistent object keeps mapping into it.
+        Raises ValueError on a file saved by another class, unless any_class is set: the parameters this class
+        does not take are then dropped.
+        '''
+        mapfile = _MapFile(path, persistent)
+        
+        if mapfile.class_name != cls.__name__ and not any_class:
+            mapfile.close()
+            raise ValueError('%s was saved by %s, not %s' % (path, mapfile.class_name, cls.__name__))
+        
+        accepted = inspect.signature(cls.__init__).parameters
+        saved = dict((name, value) for name, value in mapfile.params.items() if name in accepted)
+        saved.update(params)
+        
+        # CoreSLAM.__init__() takes the map from the file instead of making one
+        slam = cls.__new__(cls)
+        slam._mapfile = mapfile
+        slam.__init__(mapfile.laser, mapfile.size_pixels, mapfile.size_meters, **saved)
+        
+        slam._setpos(pybreezyslam.Position(*mapfile.position))
+        
+        if mapfile.random_state is not None and hasattr(slam, 'randomizer'):
+            slam.randomizer.setstate(mapfile.random_state)
+            
+        if persistent:
+            mapfile.start_flushing(flush_interval_seconds)
+        
+        return slam
+        
+    def close(self):
+        '''
+        Releases the map. An object loaded with persistent=True stops flushing its file and flushes it a last
+        time; one loaded from a file unmaps it. Views of the map, e.g. numpy.asarray(slam.map), must be dropped
+        first. Calling close() again does nothing; anything else that uses the map raises ValueError.
+        '''
+        if self.map is None:
+            return
+        
+        if self._mapfile and self._mapfile.persistent:
+            self._mapfile.write_state(self)
+        
+        self.map = None
+        
+        if self._mapfile:
+            self._mapfile.close()
+            
+    def _checkopen(self):
+        
+        if self.map is None:
+            raise ValueError('%s object is closed' % type(self).__name__)
+        
+    def _getparams(self):
+        '''
+        Returns the constructor parameters that save() records: those kept as attributes of the same name.
+        '''
+        names = inspect.signature(type(self).__init__).parameters
+        
+        return dict((name, getattr(self, name)) for name in names 
+            if name not in _UNSAVED_PARAMS and name in self.__dict__)
+        
+    def _setpos(self, position):
+        '''
+        Moves the current position to position, when load() resumes. Implementing classes override it.
+        '''
+        pass
+
+    def _mapChanged(self, rect):
+        '''
+        Called after the map changed inside rect (x, y, width, height), or everywhere if rect is None. Implementing
+        classes that keep data derived from the map override it.
+        '''
+        pass
+
+    def getdistances(self, positions, distances=None, num_threads=1):
+        '''
+        Scores many candidate positions for the latest scan against the current map in one call, and returns the
+        distances (lower is a better match, -1 when no scan point falls on the map).
+        positions is a contiguous buffer of (x_mm, y_mm, theta_degrees) doubles, e.g. an (N, 3) float64 numpy array
+        distances is an optional writable buffer of N ints (e.g. an int32 numpy array) to fill and return;
+           a new array.array('i') is returned otherwise
+        num_threads > 1 splits the positions over that many native threads
+        '''
+        self._checkopen()
+        return pybreezyslam.distanceScanToMapBatch(self.map, self.scan_for_distance, positions, distances,
+                num_threads)
 
     def __str__(self):
         
@@ -134,10 +311,10 @@ class CoreSLAM(object):
          return self.__str__()
 
         
-    def _scan_update(self, scan, scans_distances_mm, velocities, scan_angles_degrees):
+    def _scan_update(self, scan, scans_distances_mm, velocities, scan_angles_degrees, distance_scale=1):
 
         scan.update(scans_mm=scans_distances_mm, hole_width_mm=self.hole_width_mm, 
-                velocities=velocities, scan_angles_degrees=scan_angles_degrees)
+                velocities=velocities, scan_angles_degrees=scan_angles_degrees, distance_scale=distance_scale)
         
         
 # SinglePositionSLAM class ---------------------------------------------------------------------------------------------
@@ -153,10 +330,10 @@ class SinglePositionSLAM(CoreSLAM):
     '''
 
     def __init__(self, laser, map_size_pixels, map_size_meters, 
-                map_quality=_DEFAULT_MAP_QUALITY, hole_width_mm=_DEFAULT_HOLE_WIDTH_MM):
+                map_quality=_DEFAULT_MAP_QUALITY, hole_width_mm=_DEFAULT_HOLE_WIDTH_MM, map_tile_size_pixels=0):
 
         CoreSLAM.__init__(self, laser, map_size_pixels, map_size_meters, 
-            map_quality, hole_width_mm)                    
+            map_quality, hole_width_mm, map_tile_size_pixels)                    
                     
         # Initialize the position (x, y, theta)
         init_coord_mm = 500 * map_size_meters # center of map
@@ -190,7 +367,10 @@ class SinglePositionSLAM(CoreSLAM):
   
         # Update the map with this new position if indicated
         if should_update_map:
-            self.map.update(self.scan_for_mapbuild, new_position, self.map_quality, self.hole_width_mm)
+            rect = self.map.update(self.scan_for_mapbuild, new_position, self.map_quality, self.hole_width_mm)
+
+            if rect is not None:
+                self._mapChanged(rect)
       
     def getpos(self):
         '''
@@ -198,6 +378,9 @@ class SinglePositionSLAM(CoreSLAM):
         '''
         return (self.position.x_mm, self.position.y_mm, self.position.theta_degrees)
                 
+    def _setpos(self, position):
+        
+        self.position = position.copy()
         
     def _costheta(self):
         
@@ -222,7 +405,7 @@ class RMHC_SLAM(SinglePositionSLAM):
     def __init__(self, laser, map_size_pixels, map_size_meters, 
                 map_quality=_DEFAULT_MAP_QUALITY, hole_width_mm=_DEFAULT_HOLE_WIDTH_MM,
                 random_seed=None, sigma_xy_mm=_DEFAULT_SIGMA_XY_MM, sigma_theta_degrees=_DEFAULT_SIGMA_THETA_DEGREES, 
-                max_search_iter=_DEFAULT_MAX_SEARCH_ITER):
+                max_search_iter=_DEFAULT_MAX_SEARCH_ITER, num_threads=1, map_tile_size_pixels=0):
         '''
         Creates a RMHCSlam object suitable for updating with new Lidar and odometry data.
         laser is a Laser object representing the specifications of your Lidar unit
@@ -236,10 +419,15 @@ class RMHC_SLAM(SinglePositionSLAM):
         sigma_theta_degrees specifies the standard deviation in degrees of the normal distribution of 
            the rotational component of position for RMHC search
         max_search_iter specifies the maximum number of iterations for RMHC search
+        num_threads > 1 runs that many independent RMHC chains on native threads, each with an equal share of
+           max_search_iter and its own generator seeded from random_seed, and keeps the best position; results
+           are reproducible for a given random_seed and num_threads
+        map_tile_size_pixels, a power of two, makes a tiled map that grows past map_size_meters in every direction,
+           in tiles of that size allocated as the robot explores; 0 for a dense map
         '''
     
         SinglePositionSLAM.__init__(self, laser, map_size_pixels, map_size_meters, 
-            map_quality, hole_width_mm)
+            map_quality, hole_width_mm, map_tile_size_pixels)
             
         if not random_seed:
             random_seed = int(time.time()) & 0xFFFF
@@ -249,14 +437,15 @@ class RMHC_SLAM(SinglePositionSLAM):
         self.sigma_xy_mm = sigma_xy_mm
         self.sigma_theta_degrees = sigma_theta_degrees
         self.max_search_iter = max_search_iter
+        self.num_threads = num_threads
         
-    def update(self, scans_mm, pose_change=None, scan_angles_degrees=None, should_update_map=True):
+    def update(self, scans_mm, pose_change=None, scan_angles_degrees=None, should_update_map=True, distance_scale=1):
 
         if not pose_change:
         
             pose_change = (0, 0, 0)
     
-        CoreSLAM.update(self, scans_mm, pose_change, scan_angles_degrees, should_update_map)   
+        CoreSLAM.update(self, scans_mm, pose_change, scan_angles_degrees, should_update_map, distance_scale)   
     
     def _getNewPosition(self, start_position):
         '''
@@ -273,12 +462,216 @@ class RMHC_SLAM(SinglePositionSLAM):
             self.sigma_xy_mm,
             self.sigma_theta_degrees,
             self.max_search_iter,
-            self.randomizer)
+            self.randomizer,
+            self.num_threads)
                              
     def _random_normal(self, mu, sigma):
         
         return mu + self.randomizer.rnor() * sigma
 
+# BranchAndBound_SLAM class -------------------------------------------------------------------------------------------
+
+class BranchAndBound_SLAM(SinglePositionSLAM):
+    '''
+    BranchAndBound_SLAM implements the _getNewPosition() method of SinglePositionSLAM with an exact branch-and-bound
+    correlative scan matcher: every whole-pixel translation and every angular step within a window around the
+    starting position is considered, but whole blocks of translations are discarded at once using a pyramid of
+    min-pooled copies of the map, kept up to date as the map changes.
+    '''
+    
+    def __init__(self, laser, map_size_pixels, map_size_meters, 
+                map_quality=_DEFAULT_MAP_QUALITY, hole_width_mm=_DEFAULT_HOLE_WIDTH_MM,
+                window_xy_mm=_DEFAULT_WINDOW_XY_MM, window_theta_degrees=_DEFAULT_WINDOW_THETA_DEGREES,
+                step_theta_degrees=_DEFAULT_STEP_THETA_DEGREES, pyramid_levels=_DEFAULT_PYRAMID_LEVELS):
+        '''
+        Creates a BranchAndBound_SLAM object suitable for updating with new Lidar and odometry data.
+        laser is a Laser object representing the specifications of your Lidar unit
+        map_size_pixels is the size of the square map in pixels
+        map_size_meters is the size of the square map in meters
+        quality from 0 through 255 determines integration speed of scan into map
+        hole_width_mm determines width of obstacles (walls)
+        window_xy_mm is the largest translation searched along X and along Y
+        window_theta_degrees is the largest rotation searched either way
+        step_theta_degrees is the angular resolution of the search; None for the rotation that moves the
+           farthest scan point by one map pixel, which is much finer and slower
+        pyramid_levels is the number of map resolutions, each half the previous one; the coarsest should be
+           about as wide as the search window
+        '''
+    
+        SinglePositionSLAM.__init__(self, laser, map_size_pixels, map_size_meters, 
+            map_quality, hole_width_mm)
+            
+        self.window_xy_mm = window_xy_mm
+        self.window_theta_degrees = window_theta_degrees
+        self.step_theta_degrees = step_theta_degrees
+        self.pyramid_levels = pyramid_levels
+        
+        self.pyramid = pybreezyslam.MapPyramid(self.map, pyramid_levels)
+        
+        # candidates scored by the latest search, at any resolution
+        self.candidates_scored = 0
+        
+    def update(self, scans_mm, pose_change=None, scan_angles_degrees=None, should_update_map=True, distance_scale=1):
+
+        if not pose_change:
+        
+            pose_change = (0, 0, 0)
+    
+        CoreSLAM.update(self, scans_mm, pose_change, scan_angles_degrees, should_update_map, distance_scale)   
+    
+    def close(self):
+        
+        # the pyramid holds the map too
+        self.pyramid = None
+        CoreSLAM.close(self)
+        
+    def _mapChanged(self, rect):
+        
+        self.pyramid.update(rect)
+    
+    def _getNewPosition(self, start_position):
+        '''
+        Implements the _getNewPosition() method of SinglePositionSLAM. Returns the best-matching position within
+        the search window, or a copy of the starting position if none matches better.
+        '''     
+        
+        position, self.candidates_scored = pybreezyslam.bnbPositionSearch(
+            start_position, 
+            self.pyramid, 
+            self.scan_for_distance, 
+            self.window_xy_mm,
+            self.window_theta_degrees,
+            self.step_theta_degrees or 0)
+        
+        return position
+
+# ParticleSLAM class ---------------------------------------------------------------------------------------------------
+
+class ParticleSLAM(CoreSLAM):
+    '''
+    ParticleSLAM implements CoreSLAM with a cloud of weighted particles (positions): after each scan, every particle
+    is moved by the odometry plus noise and scored against the map in one native batch call, its weight multiplied
+    by the likelihood of its score, and the cloud is resampled with low-variance resampling when too few particles
+    carry the weight. The map is updated from the best particle, or from the weighted mean.
+    Unlike a single position, the cloud can keep several hypotheses, e.g. after the robot slipped.
+    '''
+    
+    def __init__(self, laser, map_size_pixels, map_size_meters, 
+                map_quality=_DEFAULT_MAP_QUALITY, hole_width_mm=_DEFAULT_HOLE_WIDTH_MM,
+                num_particles=_DEFAULT_NUM_PARTICLES, random_seed=None, sigma_xy_mm=_DEFAULT_PARTICLE_SIGMA_XY_MM,
+                sigma_theta_degrees=_DEFAULT_PARTICLE_SIGMA_THETA_DEGREES,
+                likelihood_temperature=_DEFAULT_LIKELIHOOD_TEMPERATURE,
+                resample_threshold=_DEFAULT_RESAMPLE_THRESHOLD, use_mean=False, num_threads=1,
+                map_tile_size_pixels=0):
+        '''
+        Creates a ParticleSLAM object suitable for updating with new Lidar and odometry data.
+        laser is a Laser object representing the specifications of your Lidar unit
+        map_size_pixels is the size of the square map in pixels
+        map_size_meters is the size of the square map in meters
+        quality from 0 through 255 determines integration speed of scan into map
+        hole_width_mm determines width of obstacles (walls)
+        num_particles is the size of the particle cloud
+        random_seed supports reproducible results; defaults to system time if unspecified
+        sigma_xy_mm and sigma_theta_degrees are the standard deviations of the noise added to each particle's
+           motion per scan
+        likelihood_temperature scales scan-to-map distances into likelihoods exp(-distance / temperature);
+           lower values trust the map more
+        resample_threshold is the fraction of num_particles below which the effective number of particles
+           triggers resampling
+        use_mean updates the map and position from the weighted mean of the particles instead of the best one
+        num_threads > 1 scores the particles on that many native threads
+        map_tile_size_pixels, a power of two, makes a tiled map that grows past map_size_meters in every direction,
+           in tiles of that size allocated as the robot explores; 0 for a dense map
+        '''
+        
+        if num_particles < 1:
+            raise ValueError('num_particles must be at least 1, not %d' % num_particles)
+    
+        CoreSLAM.__init__(self, laser, map_size_pixels, map_size_meters, 
+            map_quality, hole_width_mm, map_tile_size_pixels)
+            
+        if not random_seed:
+            random_seed = int(time.time()) & 0xFFFF
+            
+        self.randomizer = pybreezyslam.Randomizer(random_seed)
+        
+        self.num_particles = num_particles
+        self.sigma_xy_mm = sigma_xy_mm
+        self.sigma_theta_degrees = sigma_theta_degrees
+        self.likelihood_temperature = likelihood_temperature
+        self.resample_threshold = resample_threshold
+        self.use_mean = use_mean
+        self.num_threads = num_threads
+        
+        # Laser positions (x_mm, y_mm, theta_degrees) of all particles in one flat array, all at the center of map
+        init_coord_mm = 500 * map_size_meters
+        self.particles = array.array('d', (init_coord_mm, init_coord_mm, 0)) * num_particles
+        self.weights = array.array('d', [1. / num_particles]) * num_particles
+        self.distances = array.array('i', [0]) * num_particles
+        
+        self.effective_particles = float(num_particles)
+        self.position = pybreezyslam.Position(init_coord_mm, init_coord_mm, 0)
+        
+    def update(self, scans_mm, pose_change=None, scan_angles_degrees=None, should_update_map=True, distance_scale=1):
+
+        if not pose_change:
+        
+            pose_change = (0, 0, 0)
+    
+        CoreSLAM.update(self, scans_mm, pose_change, scan_angles_degrees, should_update_map, distance_scale)   
+    
+    def _updateMapAndPointcloud(self, dxy_mm, dtheta_degrees, should_update_map):
+        '''
+        Updates the map and point-cloud (particle cloud). Called automatically by CoreSLAM.update()
+        '''
+        
+        pybreezyslam.particlesPredict(self.particles, dxy_mm, dtheta_degrees, self.laser.offset_mm,
+                self.sigma_xy_mm, self.sigma_theta_degrees, self.randomizer)
+        
+        pybreezyslam.distanceScanToMapBatch(self.map, self.scan_for_distance, self.particles, self.distances,
+                self.num_threads)
+        
+        self.effective_particles = pybreezyslam.particlesWeigh(self.distances, self.weights, 
+                self.likelihood_temperature)
+        
+        laser_position = pybreezyslam.particlesEstimate(self.particles, self.weights, self.use_mean)
+        
+        # Current position, adjusted by laser offset
+        theta_radians = math.radians(laser_position.theta_degrees)
+        self.position = laser_position.copy()
+        self.position.x_mm -= self.laser.offset_mm * math.cos(theta_radians)
+        self.position.y_mm -= self.laser.offset_mm * math.sin(theta_radians)
+        
+        if should_update_map:
+            rect = self.map.update(self.scan_for_mapbuild, laser_position, self.map_quality, self.hole_width_mm)
+
+            if rect is not None:
+                self._mapChanged(rect)
+        
+        if self.effective_particles < self.resample_threshold * len(self.weights):
+            pybreezyslam.particlesResample(self.particles, self.weights, self.randomizer)
+    
+    def getpos(self):
+        '''
+        Returns current position as a tuple (x_mm, y_mm, theta_degrees)
+        '''
+        return (self.position.x_mm, self.position.y_mm, self.position.theta_degrees)
+    
+    def _setpos(self, position):
+        '''
+        Gathers all particles at position, adjusted by laser offset, with equal weights: load() restarts the cloud
+        at the saved position rather than saving it
+        '''
+        theta_radians = math.radians(position.theta_degrees)
+        laser_position = (position.x_mm + self.laser.offset_mm * math.cos(theta_radians),
+                          position.y_mm + self.laser.offset_mm * math.sin(theta_radians),
+                          position.theta_degrees)
+        
+        self.particles[:] = array.array('d', laser_position) * len(self.weights)
+        self.weights[:] = array.array('d', [1. / len(self.weights)]) * len(self.weights)
+        self.effective_particles = float(len(self.weights))
+        self.position = position.copy()
+
  # Deterministic_SLAM class  ------------------------------------------------------------------------------------        
 
 class Deterministic_SLAM(SinglePositionSLAM):
@@ -288,7 +681,7 @@ class Deterministic_SLAM(SinglePositionSLAM):
     '''
     
     def __init__(self, laser, map_size_pixels, map_size_meters, 
-                map_quality=_DEFAULT_MAP_QUALITY, hole_width_mm=_DEFAULT_HOLE_WIDTH_MM):
+                map_quality=_DEFAULT_MAP_QUALITY, hole_width_mm=_DEFAULT_HOLE_WIDTH_MM, map_tile_size_pixels=0):
         '''
         Creates a Deterministic_Slam object suitable for updating with new Lidar and odometry data.
         laser is a Laser object representing the specifications of your Lidar unit
@@ -296,10 +689,12 @@ class Deterministic_SLAM(SinglePositionSLAM):
         map_size_meters is the size of the square map in meters
         quality from 0 through 255 determines integration speed of scan into map
         hole_width_mm determines width of obstacles (walls)
+        map_tile_size_pixels, a power of two, makes a tiled map that grows past map_size_meters in every direction,
+           in tiles of that size allocated as the robot explores; 0 for a dense map
         '''
     
         SinglePositionSLAM.__init__(self, laser, map_size_pixels, map_size_meters, 
-            map_quality, hole_width_mm)                    
+            map_quality, hole_width_mm, map_tile_size_pixels)                    
        
     def _getNewPosition(self, start_position):
         '''
@@ -307,3 +702,170 @@ class Deterministic_SLAM(SinglePositionSLAM):
         '''
         
         return start_position.copy()
+
+
+# Map files ------------------------------------------------------------------------------------------------------------
+
+class _MapFile(object):
+    '''
+    A file written by CoreSLAM.save(), memory-mapped by CoreSLAM.load(): a page holding the header, the state
+    (position and random-number generator) and a JSON description of the SLAM object, then the map pixels in
+    native byte order, which a pybreezyslam.Map works on in place.
+    '''
+    
+    def __init__(self, path, persistent):
+        
+        self.path = os.path.abspath(path)
+        self.persistent = persistent
+        
+        self.file = open(path, 'r+b' if persistent else 'rb')
+        self.mmap = None
+        self.map = None
+        
+        self.stopping = None
+        self.flusher = None
+        
+        # nothing stays open on a file that cannot be loaded
+        try:
+            self._read(path)
+        except BaseException:
+            self._unmap()
+            raise
+            
+        if not persistent:
+            self.file.close()
+        
+    def _read(self, path):
+        
+        try:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, 
+                access=mmap.ACCESS_WRITE if self.persistent else mmap.ACCESS_COPY)
+            
+            if len(self.mmap) < _MAP_FILE_PIXELS_OFFSET:
+                raise ValueError('short header')
+            
+            magic, version, length = _MAP_FILE_HEADER.unpack_from(self.mmap)
+            
+            if magic != _MAP_FILE_MAGIC or version != _MAP_FILE_VERSION:
+                raise ValueError('bad magic')
+                
+            start = _MAP_FILE_DESCRIPTION_OFFSET
+            description = json.loads(self.mmap[start:start+length].decode())
+            
+            byteorder = description['byteorder']
+            self.size_pixels = description['map_size_pixels']
+            self.size_meters = description['map_size_meters']
+            self.laser = Laser(**description['laser'])
+            self.params = description['params']
+            self.class_name = description['class']
+            
+            x_mm, y_mm, theta_degrees, has_randomizer, random_state = _MAP_FILE_STATE.unpack_from(self.mmap, 
+                _MAP_FILE_HEADER.size)
+            
+        except (ValueError, KeyError, TypeError, struct.error):
+            raise ValueError('%s is not a version %d map file' % (path, _MAP_FILE_VERSION)) from None
+        
+        if byteorder != sys.byteorder:
+            raise ValueError('%s was saved on a %s-endian machine' % (path, byteorder))
+        
+        self.position = (x_mm, y_mm, theta_degrees)
+        self.random_state = random_state if has_randomizer else None
+        
+        size = self.size_pixels * self.size_pixels * 2
+        
+        if len(self.mmap) < _MAP_FILE_PIXELS_OFFSET + size:
+            raise ValueError('%s is truncated' % path)
+        
+        pixels = memoryview(self.mmap)[_MAP_FILE_PIXELS_OFFSET:_MAP_FILE_PIXELS_OFFSET+size].cast('H')
+        
+        try:
+            self.map = pybreezyslam.Map(self.size_pixels, self.size_meters, pixels=pixels)
+        except BaseException:
+            pixels.release()
+            raise
+        
+    @staticmethod
+    def write(path, slam):
+        
+        try:
+            pixels = memoryview(slam.map)
+        except BufferError:
+            raise ValueError('only dense maps can be saved')
+        
+        description = json.dumps({
+            'class': type(slam).__name__,
+            'byteorder': sys.byteorder,
+            'map_size_pixels': slam.map_size_pixels,
+            'map_size_meters': slam.map_size_meters,
+            'laser': dict((name, getattr(slam.laser, name)) for name in inspect.signature(Laser).parameters),
+            'params': slam._getparams()}).encode()
+        
+        if _MAP_FILE_DESCRIPTION_OFFSET + len(description) > _MAP_FILE_PIXELS_OFFSET:
+            raise ValueError('too many parameters to save')
+        
+        header = bytearray(_MAP_FILE_PIXELS_OFFSET)
+        _MAP_FILE_HEADER.pack_into(header, 0, _MAP_FILE_MAGIC, _MAP_FILE_VERSION, len(description))
+        _MapFile.pack_state(header, slam)
+        header[_MAP_FILE_DESCRIPTION_OFFSET:_MAP_FILE_DESCRIPTION_OFFSET+len(description)] = description
+        
+        # a complete file or none: a crash while saving leaves the previous one
+        temporary = path + '.tmp'
+        
+        with open(temporary, 'wb') as f:
+            f.write(header)
+            f.write(pixels)
+            f.flush()
+            os.fsync(f.fileno())
+            
+        os.replace(temporary, path)
+        
+    @staticmethod
+    def pack_state(buffer, slam):
+        
+        randomizer = getattr(slam, 'randomizer', None)
+        
+        _MAP_FILE_STATE.pack_into(buffer, _MAP_FILE_HEADER.size, *slam.getpos(), 
+            randomizer is not None, randomizer.getstate() if randomizer else 0)
+        
+    def write_state(self, slam):
+        
+        _MapFile.pack_state(self.mmap, slam)
+        
+    def flush(self):
+        
+        # on Linux, fsync() also writes the pages changed through the mapping; unlike mmap.flush(), it lets
+        # other threads run meanwhile
+        os.fsync(self.file.fileno())
+        
+    def start_flushing(self, interval_seconds):
+        
+        self.stopping = threading.Event()
+        self.flusher = threading.Thread(target=self._flush_every, args=(interval_seconds,), daemon=True)
+        self.flusher.start()
+        
+    def _flush_every(self, interval_seconds):
+        
+        while not self.stopping.wait(interval_seconds):
+            self.flush()
+            
+    def close(self):
+        
+        if self.flusher:
+            self.stopping.set()
+            self.flusher.join()
+            self.flusher = None
+            
+        if not self.file.closed:
+            self.flush()
+            
+        self._unmap()
+        
+    def _unmap(self):
+        
+        # the mapping only closes once nothing views it: the SLAM object drops its Map first
+        self.map = None
+        
+        if self.mmap is not None and not self.mmap.closed:
+            self.mmap.close()
+            
+        self.file.close()
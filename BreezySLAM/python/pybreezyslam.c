@@ -20,6 +20,9 @@ along with this code.  If not, see <http://www.gnu.org/licenses/>.
 #include <Python.h>
 #include <structmember.h>
 
+#include <math.h>
+#include <string.h>
+
 #include "../c/coreslam.h"
 #include "../c/random.h"
 #include "pyextension_utils.h"
@@ -179,6 +182,9 @@ typedef struct
     int   * lidar_distances_mm;
     float * lidar_angles_deg;
     
+    // held while the scan is read or written without the GIL
+    PyThread_type_lock lock;
+    
 } Scan;
 
 
@@ -190,6 +196,11 @@ Scan_dealloc(Scan* self)
     free(self->lidar_distances_mm);
     free(self->lidar_angles_deg);
     
+    if (self->lock)
+    {
+        PyThread_free_lock(self->lock);
+    }
+    
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
@@ -248,6 +259,12 @@ Scan_init(Scan *self, PyObject *args, PyObject *kwds)
     self->lidar_distances_mm = int_alloc(self->scan.size);
     self->lidar_angles_deg   = float_alloc(self->scan.size);
     
+    if (!self->lock && !(self->lock = PyThread_allocate_lock()))
+    {
+        PyErr_NoMemory();
+        return -1;
+    }
+    
     return 0;
 }
 
@@ -265,6 +282,91 @@ Scan_str(Scan *self)
 }
 
 
+// Helpers for Scan.update(): scan values and angles may be given as a list of numbers or as any
+// one-dimensional buffer of floats or integers (numpy arrays, array.array, memoryviews), which is
+// read in place without creating Python objects.
+
+typedef struct
+{
+    PyObject * list;
+    Py_buffer view;
+    char format;
+    Py_ssize_t size;
+
+} scan_values_t;
+
+static int scan_values_open(PyObject * obj, scan_values_t * values, const char * details)
+{
+    values->list = NULL;
+
+    if (PyList_Check(obj))
+    {
+        values->list = obj;
+        values->size = PyList_Size(obj);
+        return 0;
+    }
+
+    if (PyObject_GetBuffer(obj, &values->view, PyBUF_FORMAT | PyBUF_STRIDES) < 0)
+    {
+        PyErr_Clear();
+        return error_on_raise_argument_exception_with_details("Scan", "update", details);
+    }
+
+    // Skip byte-order / alignment prefix; only native order makes sense here
+    const char * format = values->view.format ? values->view.format : "B";
+    if (*format == '@' || *format == '=')
+    {
+        format++;
+    }
+
+    values->format = format[0];
+    values->size = values->view.shape ? values->view.shape[0] : values->view.len / values->view.itemsize;
+
+    if (values->view.ndim != 1 || format[1] != 0 || !strchr("fdbBhHiIlLqQ", values->format))
+    {
+        PyBuffer_Release(&values->view);
+        return error_on_raise_argument_exception_with_details("Scan", "update", details);
+    }
+
+    return 0;
+}
+
+static double scan_values_get(scan_values_t * values, Py_ssize_t k)
+{
+    if (values->list)
+    {
+        return PyFloat_AsDouble(PyList_GetItem(values->list, k));
+    }
+
+    const char * item = (const char *)values->view.buf + k * values->view.strides[0];
+
+    switch (values->format)
+    {
+        case 'f': return *(const float *)item;
+        case 'd': return *(const double *)item;
+        case 'b': return *(const signed char *)item;
+        case 'B': return *(const unsigned char *)item;
+        case 'h': return *(const short *)item;
+        case 'H': return *(const unsigned short *)item;
+        case 'i': return *(const int *)item;
+        case 'I': return *(const unsigned int *)item;
+        case 'l': return *(const long *)item;
+        case 'L': return *(const unsigned long *)item;
+        case 'q': return (double)*(const long long *)item;
+        case 'Q': return (double)*(const unsigned long long *)item;
+    }
+
+    return 0;
+}
+
+static void scan_values_close(scan_values_t * values)
+{
+    if (!values->list)
+    {
+        PyBuffer_Release(&values->view);
+    }
+}
+
 static PyObject *
 Scan_update(Scan *self, PyObject *args, PyObject *kwds)
 {
@@ -272,94 +374,138 @@ Scan_update(Scan *self, PyObject *args, PyObject *kwds)
     double hole_width_mm = 0;
     PyObject * py_velocities = NULL;
     PyObject * py_scan_angles_degrees = NULL;
+    double distance_scale = 1;
 
-    static char* argnames[] = {"scans_mm", "hole_width_mm", "velocities", "scan_angles_degrees", NULL};
+    static char* argnames[] = {"scans_mm", "hole_width_mm", "velocities", "scan_angles_degrees", 
+        "distance_scale", NULL};
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwds,"Od|OO", argnames,
+    if (!PyArg_ParseTupleAndKeywords(args, kwds,"Od|OOd", argnames,
         &py_lidar, 
         &hole_width_mm,
         &py_velocities,
-        &py_scan_angles_degrees))
+        &py_scan_angles_degrees,
+        &distance_scale))
     {
         return null_on_raise_argument_exception("Scan", "update");
     }
 
+    // Default to no velocities
+    double dxy_mm = 0;
+    double dtheta_degrees = 0;
+
+    // Bozo filter on velocities tuple
+    if (py_velocities && py_velocities != Py_None)
+    {
+        if (!PyTuple_Check(py_velocities))
+        {
+            return null_on_raise_argument_exception_with_details("Scan", "update", 
+                    "velocities must be a tuple");    
+        }
+
+        if (!double_from_tuple(py_velocities, 0, &dxy_mm) ||
+                !double_from_tuple(py_velocities, 1, &dtheta_degrees))
+        {
+            return null_on_raise_argument_exception_with_details("Scan", "update", 
+                    "velocities tuple must contain at least two numbers");    
+
+        }
+    }
+
     // Bozo filter on LIDAR argument
-    if (!PyList_Check(py_lidar))
+    scan_values_t lidar;
+    if (scan_values_open(py_lidar, &lidar, "lidar must be a list or a buffer of numbers"))
     {
-        return null_on_raise_argument_exception_with_details("Scan", "update", 
-            "lidar must be a list");
+        return NULL;
     }
 
+    int have_angles = py_scan_angles_degrees && py_scan_angles_degrees != Py_None;
+    scan_values_t angles;
+
     // Scan angles provided
-    if (py_scan_angles_degrees != Py_None) 
+    if (have_angles) 
     {
-        // Bozo filter #1: SCAN_ANGLES_DEGREES  must be a list
-        if (!PyList_Check(py_scan_angles_degrees))
+        // Bozo filter #1: SCAN_ANGLES_DEGREES  must be a list or a buffer
+        if (scan_values_open(py_scan_angles_degrees, &angles, "scan angles must be a list or a buffer of numbers"))
         {
-            return null_on_raise_argument_exception_with_details("Scan", "update", 
-                    "scan angles must be a list");
+            scan_values_close(&lidar);
+            return NULL;
         }
 
         // Bozo filter #2: must have same number of scan angles as scan distances
-        if (PyList_Size(py_lidar) != PyList_Size(py_scan_angles_degrees))
+        if (lidar.size != angles.size)
         {
+            scan_values_close(&lidar);
+            scan_values_close(&angles);
             return null_on_raise_argument_exception_with_details("Scan", "update", 
                     "number of scan angles must equal number of scan distances");
         }
 
-        // Extract scan angle values from argument
-        for (int k=0; k<PyList_Size(py_scan_angles_degrees); ++k)
+        // Bozo filter #3: angles are interpolated into buffers holding one laser scan
+        if (lidar.size > self->scan.size)
         {
-            self->lidar_angles_deg[k] = (float)PyFloat_AsDouble(PyList_GetItem(py_scan_angles_degrees, k));
+            scan_values_close(&lidar);
+            scan_values_close(&angles);
+            return null_on_raise_argument_exception_with_details("Scan", "update", 
+                    "more scan distances than laser scan size");
         }
     }
 
     // No scan angles provided; lidar-list size must match scan size
-    else if (PyList_Size(py_lidar) != self->scan.size)
+    else if (lidar.size != self->scan.size)
     {        
+        scan_values_close(&lidar);
         return null_on_raise_argument_exception_with_details("Scan", "update", 
                 "lidar size mismatch");
     }
 
-    // Default to no velocities
-    double dxy_mm = 0;
-    double dtheta_degrees = 0;
+    // The value buffers belong to the scan: copy into them under its lock
+    acquire_lock_allowing_threads(self->lock);
 
-    // Bozo filter on velocities tuple
-    if (py_velocities != Py_None)
+    // Extract scan angle values from argument
+    if (have_angles)
     {
-        if (!PyTuple_Check(py_velocities))
+        for (Py_ssize_t k=0; k<angles.size; ++k)
         {
-            return null_on_raise_argument_exception_with_details("Scan", "update", 
-                    "velocities must be a tuple");    
+            self->lidar_angles_deg[k] = (float)scan_values_get(&angles, k);
         }
 
-        if (!double_from_tuple(py_velocities, 0, &dxy_mm) ||
-                !double_from_tuple(py_velocities, 1, &dtheta_degrees))
-        {
-            return null_on_raise_argument_exception_with_details("Scan", "update", 
-                    "velocities tuple must contain at least two numbers");    
+        scan_values_close(&angles);
+    }
 
-        }
+    // Extract LIDAR values from argument; missing (NaN, infinite) values count as no detection
+    for (Py_ssize_t k=0; k<lidar.size; ++k)
+    {
+        double distance_mm = scan_values_get(&lidar, k) * distance_scale;
+        self->lidar_distances_mm[k] = isfinite(distance_mm) ? (int)distance_mm : 0;
     }
 
-    // Extract LIDAR values from argument
-    for (int k=0; k<PyList_Size(py_lidar); ++k)
+    int scan_size = (int)lidar.size;
+
+    scan_values_close(&lidar);
+
+    if (PyErr_Occurred())
     {
-        self->lidar_distances_mm[k] = (int)PyFloat_AsDouble(PyList_GetItem(py_lidar, k));
+        PyThread_release_lock(self->lock);
+        return null_on_raise_argument_exception_with_details("Scan", "update", 
+                "scan values must be numbers");
     }
 
-    // Update the scan
+    // Update the scan; everything it needs is now in C structures
+    Py_BEGIN_ALLOW_THREADS
+
     scan_update(
             &self->scan, 
-            (py_scan_angles_degrees != Py_None) ? self->lidar_angles_deg :NULL,
+            have_angles ? self->lidar_angles_deg : NULL,
             self->lidar_distances_mm, 
-            PyList_Size(py_lidar),
+            scan_size,
             hole_width_mm,
             dxy_mm,
             dtheta_degrees);
 
+    Py_END_ALLOW_THREADS
+
+    PyThread_release_lock(self->lock);
+
     Py_RETURN_NONE;
 
 } // Scan_update
@@ -368,11 +514,15 @@ Scan_update(Scan *self, PyObject *args, PyObject *kwds)
 static PyMethodDef Scan_methods[] = 
 {
     {"update", (PyCFunction)Scan_update, METH_VARARGS | METH_KEYWORDS, 
-        "Scan.update(scans_mm, hole_width_mm, velocities=None) updates scan.\n"\
-            "scans_mm is a list of integers representing scanned distances in mm.\n"\
+        "Scan.update(scans_mm, hole_width_mm, velocities=None, scan_angles_degrees=None, distance_scale=1)\n"\
+            "updates scan.\n"\
+            "scans_mm is a list of integers representing scanned distances in mm, or any one-dimensional\n"\
+            "buffer of floats or integers (numpy array, array.array, memoryview), read without copying.\n"\
             "hole_width_mm is the width of holes (obstacles, walls) in millimeters.\n"\
             "velocities is an optional tuple containing (dxy_mm/dt, dtheta_degrees/dt);\n"\
-            "i.e., robot's (forward, rotational velocity) for improving the quality of the scan."
+            "i.e., robot's (forward, rotational velocity) for improving the quality of the scan.\n"\
+            "scan_angles_degrees is an optional list or buffer of angles, one per scanned distance.\n"\
+            "distance_scale multiplies each scanned distance to get mm, e.g. 1000 for distances in meters."
     },
     {NULL}  // Sentinel 
 };
@@ -440,19 +590,36 @@ typedef struct
     
     map_t map;
     
+    // shape and strides of the buffer-protocol view of the pixels
+    Py_ssize_t shape[2];
+    Py_ssize_t strides[2];
+    
+    // held while the map is read or written without the GIL
+    PyThread_type_lock lock;
+    
+    // the caller's buffer a map made with Map(pixels=...) works on
+    Py_buffer pixels_view;
+    
 } Map;
 
-// Helper for Map.__init__(), Map.set()
-static int bad_mapbytes(PyObject * py_mapbytes, int size_pixels, const char * methodname)
+// Helper for Map.__init__(), Map.get(), Map.set(): accepts any contiguous buffer holding one byte
+// (bytearray, bytes, uint8 array) or one unsigned short (uint16 array) per pixel.
+static int get_mapbuffer(PyObject * py_mapbuffer, int size_pixels, int writable, 
+        const char * methodname, Py_buffer * view)
 {    
-    if (!PyByteArray_Check(py_mapbytes))
+    int flags = PyBUF_C_CONTIGUOUS | PyBUF_FORMAT | (writable ? PyBUF_WRITABLE : 0);
+    
+    if (PyObject_GetBuffer(py_mapbuffer, view, flags) < 0)
     {
+        PyErr_Clear();
         return error_on_raise_argument_exception_with_details("Map", methodname, 
-            "argument is not a byte array");        
+            writable ? "argument is not a writable contiguous buffer" : "argument is not a contiguous buffer");        
     }
     
-    if (PyByteArray_GET_SIZE(py_mapbytes) != (size_pixels * size_pixels))
+    if ((view->itemsize != 1 && view->itemsize != sizeof(pixel_t)) ||
+        view->len != (Py_ssize_t)size_pixels * size_pixels * view->itemsize)
     {        
+        PyBuffer_Release(view);
         return error_on_raise_argument_exception_with_details("Map", methodname, 
             "mapbytes are wrong size");
     }
@@ -460,11 +627,33 @@ static int bad_mapbytes(PyObject * py_mapbytes, int size_pixels, const char * me
     return 0;
 }
 
+static void set_from_mapbuffer(map_t * map, Py_buffer * view)
+{
+    if (view->itemsize == 1)
+    {
+        map_set(map, (char *)view->buf);
+    }
+    else
+    {
+        map_set_pixels(map, (pixel_t *)view->buf);
+    }
+}
+
 static void
 Map_dealloc(Map* self)
 {            
     map_free(&self->map);
     
+    if (self->pixels_view.obj)
+    {
+        PyBuffer_Release(&self->pixels_view);
+    }
+    
+    if (self->lock)
+    {
+        PyThread_free_lock(self->lock);
+    }
+    
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
@@ -484,22 +673,100 @@ Map_init(Map *self, PyObject *args, PyObject *kwds)
 	int size_pixels;
 	double size_meters;
 	PyObject * py_bytes = NULL;
+	int tile_size_pixels = 0;
+	PyObject * py_pixels = NULL;
 	
-    static char * argnames[] = {"size_pixels", "size_meters", "bytes", NULL};
+    static char * argnames[] = {"size_pixels", "size_meters", "bytes", "tile_size_pixels", "pixels", NULL};
 
-    if(!PyArg_ParseTupleAndKeywords(args, kwds,"id|O", argnames, 
+    if(!PyArg_ParseTupleAndKeywords(args, kwds,"id|OiO", argnames, 
         &size_pixels, 
         &size_meters, 
-        &py_bytes))
+        &py_bytes,
+        &tile_size_pixels,
+        &py_pixels))
     {
         return error_on_raise_argument_exception("Map");
     }
+    
+    if (py_pixels == Py_None)
+    {
+        py_pixels = NULL;
+    }
+    
+    if (py_pixels && (tile_size_pixels || (py_bytes && py_bytes != Py_None)))
+    {
+        return error_on_raise_argument_exception_with_details("Map", "__init__", 
+                "pixels cannot be combined with bytes or tile_size_pixels");
+    }
+    
+    int tile_bits = 0;
+    
+    if (tile_size_pixels)
+    {
+        while ((1 << tile_bits) < tile_size_pixels && tile_bits < 12)
+        {
+            ++tile_bits;
+        }
+        
+        if ((1 << tile_bits) != tile_size_pixels || tile_bits < 3)
+        {
+            return error_on_raise_argument_exception_with_details("Map", "__init__", 
+                    "tile_size_pixels must be a power of two from 8 to 4096");
+        }
+    }
+    
+    if (self->map.pixels || self->map.tiles)
+    {
+        return error_on_raise_argument_exception_with_details("Map", "__init__", "already initialized");
+    }
            
-    map_init(&self->map, size_pixels, size_meters);
+    if (py_pixels)
+    {
+        if (get_mapbuffer(py_pixels, size_pixels, 1, "__init__", &self->pixels_view))
+        {
+            return -1;
+        }
+        
+        if (self->pixels_view.itemsize != sizeof(pixel_t))
+        {
+            PyBuffer_Release(&self->pixels_view);
+            return error_on_raise_argument_exception_with_details("Map", "__init__", 
+                    "pixels must be a uint16 buffer");
+        }
+        
+        map_init_external(&self->map, size_pixels, size_meters, (pixel_t *)self->pixels_view.buf);
+    }
+    else if (tile_bits)
+    {
+        map_init_tiled(&self->map, size_pixels, size_meters, tile_bits);
+    }
+    else
+    {
+        map_init(&self->map, size_pixels, size_meters);
+    }
+    
+    self->shape[0] = self->shape[1] = size_pixels;
+    self->strides[0] = size_pixels * sizeof(pixel_t);
+    self->strides[1] = sizeof(pixel_t);
+    
+    if (!self->lock && !(self->lock = PyThread_allocate_lock()))
+    {
+        PyErr_NoMemory();
+        return -1;
+    }
     
-    if (py_bytes && !bad_mapbytes(py_bytes, size_pixels, "__init__"))
+    if (py_bytes && py_bytes != Py_None)
     {    
-        map_set(&self->map, PyByteArray_AsString(py_bytes));
+        Py_buffer view;
+        
+        if (get_mapbuffer(py_bytes, size_pixels, 0, "__init__", &view))
+        {
+            return -1;
+        }
+        
+        set_from_mapbuffer(&self->map, &view);
+        
+        PyBuffer_Release(&view);
     }
     
     return 0;
@@ -521,18 +788,37 @@ static PyObject *
 Map_get(Map * self, PyObject * args, PyObject * kwds)
 {        
     PyObject * py_mapbytes = NULL;
+    Py_buffer view;
 
     if (!PyArg_ParseTuple(args, "O", &py_mapbytes))
     {
         return null_on_raise_argument_exception("Map", "get");
     }
     
-    if (bad_mapbytes(py_mapbytes, self->map.size_pixels, "get"))
+    if (get_mapbuffer(py_mapbytes, self->map.size_pixels, 1, "get", &view))
     {
-        Py_RETURN_NONE;
+        return NULL;
     }
     
-    map_get(&self->map, PyByteArray_AsString(py_mapbytes));
+    // The exported buffer cannot be resized or freed until it is released
+    acquire_lock_allowing_threads(self->lock);
+    
+    Py_BEGIN_ALLOW_THREADS
+    
+    if (view.itemsize == 1)
+    {
+        map_get(&self->map, (char *)view.buf);
+    }
+    else
+    {
+        map_get_pixels(&self->map, (pixel_t *)view.buf);
+    }
+    
+    Py_END_ALLOW_THREADS
+    
+    PyThread_release_lock(self->lock);
+    
+    PyBuffer_Release(&view);
     
     Py_RETURN_NONE;
 }
@@ -541,22 +827,73 @@ static PyObject *
 Map_set(Map * self, PyObject * args, PyObject * kwds)
 {        
     PyObject * py_mapbytes = NULL;
+    Py_buffer view;
 
     if (!PyArg_ParseTuple(args, "O", &py_mapbytes))
     {
-        return null_on_raise_argument_exception("Map", "get");
+        return null_on_raise_argument_exception("Map", "set");
     }
     
-    if (bad_mapbytes(py_mapbytes, self->map.size_pixels, "get"))
+    if (get_mapbuffer(py_mapbytes, self->map.size_pixels, 0, "set", &view))
     {
-        Py_RETURN_NONE;
+        return NULL;
     }
     
-    map_set(&self->map, PyByteArray_AsString(py_mapbytes));
+    acquire_lock_allowing_threads(self->lock);
+    
+    Py_BEGIN_ALLOW_THREADS
+    set_from_mapbuffer(&self->map, &view);
+    Py_END_ALLOW_THREADS
+    
+    PyThread_release_lock(self->lock);
+    
+    PyBuffer_Release(&view);
     
     Py_RETURN_NONE;
 }
 
+// Exposes the pixels as a read-only, two-dimensional array of unsigned shorts, so that
+// numpy.asarray(map) is a live view of the map without any copy.
+static int
+Map_getbuffer(Map * self, Py_buffer * view, int flags)
+{
+    if (flags & PyBUF_WRITABLE)
+    {
+        PyErr_SetString(PyExc_BufferError, "Map pixels are read-only; use Map.set() to change them");
+        view->obj = NULL;
+        return -1;
+    }
+    
+    if (self->map.tiles)
+    {
+        PyErr_SetString(PyExc_BufferError, "a tiled Map has no contiguous pixels; use Map.get_rect() to read them");
+        view->obj = NULL;
+        return -1;
+    }
+    
+    view->buf = self->map.pixels;
+    view->obj = (PyObject *)self;
+    view->len = self->shape[0] * self->strides[0];
+    view->readonly = 1;
+    view->itemsize = sizeof(pixel_t);
+    view->format = (flags & PyBUF_FORMAT) ? "H" : NULL;
+    view->ndim = 2;
+    view->shape = (flags & PyBUF_ND) ? self->shape : NULL;
+    view->strides = ((flags & PyBUF_STRIDES) == PyBUF_STRIDES) ? self->strides : NULL;
+    view->suboffsets = NULL;
+    view->internal = NULL;
+    
+    Py_INCREF(self);
+    
+    return 0;
+}
+
+static PyBufferProcs Map_as_buffer = 
+{
+    .bf_getbuffer = (getbufferproc)Map_getbuffer,
+    .bf_releasebuffer = NULL,
+};
+
 static PyObject *
 Map_update(Map *self, PyObject *args, PyObject *kwds)
 {   
@@ -584,78 +921,258 @@ Map_update(Map *self, PyObject *args, PyObject *kwds)
             
     position_t position = pypos2cpos(py_position);
     
-    map_update(
+    int rect[4];
+    int touched;
+    
+    // Locks are always taken in map, scan, randomizer, pyramid order
+    acquire_lock_allowing_threads(self->lock);
+    acquire_lock_allowing_threads(py_scan->lock);
+    
+    Py_BEGIN_ALLOW_THREADS
+    touched = map_update_rect(
         &self->map, 
         &py_scan->scan, 
         position,
         map_quality, 
-        hole_width_mm);
+        hole_width_mm,
+        rect);
+    Py_END_ALLOW_THREADS
+    
+    PyThread_release_lock(py_scan->lock);
+    PyThread_release_lock(self->lock);
+    
+    if (!touched)
+    {
+        Py_RETURN_NONE;
+    }
 
-    Py_RETURN_NONE;
+    return Py_BuildValue("iiii", rect[0], rect[1], rect[2], rect[3]);
 }
 
-static PyMethodDef Map_methods[] = 
-{
-    {"update", (PyCFunction)Map_update, METH_VARARGS, 
-    "Map.update(Scan, Position, quality, hole_width_mm) updates map based on scan and position.\n"\
-    "Quality from 0 through 255 determines integration speed of scan into map.\n"\
-    "Hole width determines width of obstacles (walls)."
-    },
-    {"get", (PyCFunction)Map_get, METH_VARARGS,
-    "Map.get(bytearray) fills byte array with map pixels, where bytearray length is square of size of map."
-    },
-    {"set", (PyCFunction)Map_set, METH_VARARGS,
-    "Map.set(bytearray) fills current map with pixels in bytearray, where bytearray length is square of size of map."
-    },
-    {NULL}  // Sentinel 
-};
+static PyObject *
+Map_take_dirty(Map *self, PyObject *args, PyObject *kwds)
+{   
+    int rect[4];
+    
+    acquire_lock_allowing_threads(self->lock);
+    int dirty = map_take_dirty(&self->map, rect);
+    PyThread_release_lock(self->lock);
+    
+    if (!dirty)
+    {
+        Py_RETURN_NONE;
+    }
 
-#define TP_DOC_MAP \
-"A class for maps used in SLAM.\n"\
-"Map.__init__(size_pixels, size_meters, bytes=None)"
+    return Py_BuildValue("iiii", rect[0], rect[1], rect[2], rect[3]);
+}
 
+static PyObject *
+Map_get_rect(Map * self, PyObject * args, PyObject * kwds)
+{        
+    PyObject * py_pixels = NULL;
+    int rect[4];
 
-static PyTypeObject pybreezyslam_MapType = 
-{
-    #if PY_MAJOR_VERSION < 3
-    PyObject_HEAD_INIT(NULL)
-    0,                                          // ob_size
-    #else
-    PyVarObject_HEAD_INIT(NULL, 0)
-    #endif
-    "pybreezyslam.Map",                       // tp_name
-    sizeof(Map),                                // tp_basicsize
-    0,                                          // tp_itemsize
-    (destructor)Map_dealloc,                    // tp_dealloc
-    0,                                          // tp_print
-    0,                                          // tp_getattr
-    0,                                          // tp_setattr
-    0,                                          // tp_compare
-    (reprfunc)Map_str,                          // tp_repr
-    0,                                          // tp_as_number
-    0,                                          // tp_as_sequence
-    0,                                          // tp_as_positionping
-    0,                                          // tp_hash 
-    0,                                          // tp_call
-    (reprfunc)Map_str,                          // tp_str
-    0,                                          // tp_getattro
-    0,                                          // tp_setattro
-    0,                                          // tp_as_buffer
-    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,   // tp_flags
-    TP_DOC_MAP,                                 // tp_doc 
-    0,                                          // tp_traverse 
-    0,                                          // tp_clear 
-    0,                                          // tp_richcompare 
-    0,                                          // tp_weaklistoffset 
-    0,                                          // tp_iter 
-    0,                                          // tp_iternext 
-    Map_methods,                         		// tp_methods 
-    0,                         					// tp_members 
-    0,                                          // tp_getset 
-    0,                                          // tp_base 
-    0,                                          // tp_dict 
-    0,                                          // tp_descr_get 
-    0,                                          // tp_descr_set 
+    if (!PyArg_ParseTuple(args, "O(iiii)", &py_pixels, &rect[0], &rect[1], &rect[2], &rect[3]))
+    {
+        return null_on_raise_argument_exception("Map", "get_rect");
+    }
+    
+    if (rect[2] < 0 || rect[3] < 0)
+    {
+        return null_on_raise_argument_exception_with_details("Map", "get_rect", "rect has a negative size");
+    }
+    
+    Py_buffer view;
+    
+    if (PyObject_GetBuffer(py_pixels, &view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT | PyBUF_WRITABLE) < 0)
+    {
+        PyErr_Clear();
+        return null_on_raise_argument_exception_with_details("Map", "get_rect", 
+            "argument is not a writable contiguous buffer");        
+    }
+    
+    Py_ssize_t npix = (Py_ssize_t)rect[2] * rect[3];
+    
+    if ((view.itemsize != 1 && view.itemsize != sizeof(pixel_t)) || view.len != npix * view.itemsize)
+    {        
+        PyBuffer_Release(&view);
+        return null_on_raise_argument_exception_with_details("Map", "get_rect", "buffer does not match rect");
+    }
+    
+    pixel_t * pixels = view.itemsize == 1 ? (pixel_t *)PyMem_Malloc(npix * sizeof(pixel_t)) : (pixel_t *)view.buf;
+    
+    if (!pixels)
+    {
+        PyBuffer_Release(&view);
+        return PyErr_NoMemory();
+    }
+    
+    acquire_lock_allowing_threads(self->lock);
+    
+    Py_BEGIN_ALLOW_THREADS
+    
+    map_get_rect(&self->map, rect, pixels);
+    
+    if (view.itemsize == 1)
+    {
+        Py_ssize_t k = 0;
+        for (k=0; k<npix; ++k)
+        {
+            ((char *)view.buf)[k] = pixels[k] >> 8;
+        }
+    }
+    
+    Py_END_ALLOW_THREADS
+    
+    PyThread_release_lock(self->lock);
+    
+    if (view.itemsize == 1)
+    {
+        PyMem_Free(pixels);
+    }
+    
+    PyBuffer_Release(&view);
+    
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+Map_bounds(Map *self, PyObject *args, PyObject *kwds)
+{   
+    int rect[4];
+    
+    acquire_lock_allowing_threads(self->lock);
+    int bounded = map_bounds(&self->map, rect);
+    PyThread_release_lock(self->lock);
+    
+    if (!bounded)
+    {
+        Py_RETURN_NONE;
+    }
+
+    return Py_BuildValue("iiii", rect[0], rect[1], rect[2], rect[3]);
+}
+
+static PyObject *
+Map_memory(Map *self, PyObject *args, PyObject *kwds)
+{   
+    map_t * map = &self->map;
+    
+    Py_ssize_t bytes = 0;
+    
+    acquire_lock_allowing_threads(self->lock);
+    
+    if (map->tiles)
+    {
+        Py_ssize_t tile_bytes = (((Py_ssize_t)1 << (2 * map->tile_bits)) + 1) * sizeof(pixel_t);
+        
+        Py_ssize_t block_bytes = ((Py_ssize_t)map->block_tiles * map->block_tiles << (2 * map->tile_bits)) * sizeof(pixel_t);
+        
+        /* tiles of their own, the blank one, the block and the directory */
+        bytes = (map->tiles_allocated - map->block_allocated + 1) * tile_bytes + block_bytes + sizeof(pixel_t) + 
+            (Py_ssize_t)map->tiles_nx * map->tiles_ny * sizeof(pixel_t *);
+    }
+    else
+    {
+        bytes = (Py_ssize_t)map->size_pixels * map->size_pixels * sizeof(pixel_t);
+    }
+    
+    PyThread_release_lock(self->lock);
+    
+    return PyLong_FromSsize_t(bytes);
+}
+
+static PyMethodDef Map_methods[] = 
+{
+    {"update", (PyCFunction)Map_update, METH_VARARGS, 
+    "Map.update(Scan, Position, quality, hole_width_mm) updates map based on scan and position.\n"\
+    "Quality from 0 through 255 determines integration speed of scan into map.\n"\
+    "Hole width determines width of obstacles (walls).\n"\
+    "Returns the (x, y, width, height) box of pixels touched by the update, or None."
+    },
+    {"take_dirty", (PyCFunction)Map_take_dirty, METH_NOARGS,
+    "Map.take_dirty() returns the (x, y, width, height) box of pixels changed since the previous call, or None,\n"\
+    "and clears it. A new map, or one filled by Map.set(), is entirely dirty."
+    },
+    {"get", (PyCFunction)Map_get, METH_VARARGS,
+    "Map.get(bytearray) fills byte array with map pixels, where bytearray length is square of size of map.\n"\
+    "Any writable contiguous buffer works: one byte per pixel gets the top eight bits of each pixel, while\n"\
+    "a uint16 array gets a copy of the raw pixels."
+    },
+    {"set", (PyCFunction)Map_set, METH_VARARGS,
+    "Map.set(bytearray) fills current map with pixels in bytearray, where bytearray length is square of size of map.\n"\
+    "Accepts the same buffers as Map.get()."
+    },
+    {"get_rect", (PyCFunction)Map_get_rect, METH_VARARGS,
+    "Map.get_rect(buffer, rect) fills buffer with the pixels of the (x, y, width, height) box rect, row by row.\n"\
+    "The box may lie anywhere: pixels off a dense map, or never touched on a tiled one, read as unknown.\n"\
+    "buffer takes width * height bytes or uint16 values, as in Map.get()."
+    },
+    {"bounds", (PyCFunction)Map_bounds, METH_NOARGS,
+    "Map.bounds() returns the (x, y, width, height) box of the tiles allocated so far, the whole map\n"\
+    "for a dense map, or None for a tiled map that no scan has touched."
+    },
+    {"memory", (PyCFunction)Map_memory, METH_NOARGS,
+    "Map.memory() returns the number of bytes holding the pixels."
+    },
+    {NULL}  // Sentinel 
+};
+
+#define TP_DOC_MAP \
+"A class for maps used in SLAM.\n"\
+"Map.__init__(size_pixels, size_meters, bytes=None, tile_size_pixels=0, pixels=None)\n"\
+"pixels, a writable contiguous buffer of size_pixels * size_pixels uint16 values, e.g. a memoryview of an\n"\
+"mmap, becomes the map's own pixels, as they are and without any copy: the map keeps the buffer for its life.\n"\
+"tile_size_pixels, a power of two, makes a tiled map: tiles that size are allocated when a scan first\n"\
+"touches them, and the map grows past size_pixels in every direction. size_pixels then only sets the scale\n"\
+"and the window that Map.get() and Map.set() use; Map.get_rect() reads anywhere.\n"\
+"Dense maps support the buffer protocol: numpy.asarray(map) is a read-only, zero-copy\n"\
+"(size_pixels, size_pixels) uint16 view of the live map pixels.\n"\
+"Map.update() and Map.get() run without the GIL; the view is not locked, so read it\n"\
+"from the thread that updates the map, or use Map.get() for a consistent copy."
+
+
+static PyTypeObject pybreezyslam_MapType = 
+{
+    #if PY_MAJOR_VERSION < 3
+    PyObject_HEAD_INIT(NULL)
+    0,                                          // ob_size
+    #else
+    PyVarObject_HEAD_INIT(NULL, 0)
+    #endif
+    "pybreezyslam.Map",                       // tp_name
+    sizeof(Map),                                // tp_basicsize
+    0,                                          // tp_itemsize
+    (destructor)Map_dealloc,                    // tp_dealloc
+    0,                                          // tp_print
+    0,                                          // tp_getattr
+    0,                                          // tp_setattr
+    0,                                          // tp_compare
+    (reprfunc)Map_str,                          // tp_repr
+    0,                                          // tp_as_number
+    0,                                          // tp_as_sequence
+    0,                                          // tp_as_positionping
+    0,                                          // tp_hash 
+    0,                                          // tp_call
+    (reprfunc)Map_str,                          // tp_str
+    0,                                          // tp_getattro
+    0,                                          // tp_setattro
+    &Map_as_buffer,                             // tp_as_buffer
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,   // tp_flags
+    TP_DOC_MAP,                                 // tp_doc 
+    0,                                          // tp_traverse 
+    0,                                          // tp_clear 
+    0,                                          // tp_richcompare 
+    0,                                          // tp_weaklistoffset 
+    0,                                          // tp_iter 
+    0,                                          // tp_iternext 
+    Map_methods,                         		// tp_methods 
+    0,                         					// tp_members 
+    0,                                          // tp_getset 
+    0,                                          // tp_base 
+    0,                                          // tp_dict 
+    0,                                          // tp_descr_get 
+    0,                                          // tp_descr_set 
     0,                                          // tp_dictoffset 
     (initproc)Map_init,                         // tp_init 
     0,                                          // tp_alloc 
@@ -670,6 +1187,9 @@ typedef struct
     
     void * randomizer;
     
+    // held while the generator is used without the GIL
+    PyThread_type_lock lock;
+    
 } Randomizer;
 
 
@@ -678,6 +1198,11 @@ Randomizer_dealloc(Randomizer* self)
 {            
     random_free(self->randomizer);
     
+    if (self->lock)
+    {
+        PyThread_free_lock(self->lock);
+    }
+    
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
@@ -703,9 +1228,53 @@ Randomizer_init(Randomizer *self, PyObject *args, PyObject *kwds)
     
     self->randomizer = random_new(seed);
     
+    if (!self->lock && !(self->lock = PyThread_allocate_lock()))
+    {
+        PyErr_NoMemory();
+        return -1;
+    }
+    
     return 0;
 }
 
+static PyObject *
+Randomizer_getstate(Randomizer * self, PyObject * args)
+{
+    acquire_lock_allowing_threads(self->lock);
+    unsigned int state = random_state(self->randomizer);
+    PyThread_release_lock(self->lock);
+    
+    return PyLong_FromUnsignedLong(state);
+}
+
+static PyObject *
+Randomizer_setstate(Randomizer * self, PyObject * args)
+{
+    unsigned int state = 0;
+    
+    if (!PyArg_ParseTuple(args, "I", &state))
+    {
+        return null_on_raise_argument_exception("Randomizer", "setstate");
+    }
+    
+    acquire_lock_allowing_threads(self->lock);
+    random_init(self->randomizer, (int)state);
+    PyThread_release_lock(self->lock);
+    
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef Randomizer_methods[] = 
+{
+    {"getstate", (PyCFunction)Randomizer_getstate, METH_NOARGS, 
+    "Randomizer.getstate() returns the state of the generator, an unsigned 32-bit integer."
+    },
+    {"setstate", (PyCFunction)Randomizer_setstate, METH_VARARGS, 
+    "Randomizer.setstate(state) restores a state returned by Randomizer.getstate()."
+    },
+    {NULL}  // Sentinel 
+};
+
 #define TP_DOC_RANDOMIZER \
 ""
 
@@ -743,7 +1312,7 @@ static PyTypeObject pybreezyslam_RandomizerType =
     0,                                          // tp_weaklistoffset 
     0,                                          // tp_iter 
     0,                                          // tp_iternext 
-    0,                         					// tp_methods 
+    Randomizer_methods,                         // tp_methods 
     0,                         					// tp_members 
     0,                                          // tp_getset 
     0,                                          // tp_base 
@@ -757,6 +1326,195 @@ static PyTypeObject pybreezyslam_RandomizerType =
 };
 
 
+// MapPyramid class ------------------------------------------------------------
+
+typedef struct 
+{
+    PyObject_HEAD
+    
+    map_pyramid_t pyramid;
+    Map * py_map;
+    
+    // held while the pyramid is read or written without the GIL
+    PyThread_type_lock lock;
+    
+} MapPyramid;
+
+
+static void
+MapPyramid_dealloc(MapPyramid* self)
+{            
+    if (self->py_map)
+    {
+        map_pyramid_free(&self->pyramid);
+        Py_DECREF(self->py_map);
+    }
+    
+    if (self->lock)
+    {
+        PyThread_free_lock(self->lock);
+    }
+    
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject *
+MapPyramid_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{    
+    MapPyramid *self;
+    
+    self = (MapPyramid *)type->tp_alloc(type, 0);
+    
+    return (PyObject *)self;
+}
+
+static int
+MapPyramid_init(MapPyramid *self, PyObject *args, PyObject *kwds)
+{                    
+    Map * py_map = NULL;
+    int nlevels = 0;
+    
+    if (!PyArg_ParseTuple(args, "Oi", &py_map, &nlevels))
+    {
+        return error_on_raise_argument_exception("MapPyramid");
+    }
+    
+    if (error_on_check_argument_type((PyObject *)py_map, &pybreezyslam_MapType, 0,
+            "pybreezyslam.Map", "MapPyramid", "__init__"))
+    {
+        return -1;
+    }
+    
+    if (self->py_map)
+    {
+        return error_on_raise_argument_exception_with_details("MapPyramid", "__init__", "already initialized");
+    }
+    
+    if (nlevels < 1 || nlevels > 15)
+    {
+        return error_on_raise_argument_exception_with_details("MapPyramid", "__init__", 
+                "levels must be between 1 and 15");
+    }
+    
+    if (py_map->map.tiles)
+    {
+        return error_on_raise_argument_exception_with_details("MapPyramid", "__init__", 
+                "tiled maps are not supported");
+    }
+    
+    if (!(self->lock = PyThread_allocate_lock()))
+    {
+        PyErr_NoMemory();
+        return -1;
+    }
+    
+    acquire_lock_allowing_threads(py_map->lock);
+    
+    Py_BEGIN_ALLOW_THREADS
+    map_pyramid_init(&self->pyramid, &py_map->map, nlevels);
+    Py_END_ALLOW_THREADS
+    
+    PyThread_release_lock(py_map->lock);
+    
+    Py_INCREF(py_map);
+    self->py_map = py_map;
+    
+    return 0;
+}
+
+static PyObject *
+MapPyramid_update(MapPyramid *self, PyObject *args, PyObject *kwds)
+{   
+    PyObject * py_rect = Py_None;
+    int rect[4] = {0, 0, self->pyramid.size_pixels, self->pyramid.size_pixels};
+    
+    if (!PyArg_ParseTuple(args, "|O", &py_rect))
+    {
+        return null_on_raise_argument_exception("MapPyramid", "update");
+    }
+    
+    if (py_rect != Py_None && !PyArg_ParseTuple(py_rect, "iiii", &rect[0], &rect[1], &rect[2], &rect[3]))
+    {
+        PyErr_Clear();
+        return null_on_raise_argument_exception_with_details("MapPyramid", "update", 
+                "rect must be a tuple (x, y, width, height) or None");
+    }
+    
+    acquire_lock_allowing_threads(self->py_map->lock);
+    acquire_lock_allowing_threads(self->lock);
+    
+    Py_BEGIN_ALLOW_THREADS
+    map_pyramid_update(&self->pyramid, &self->py_map->map, rect);
+    Py_END_ALLOW_THREADS
+    
+    PyThread_release_lock(self->lock);
+    PyThread_release_lock(self->py_map->lock);
+    
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef MapPyramid_methods[] = 
+{
+    {"update", (PyCFunction)MapPyramid_update, METH_VARARGS, 
+    "MapPyramid.update(rect=None) brings the pyramid up to date after the map changed inside rect\n"\
+    "(x, y, width, height), as returned by Map.update(); None means the whole map."
+    },
+    {NULL}  // Sentinel 
+};
+
+#define TP_DOC_MAPPYRAMID \
+"Min-pooled resolution levels of a Map for branch-and-bound search: level k holds, for each pixel,\n"\
+"the lowest map value over the 2^k x 2^k pixels starting there.\n"\
+"MapPyramid.__init__(map, levels)"
+
+static PyTypeObject pybreezyslam_MapPyramidType = 
+{
+    #if PY_MAJOR_VERSION < 3
+    PyObject_HEAD_INIT(NULL)
+    0,                                          // ob_size
+    #else
+    PyVarObject_HEAD_INIT(NULL, 0)
+    #endif
+    "pybreezyslam.MapPyramid",                // tp_name
+    sizeof(MapPyramid),                         // tp_basicsize
+    0,                                          // tp_itemsize
+    (destructor)MapPyramid_dealloc,             // tp_dealloc
+    0,                                          // tp_print
+    0,                                          // tp_getattr
+    0,                                          // tp_setattr
+    0,                                          // tp_compare
+    0,                                          // tp_repr
+    0,                                          // tp_as_number
+    0,                                          // tp_as_sequence
+    0,                                          // tp_as_positionping
+    0,                                          // tp_hash 
+    0,                                          // tp_call
+    0,                                          // tp_str
+    0,                                          // tp_getattro
+    0,                                          // tp_setattro
+    0,                                          // tp_as_buffer
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,   // tp_flags
+    TP_DOC_MAPPYRAMID,                          // tp_doc 
+    0,                                          // tp_traverse 
+    0,                                          // tp_clear 
+    0,                                          // tp_richcompare 
+    0,                                          // tp_weaklistoffset 
+    0,                                          // tp_iter 
+    0,                                          // tp_iternext 
+    MapPyramid_methods,                         // tp_methods 
+    0,                         					// tp_members 
+    0,                                          // tp_getset 
+    0,                                          // tp_base 
+    0,                                          // tp_dict 
+    0,                                          // tp_descr_get 
+    0,                                          // tp_descr_set 
+    0,                                          // tp_dictoffset 
+    (initproc)MapPyramid_init,                  // tp_init 
+    0,                                          // tp_alloc 
+    MapPyramid_new,                             // tp_new 
+};
+
+
 // pybreezyslam module ------------------------------------------------------------
 
 
@@ -773,23 +1531,183 @@ distanceScanToMap(PyObject *self, PyObject *args)
         return null_on_raise_argument_exception("breezyslam", "distanceScanToMap");
     }
     
-    // Check object types
+    // Check object types
+    if (error_on_check_argument_type((PyObject *)py_map, &pybreezyslam_MapType, 0,
+            "pybreezyslam.Map", "pybreezyslam", "distanceScanToMap") ||
+        error_on_check_argument_type((PyObject *)py_scan, &pybreezyslam_ScanType, 1,
+            "pybreezyslam.Scan", "pybreezyslam", "distanceScanToMap") ||
+        error_on_check_argument_type((PyObject *)py_position, &pybreezyslam_PositionType, 2, 
+            "pybreezyslam.Position", "pybreezyslam", "distanceScanToMap"))
+    {
+            return NULL;
+    }
+    
+        
+    // Translate position object from Python to C
+    position_t c_position = pypos2cpos(py_position);
+    
+    int distance;
+    
+    acquire_lock_allowing_threads(py_map->lock);
+    acquire_lock_allowing_threads(py_scan->lock);
+    
+    // Run C version without the GIL and return Python integer
+    Py_BEGIN_ALLOW_THREADS
+    distance = distance_scan_to_map(&py_map->map, &py_scan->scan, c_position);
+    Py_END_ALLOW_THREADS
+    
+    PyThread_release_lock(py_scan->lock);
+    PyThread_release_lock(py_map->lock);
+    
+    return PyLong_FromLong(distance);
+}
+
+// Helpers for distanceScanToMapBatch(): positions come as any C-contiguous buffer of doubles holding
+// (x_mm, y_mm, theta_degrees) triples, such as an (N, 3) float64 numpy array; distances go to a
+// C-contiguous buffer of N ints, by default a new array.array('i').
+
+static int get_batchbuffer(PyObject * obj, char format, int writable, Py_buffer * view)
+{
+    int flags = PyBUF_C_CONTIGUOUS | PyBUF_FORMAT | (writable ? PyBUF_WRITABLE : 0);
+
+    if (PyObject_GetBuffer(obj, view, flags) < 0)
+    {
+        PyErr_Clear();
+        return -1;
+    }
+
+    const char * buffer_format = view->format ? view->format : "B";
+    if (*buffer_format == '@' || *buffer_format == '=')
+    {
+        buffer_format++;
+    }
+
+    if (buffer_format[0] != format || buffer_format[1] != 0)
+    {
+        PyBuffer_Release(view);
+        return -1;
+    }
+
+    return 0;
+}
+
+static PyObject * new_distances(Py_ssize_t count)
+{
+    PyObject * array_module = PyImport_ImportModule("array");
+
+    if (!array_module)
+    {
+        return NULL;
+    }
+
+    PyObject * zeros = PyBytes_FromStringAndSize(NULL, count * sizeof(int));
+
+    if (!zeros)
+    {
+        Py_DECREF(array_module);
+        return NULL;
+    }
+
+    memset(PyBytes_AS_STRING(zeros), 0, count * sizeof(int));
+
+    PyObject * distances = PyObject_CallMethod(array_module, "array", "sO", "i", zeros);
+
+    Py_DECREF(zeros);
+    Py_DECREF(array_module);
+
+    return distances;
+}
+
+static PyObject *
+distanceScanToMapBatch(PyObject *self, PyObject *args, PyObject *kwds)
+{   
+    Map * py_map = NULL;
+    Scan * py_scan = NULL;
+    PyObject * py_positions = NULL;
+    PyObject * py_distances = NULL;
+    int num_threads = 1;
+
+    static char* argnames[] = {"map", "scan", "positions", "distances", "num_threads", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OOO|Oi", argnames,
+        &py_map, 
+        &py_scan, 
+        &py_positions, 
+        &py_distances,
+        &num_threads))
+    {        
+        return null_on_raise_argument_exception("breezyslam", "distanceScanToMapBatch");
+    }
+    
     if (error_on_check_argument_type((PyObject *)py_map, &pybreezyslam_MapType, 0,
-            "pybreezyslam.Map", "pybreezyslam", "distanceScanToMap") ||
+            "pybreezyslam.Map", "pybreezyslam", "distanceScanToMapBatch") ||
         error_on_check_argument_type((PyObject *)py_scan, &pybreezyslam_ScanType, 1,
-            "pybreezyslam.Scan", "pybreezyslam", "distanceScanToMap") ||
-        error_on_check_argument_type((PyObject *)py_position, &pybreezyslam_PositionType, 2, 
-            "pybreezyslam.Position", "pybreezyslam", "distanceScanToMap"))
+            "pybreezyslam.Scan", "pybreezyslam", "distanceScanToMapBatch"))
     {
             return NULL;
     }
-    
-        
-    // Translate position object from Python to C
-    position_t c_position = pypos2cpos(py_position);
-    
-    // Run C version and return Python integer
-    return PyLong_FromLong(distance_scan_to_map(&py_map->map, &py_scan->scan, c_position));
+
+    Py_buffer positions;
+    if (get_batchbuffer(py_positions, 'd', 0, &positions))
+    {
+        return null_on_raise_argument_exception_with_details("breezyslam", "distanceScanToMapBatch", 
+                "positions must be a contiguous buffer of doubles");
+    }
+
+    Py_ssize_t count = positions.len / sizeof(double) / 3;
+
+    if (positions.len != count * 3 * (Py_ssize_t)sizeof(double) || count > INT_MAX)
+    {
+        PyBuffer_Release(&positions);
+        return null_on_raise_argument_exception_with_details("breezyslam", "distanceScanToMapBatch", 
+                "positions must hold (x_mm, y_mm, theta_degrees) triples");
+    }
+
+    if (py_distances && py_distances != Py_None)
+    {
+        Py_INCREF(py_distances);
+    }
+    else if (!(py_distances = new_distances(count)))
+    {
+        PyBuffer_Release(&positions);
+        return NULL;
+    }
+
+    Py_buffer distances;
+    int have_distances = !get_batchbuffer(py_distances, 'i', 1, &distances);
+
+    if (!have_distances || distances.len != count * (Py_ssize_t)sizeof(int))
+    {
+        if (have_distances)
+        {
+            PyBuffer_Release(&distances);
+        }
+        PyBuffer_Release(&positions);
+        Py_DECREF(py_distances);
+        return null_on_raise_argument_exception_with_details("breezyslam", "distanceScanToMapBatch", 
+                "distances must be a writable contiguous buffer of one int per position");
+    }
+
+    acquire_lock_allowing_threads(py_map->lock);
+    acquire_lock_allowing_threads(py_scan->lock);
+
+    Py_BEGIN_ALLOW_THREADS
+    distance_scan_to_map_batch(
+            &py_map->map, 
+            &py_scan->scan, 
+            (const double *)positions.buf, 
+            (int)count, 
+            (int *)distances.buf, 
+            num_threads);
+    Py_END_ALLOW_THREADS
+
+    PyThread_release_lock(py_scan->lock);
+    PyThread_release_lock(py_map->lock);
+
+    PyBuffer_Release(&distances);
+    PyBuffer_Release(&positions);
+
+    return py_distances;
 }
 
 // Called internally, so minimal type-checking on arguments
@@ -804,9 +1722,10 @@ rmhcPositionSearch(PyObject *self, PyObject *args)
 	double sigma_theta_degrees = 0;
 	int max_search_iter = 0;
 	Randomizer * py_randomizer = NULL;
+    int num_threads = 1;
 	
     // Extract Python objects for map, scan, and position
-    if (!PyArg_ParseTuple(args, "OOOOddiO", 
+    if (!PyArg_ParseTuple(args, "OOOOddiO|i", 
         &py_start_pos,
         &py_map,
         &py_scan,
@@ -814,23 +1733,38 @@ rmhcPositionSearch(PyObject *self, PyObject *args)
         &sigma_xy_mm,
         &sigma_theta_degrees,
         &max_search_iter,
-        &py_randomizer))
+        &py_randomizer,
+        &num_threads))
     {        
         return null_on_raise_argument_exception("breezyslam.algorithms", "rmhcPositionSearch");
     }
     
     // Convert Python objects to C structures
     position_t start_pos = pypos2cpos(py_start_pos);
-
-	position_t likeliest_position = 
-    rmhc_position_search(
+    
+    position_t likeliest_position;
+    
+    acquire_lock_allowing_threads(py_map->lock);
+    acquire_lock_allowing_threads(py_scan->lock);
+    acquire_lock_allowing_threads(py_randomizer->lock);
+    
+    // The search only touches C structures, so other Python threads can run meanwhile
+    Py_BEGIN_ALLOW_THREADS
+	likeliest_position = 
+    rmhc_position_search_parallel(
         start_pos,
         &py_map->map,
         &py_scan->scan,
         sigma_xy_mm,
         sigma_theta_degrees,
         max_search_iter,
-        py_randomizer->randomizer);    
+        py_randomizer->randomizer,
+        num_threads);    
+    Py_END_ALLOW_THREADS
+    
+    PyThread_release_lock(py_randomizer->lock);
+    PyThread_release_lock(py_scan->lock);
+    PyThread_release_lock(py_map->lock);
     
     
     // Convert C position back to Python object
@@ -847,6 +1781,391 @@ rmhcPositionSearch(PyObject *self, PyObject *args)
 }
 
 
+// Called internally, so minimal type-checking on arguments
+static PyObject *
+bnbPositionSearch(PyObject *self, PyObject *args)
+{   	    
+    Position * py_start_pos = NULL;
+    MapPyramid * py_pyramid = NULL;
+    Scan * py_scan = NULL;
+    double window_xy_mm = 0;
+    double window_theta_degrees = 0;
+    double step_theta_degrees = 0;
+    
+    if (!PyArg_ParseTuple(args, "OOOddd", 
+        &py_start_pos,
+        &py_pyramid,
+        &py_scan,
+        &window_xy_mm,
+        &window_theta_degrees,
+        &step_theta_degrees))
+    {        
+        return null_on_raise_argument_exception("breezyslam.algorithms", "bnbPositionSearch");
+    }
+    
+    position_t start_pos = pypos2cpos(py_start_pos);
+    Map * py_map = py_pyramid->py_map;
+    
+    position_t likeliest_position;
+    int candidates_scored = 0;
+    
+    acquire_lock_allowing_threads(py_map->lock);
+    acquire_lock_allowing_threads(py_scan->lock);
+    acquire_lock_allowing_threads(py_pyramid->lock);
+    
+    Py_BEGIN_ALLOW_THREADS
+    likeliest_position = 
+    bnb_position_search(
+        start_pos,
+        &py_map->map,
+        &py_pyramid->pyramid,
+        &py_scan->scan,
+        window_xy_mm,
+        window_theta_degrees,
+        step_theta_degrees,
+        &candidates_scored);
+    Py_END_ALLOW_THREADS
+    
+    PyThread_release_lock(py_pyramid->lock);
+    PyThread_release_lock(py_scan->lock);
+    PyThread_release_lock(py_map->lock);
+    
+    PyObject * argList = Py_BuildValue("ddd", 
+        likeliest_position.x_mm, 
+        likeliest_position.y_mm, 
+        likeliest_position.theta_degrees); 
+    PyObject * py_likeliest_position = 
+    PyObject_CallObject((PyObject *) &pybreezyslam_PositionType, argList);
+    Py_DECREF(argList);	
+    
+    if (!py_likeliest_position)
+    {
+        return NULL;
+    }
+    
+    return Py_BuildValue("Ni", py_likeliest_position, candidates_scored);
+}
+
+
+// Particle sets: contiguous buffers of doubles holding (x_mm, y_mm, theta_degrees) triples, with a
+// buffer of one double weight per particle, e.g. (N, 3) and (N,) float64 numpy arrays or array.array('d').
+
+static int get_particles(PyObject * py_particles, PyObject * py_weights, const char * methodname, 
+        Py_buffer * particles, Py_buffer * weights, Py_ssize_t * count)
+{
+    if (get_batchbuffer(py_particles, 'd', 1, particles))
+    {
+        return error_on_raise_argument_exception_with_details("breezyslam", methodname, 
+                "particles must be a writable contiguous buffer of doubles");
+    }
+
+    *count = particles->len / sizeof(double) / 3;
+
+    if (particles->len != *count * 3 * (Py_ssize_t)sizeof(double) || *count > INT_MAX)
+    {
+        PyBuffer_Release(particles);
+        return error_on_raise_argument_exception_with_details("breezyslam", methodname, 
+                "particles must hold (x_mm, y_mm, theta_degrees) triples");
+    }
+
+    if (get_batchbuffer(py_weights, 'd', 1, weights))
+    {
+        PyBuffer_Release(particles);
+        return error_on_raise_argument_exception_with_details("breezyslam", methodname, 
+                "weights must be a writable contiguous buffer of doubles");
+    }
+
+    if (weights->len != *count * (Py_ssize_t)sizeof(double))
+    {
+        PyBuffer_Release(weights);
+        PyBuffer_Release(particles);
+        return error_on_raise_argument_exception_with_details("breezyslam", methodname, 
+                "weights must hold one double per particle");
+    }
+
+    return 0;
+}
+
+static PyObject *
+particlesPredict(PyObject *self, PyObject *args)
+{   
+    PyObject * py_particles = NULL;
+    double dxy_mm = 0;
+    double dtheta_degrees = 0;
+    double offset_mm = 0;
+    double sigma_xy_mm = 0;
+    double sigma_theta_degrees = 0;
+    Randomizer * py_randomizer = NULL;
+
+    if (!PyArg_ParseTuple(args, "OdddddO!", 
+        &py_particles,
+        &dxy_mm,
+        &dtheta_degrees,
+        &offset_mm,
+        &sigma_xy_mm,
+        &sigma_theta_degrees,
+        &pybreezyslam_RandomizerType, &py_randomizer))
+    {        
+        return null_on_raise_argument_exception("breezyslam", "particlesPredict");
+    }
+
+    Py_buffer particles;
+    int have_particles = !get_batchbuffer(py_particles, 'd', 1, &particles);
+
+    if (!have_particles || particles.len % (3 * sizeof(double)) || particles.len / sizeof(double) / 3 > INT_MAX)
+    {
+        if (have_particles)
+        {
+            PyBuffer_Release(&particles);
+        }
+        return null_on_raise_argument_exception_with_details("breezyslam", "particlesPredict", 
+                "particles must be a writable contiguous buffer of (x_mm, y_mm, theta_degrees) doubles");
+    }
+
+    acquire_lock_allowing_threads(py_randomizer->lock);
+
+    Py_BEGIN_ALLOW_THREADS
+    particles_predict((double *)particles.buf, (int)(particles.len / sizeof(double) / 3), 
+            dxy_mm, dtheta_degrees, offset_mm, sigma_xy_mm, sigma_theta_degrees, py_randomizer->randomizer);
+    Py_END_ALLOW_THREADS
+
+    PyThread_release_lock(py_randomizer->lock);
+
+    PyBuffer_Release(&particles);
+
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+particlesWeigh(PyObject *self, PyObject *args)
+{   
+    PyObject * py_distances = NULL;
+    PyObject * py_weights = NULL;
+    double temperature = 0;
+
+    if (!PyArg_ParseTuple(args, "OOd", &py_distances, &py_weights, &temperature) || temperature <= 0)
+    {        
+        return null_on_raise_argument_exception("breezyslam", "particlesWeigh");
+    }
+
+    Py_buffer distances, weights;
+
+    if (get_batchbuffer(py_distances, 'i', 0, &distances))
+    {
+        return null_on_raise_argument_exception_with_details("breezyslam", "particlesWeigh", 
+                "distances must be a contiguous buffer of ints");
+    }
+
+    int have_weights = !get_batchbuffer(py_weights, 'd', 1, &weights);
+
+    if (!have_weights || weights.len / (Py_ssize_t)sizeof(double) != distances.len / (Py_ssize_t)sizeof(int) ||
+            distances.len / (Py_ssize_t)sizeof(int) > INT_MAX)
+    {
+        if (have_weights)
+        {
+            PyBuffer_Release(&weights);
+        }
+        PyBuffer_Release(&distances);
+        return null_on_raise_argument_exception_with_details("breezyslam", "particlesWeigh", 
+                "weights must be a writable contiguous buffer of one double per distance");
+    }
+
+    double effective_count;
+
+    Py_BEGIN_ALLOW_THREADS
+    effective_count = particles_weigh((const int *)distances.buf, (double *)weights.buf, 
+            (int)(distances.len / sizeof(int)), temperature);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&weights);
+    PyBuffer_Release(&distances);
+
+    return PyFloat_FromDouble(effective_count);
+}
+
+static PyObject *
+particlesResample(PyObject *self, PyObject *args)
+{   
+    PyObject * py_particles = NULL;
+    PyObject * py_weights = NULL;
+    Randomizer * py_randomizer = NULL;
+
+    if (!PyArg_ParseTuple(args, "OOO!", &py_particles, &py_weights, &pybreezyslam_RandomizerType, &py_randomizer))
+    {        
+        return null_on_raise_argument_exception("breezyslam", "particlesResample");
+    }
+
+    Py_buffer particles, weights;
+    Py_ssize_t count = 0;
+
+    if (get_particles(py_particles, py_weights, "particlesResample", &particles, &weights, &count))
+    {
+        return NULL;
+    }
+
+    acquire_lock_allowing_threads(py_randomizer->lock);
+
+    Py_BEGIN_ALLOW_THREADS
+    particles_resample((double *)particles.buf, (double *)weights.buf, (int)count, py_randomizer->randomizer);
+    Py_END_ALLOW_THREADS
+
+    PyThread_release_lock(py_randomizer->lock);
+
+    PyBuffer_Release(&weights);
+    PyBuffer_Release(&particles);
+
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+particlesEstimate(PyObject *self, PyObject *args)
+{   
+    PyObject * py_particles = NULL;
+    PyObject * py_weights = NULL;
+    int mean = 0;
+
+    if (!PyArg_ParseTuple(args, "OOp", &py_particles, &py_weights, &mean))
+    {        
+        return null_on_raise_argument_exception("breezyslam", "particlesEstimate");
+    }
+
+    Py_buffer particles, weights;
+    Py_ssize_t count = 0;
+
+    if (get_particles(py_particles, py_weights, "particlesEstimate", &particles, &weights, &count))
+    {
+        return NULL;
+    }
+
+    position_t estimate;
+
+    Py_BEGIN_ALLOW_THREADS
+    estimate = particles_estimate((const double *)particles.buf, (const double *)weights.buf, (int)count, mean);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&weights);
+    PyBuffer_Release(&particles);
+
+    PyObject * argList = Py_BuildValue("ddd", estimate.x_mm, estimate.y_mm, estimate.theta_degrees); 
+    PyObject * py_estimate = PyObject_CallObject((PyObject *) &pybreezyslam_PositionType, argList);
+    Py_DECREF(argList);	
+
+    return py_estimate;
+}
+
+
+// Kernel dispatch ------------------------------------------------------------
+
+#ifndef BREEZYSLAM_KERNEL_DISPATCH
+
+// Builds without dispatch run the one kernel setup.py compiled in; these stand in for coreslam_x86_64.c
+
+#ifndef BREEZYSLAM_KERNEL_NAME
+#define BREEZYSLAM_KERNEL_NAME "sisd"
+#endif
+
+static const char * build_kernels[] = {BREEZYSLAM_KERNEL_NAME, NULL};
+
+const char ** distance_kernels(void)
+{
+    return build_kernels;
+}
+
+int distance_kernel_select(const char * name)
+{
+    return !name || !strcmp(name, BREEZYSLAM_KERNEL_NAME);
+}
+
+const char * distance_kernel(void)
+{
+    return BREEZYSLAM_KERNEL_NAME;
+}
+
+#endif
+
+static PyObject *
+distanceKernels(PyObject *self, PyObject *args)
+{   
+    const char ** names = distance_kernels();
+
+    Py_ssize_t count = 0;
+    while (names[count])
+    {
+        ++count;
+    }
+
+    PyObject * py_names = PyTuple_New(count);
+    if (!py_names)
+    {
+        return NULL;
+    }
+
+    Py_ssize_t k = 0;
+    for (k=0; k<count; ++k)
+    {
+        PyObject * py_name = PyUnicode_FromString(names[k]);
+        if (!py_name)
+        {
+            Py_DECREF(py_names);
+            return NULL;
+        }
+        PyTuple_SET_ITEM(py_names, k, py_name);
+    }
+
+    return py_names;
+}
+
+static PyObject *
+distanceKernel(PyObject *self, PyObject *args)
+{   
+    return PyUnicode_FromString(distance_kernel());
+}
+
+static PyObject *
+setDistanceKernel(PyObject *self, PyObject *args)
+{   
+    const char * name = NULL;
+
+    if (!PyArg_ParseTuple(args, "z", &name))
+    {        
+        return null_on_raise_argument_exception("breezyslam", "setDistanceKernel");
+    }
+
+    if (!distance_kernel_select(name))
+    {
+        PyErr_Format(PyExc_ValueError, "distance kernel '%s' is not available on this CPU", name);
+        return NULL;
+    }
+
+    Py_RETURN_NONE;
+}
+
+// Picks the fastest kernel, or the one named by BREEZYSLAM_KERNEL; returns -1 with an exception set if the
+// warning about an unavailable kernel was turned into an error
+static int select_kernel_from_environment(void)
+{
+    const char * name = getenv("BREEZYSLAM_KERNEL");
+
+    if (name && *name && !distance_kernel_select(name))
+    {
+        distance_kernel_select(NULL);
+
+        char message[200];
+        PyOS_snprintf(message, sizeof(message), 
+            "BREEZYSLAM_KERNEL=%s is not available on this CPU, using %s", name, distance_kernel());
+
+        return PyErr_WarnEx(PyExc_RuntimeWarning, message, 1);
+    }
+
+    if (!name || !*name)
+    {
+        distance_kernel_select(NULL);
+    }
+
+    return 0;
+}
+
+
 static PyMethodDef module_methods[] = 
 {
     {"distanceScanToMap", distanceScanToMap, METH_VARARGS,
@@ -857,10 +2176,55 @@ static PyMethodDef module_methods[] =
     "scan is a breezyslam.components.Scan object\n"\
     "position is a breezyslam.components.Position object\n"\
     },
+    {"distanceScanToMapBatch", (PyCFunction)distanceScanToMapBatch, METH_VARARGS | METH_KEYWORDS,
+        "distanceScanToMapBatch(map, scan, positions, distances=None, num_threads=1)\n"
+    "Computes distanceScanToMap() for many positions in one call, -1 for infinity.\n"\
+    "positions is a contiguous buffer of doubles holding (x_mm, y_mm, theta_degrees) triples,\n"\
+    "e.g. an (N, 3) float64 numpy array\n"\
+    "distances is an optional writable contiguous buffer of N ints (e.g. an int32 numpy array) to fill;\n"\
+    "a new array.array('i') is returned if not given\n"\
+    "num_threads > 1 splits the positions over that many native threads\n"\
+    },
     {"rmhcPositionSearch", rmhcPositionSearch, METH_VARARGS,
-        "rmhcPositionSearch(startpos, map, scan, laser, sigma_xy_mm, max_iter, randomizer)\n"
+        "rmhcPositionSearch(startpos, map, scan, laser, sigma_xy_mm, max_iter, randomizer, num_threads=1)\n"
     "Internal use only."
     },
+    {"bnbPositionSearch", bnbPositionSearch, METH_VARARGS,
+        "bnbPositionSearch(startpos, pyramid, scan, window_xy_mm, window_theta_degrees, step_theta_degrees)\n"
+    "Returns (position, candidates_scored). Internal use only."
+    },
+    {"particlesPredict", particlesPredict, METH_VARARGS,
+        "particlesPredict(particles, dxy_mm, dtheta_degrees, offset_mm, sigma_xy_mm, sigma_theta_degrees, randomizer)\n"
+    "Moves each laser-position particle by the odometry, plus normal noise."
+    },
+    {"particlesWeigh", particlesWeigh, METH_VARARGS,
+        "particlesWeigh(distances, weights, temperature)\n"
+    "Multiplies weights by exp(-(distance - lowest distance) / temperature), normalizes them,\n"\
+    "and returns the effective number of particles."
+    },
+    {"particlesResample", particlesResample, METH_VARARGS,
+        "particlesResample(particles, weights, randomizer)\n"
+    "Low-variance resampling in place; weights become equal."
+    },
+    {"particlesEstimate", particlesEstimate, METH_VARARGS,
+        "particlesEstimate(particles, weights, mean)\n"
+    "Returns the weighted mean Position if mean is true, else the heaviest particle."
+    },
+    {"distanceKernels", distanceKernels, METH_NOARGS,
+        "distanceKernels()\n"
+    "Returns the names of the distanceScanToMap() kernels this build and CPU can run, slowest first.\n"\
+    "All kernels return identical distances."
+    },
+    {"distanceKernel", distanceKernel, METH_NOARGS,
+        "distanceKernel()\n"
+    "Returns the name of the kernel in use: the fastest one at import, unless the BREEZYSLAM_KERNEL\n"\
+    "environment variable names another."
+    },
+    {"setDistanceKernel", setDistanceKernel, METH_VARARGS,
+        "setDistanceKernel(name)\n"
+    "Switches kernels, None for the fastest; raises ValueError if this CPU cannot run it.\n"\
+    "Not thread-safe: switch before starting SLAM."
+    },
     {NULL, NULL, 0, NULL}        /* Sentinel */
 };
 
@@ -870,6 +2234,7 @@ static void add_classes(PyObject * module)
     add_class(module, &pybreezyslam_MapType, "Map");
     add_class(module, &pybreezyslam_PositionType, "Position");
     add_class(module, &pybreezyslam_RandomizerType, "Randomizer");
+    add_class(module, &pybreezyslam_MapPyramidType, "MapPyramid");
 }
 
 static int types_are_ready(void)
@@ -878,7 +2243,8 @@ return
     type_is_ready(&pybreezyslam_ScanType) &&
     type_is_ready(&pybreezyslam_MapType) &&
     type_is_ready(&pybreezyslam_PositionType) &&
-    type_is_ready(&pybreezyslam_RandomizerType);
+    type_is_ready(&pybreezyslam_RandomizerType) &&
+    type_is_ready(&pybreezyslam_MapPyramidType);
 }
 
 #if PY_MAJOR_VERSION < 3
@@ -890,6 +2256,11 @@ initpybreezyslam(void)
         return;
     }
     
+    if (select_kernel_from_environment() < 0)
+    {
+        return;
+    }
+    
     PyObject * module = Py_InitModule("pybreezyslam", module_methods);
        
     if (module == NULL)
@@ -923,6 +2294,11 @@ PyInit_pybreezyslam(void)
         return NULL;
     }
     
+    if (select_kernel_from_environment() < 0)
+    {
+        return NULL;
+    }
+    
     PyObject* module = PyModule_Create(&moduledef);
     
     if (module == NULL)
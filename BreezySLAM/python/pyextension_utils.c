@@ -136,3 +136,15 @@ error_on_check_argument_type(
     
     return 0;
 }
+
+void
+acquire_lock_allowing_threads(
+    PyThread_type_lock lock)
+{
+    if (!PyThread_acquire_lock(lock, NOWAIT_LOCK))
+    {
+        Py_BEGIN_ALLOW_THREADS
+        PyThread_acquire_lock(lock, WAIT_LOCK);
+        Py_END_ALLOW_THREADS
+    }
+}
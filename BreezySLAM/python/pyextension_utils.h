@@ -143,4 +143,12 @@ error_on_check_argument_type(
     const char * classname,
     const char *methodname);
 
+/**
+* Acquires a per-object lock, releasing the GIL while waiting for it, so that a thread holding the
+* lock while running without the GIL can always get the GIL back.
+* @param lock the lock
+*/
+void
+acquire_lock_allowing_threads(
+    PyThread_type_lock lock);
 
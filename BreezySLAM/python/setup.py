@@ -21,16 +21,28 @@ along with this code.  If not, see <http://www.gnu.org/licenses/>.
 
 # Support streaming SIMD extensions
 
-from platform import machine
+from platform import machine, system
 
 OPT_FLAGS  = []
 SIMD_FLAGS = []
 
+KERNEL_SOURCES = []
+MACROS = []
+
+# Parallel RMHC search uses POSIX threads
+THREAD_FLAGS = [] if system() == 'Windows' else ['-pthread']
+
 arch = machine()
 
 print(arch)
 
-if  arch in ['i686', 'x86_64']:
+# Kernels for the running CPU are picked at import time: see coreslam_x86_64.c. The compiler builds the
+# AVX2 and AVX-512 kernels for their own instruction sets, so no SIMD flags are needed here.
+if arch == 'x86_64' and system() != 'Windows':
+    KERNEL_SOURCES = ['../c/coreslam_sisd.c', '../c/coreslam_x86_64.c']
+    MACROS = [('BREEZYSLAM_KERNEL_DISPATCH', None)]
+
+elif  arch in ['i686', 'x86_64']:
     SIMD_FLAGS = ['-msse3']
     arch = 'i686'
 
@@ -41,19 +53,24 @@ elif arch == 'armv7l':
 else:
     arch = 'sisd'
 
+if not KERNEL_SOURCES:
+    KERNEL_SOURCES = ['../c/coreslam_' + arch + '.c']
+    MACROS = [('BREEZYSLAM_KERNEL_NAME', '"%s"' % arch)]
+
 SOURCES = [
     'pybreezyslam.c', 
     'pyextension_utils.c', 
     '../c/coreslam.c', 
-    '../c/coreslam_' + arch + '.c',
     '../c/random.c',
-    '../c/ziggurat.c']
+    '../c/ziggurat.c'] + KERNEL_SOURCES
 
 from distutils.core import setup, Extension
 
 module = Extension('pybreezyslam', 
     sources = SOURCES, 
-    extra_compile_args = ['-std=gnu99'] + SIMD_FLAGS + OPT_FLAGS
+    define_macros = MACROS,
+    extra_compile_args = ['-std=gnu99'] + SIMD_FLAGS + OPT_FLAGS + THREAD_FLAGS,
+    extra_link_args = THREAD_FLAGS
     )
 
 
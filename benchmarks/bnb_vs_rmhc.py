@@ -0,0 +1,58 @@
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from breezyslam.algorithms import RMHC_SLAM, BranchAndBound_SLAM
+from breezyslam.sensors import Laser
+
+from scans import synthetic_run
+
+
+# Scans/sec, candidates scored per scan and position error of BranchAndBound_SLAM against RMHC_SLAM on the same
+# scans. RMHC scores one candidate per iteration: at least max_search_iter per scan.
+# Run with pybreezyslam built: python benchmarks/bnb_vs_rmhc.py [scans] [noise_mm]
+
+def run(slam, scans):
+    errors = []
+    scored = 0
+    start = time.perf_counter()
+
+    for scan_mm, truth in scans:
+        slam.update(scan_mm)
+        scored += getattr(slam, "candidates_scored", 0)
+
+        x, y, _ = slam.getpos()
+        errors.append(np.hypot(x - truth[0], y - truth[1]))
+
+    elapsed = time.perf_counter() - start
+
+    return len(scans) / elapsed, scored / len(scans), float(np.mean(errors)), float(np.max(errors))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    noise_mm = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    scans = synthetic_run(count, noise_mm)
+    laser = Laser(360, 5, 359, 4000, 0, 0)
+
+    print(f"{count} scans, {noise_mm} mm noise")
+
+    slams = [
+        ("RMHC_SLAM", RMHC_SLAM(laser, 600, 5, random_seed=42)),
+        ("BranchAndBound_SLAM", BranchAndBound_SLAM(laser, 600, 5)),
+    ]
+
+    for name, slam in slams:
+        rate, scored, error, max_error = run(slam, scans)
+        scored = f"{scored:8.0f}" if scored else "   >1000"
+
+        print(f"{name:20s}: {rate:6.1f} scans/s, {scored} candidates/scan, "
+              f"position error mean {error:6.1f} mm, max {max_error:6.1f} mm")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+sys.path.insert(0, ".")
+
+import pygame
+
+from ei.main_view import MainView, QR_REDETECT_INTERVAL
+
+
+# Checks that camera frames go all the way through the viewer's pipeline: MainView.camera_image_callback() submits
+# them, and every one must reach MainView.apply_camera_frame(), with the QR code found and, between redetections,
+# tracked around its last quad. Exits with status 1 otherwise. Frames are JPEGs of a moving synthetic QR code.
+# Run from the repository root: python benchmarks/camera_pipeline.py [frames]
+
+class Sample:
+    def __init__(self, payload):
+        self.value = self
+        self.payload = payload
+
+
+class CameraImage:
+    def write_array(self, image):
+        pass
+
+
+def make_frames(count, width=720, height=720):
+    code = cv2.QRCodeEncoder.create().encode("turtle")
+    code = cv2.resize(code, (200, 200), interpolation=cv2.INTER_NEAREST)
+
+    frames = []
+
+    for k in range(count):
+        image = np.full((height, width, 3), 255, dtype=np.uint8)
+        x, y = 100 + 4 * k, 200 + 2 * k
+        image[y:y + 200, x:x + 200] = code[:, :, None]
+
+        frames.append(Sample(cv2.imencode(".jpg", image)[1].tobytes()))
+
+    return frames
+
+
+def make_view(applied, done):
+    # only what the camera path uses: no zenoh session, no display
+    view = MainView.__new__(MainView)
+
+    view.camera_matrix = np.array([[910.0, 0.0, 360.0], [0.0, 910.0, 372.0], [0.0, 0.0, 1.0]])
+    view.camera_distortion = np.zeros(5)
+    view.camera_image = CameraImage()
+    view.images_lock = threading.Lock()
+    view.last_points = []
+    view.frames_since_detection = 0
+
+    def apply_camera_frame(frame):
+        MainView.apply_camera_frame(view, frame)
+        applied.append(frame)
+        done.set()
+
+    view.apply_camera_frame = apply_camera_frame
+    view.camera_pipeline = view.open_camera_pipeline()
+
+    return view
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    # request_redraw() posts pygame events
+    pygame.display.init()
+
+    frames = make_frames(count)
+    applied = []
+    done = threading.Event()
+    view = make_view(applied, done)
+
+    start = time.perf_counter()
+
+    # one frame at a time, so that the pipeline drops none and each sees the quad of the previous one
+    for sample in frames:
+        done.clear()
+        view.camera_image_callback(sample)
+
+        if not done.wait(5.0):
+            break
+
+    elapsed = time.perf_counter() - start
+    view.camera_pipeline.close()
+
+    found = sum(frame.quad is not None for frame in applied)
+    tracked = sum(frame.tracked for frame in applied)
+    stats = view.camera_pipeline.stats()
+
+    print(f"{count} frames: {len(applied)} applied, {found} with the QR code, {tracked} tracked, "
+          f"{stats['average_latency'] * 1000:.1f} ms average latency, {len(applied) / elapsed:.1f} frames/s")
+
+    # every QR_REDETECT_INTERVAL frames, and the first, search the whole frame
+    failed = len(applied) < count or found < count or tracked < count - 1 - count // (QR_REDETECT_INTERVAL + 1)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "raspberry"))
+
+from streamer import Streamer, SyntheticSource, VideoFileSource, FRAME_WIDTH, JPEG_QUALITY
+
+
+# Robot camera streaming without the robot: frames per second of the old one-thread capture -> resize -> encode ->
+# publish loop against the pipelined streamer with 1 to --max-encoders encoder threads. A capture source with a frame
+# rate (--fps) blocks like the camera does; --publish-ms adds the time a zenoh put takes on the robot link.
+# Run: python benchmarks/camera_streamer.py [--video file.mp4] [--fps 15] [--publish-ms 5] [--seconds 5]
+
+def make_source(args):
+    if args.video:
+        return VideoFileSource(args.video, realtime=args.fps != 0)
+
+    return SyntheticSource(args.width, args.height, args.fps)
+
+
+def publisher(delay_ms):
+    def publish(payload):
+        if delay_ms:
+            time.sleep(delay_ms / 1000)
+
+    return publish
+
+
+def serial(args):
+    # the loop raspberry/turtle.py used to run
+    source = make_source(args)
+    publish = publisher(args.publish_ms)
+    jpeg_opts = [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY]
+
+    frames = 0
+    start = time.perf_counter()
+
+    while time.perf_counter() - start < args.seconds:
+        raw = source.read()
+        height = int(raw.shape[0] * FRAME_WIDTH / raw.shape[1])
+        frame = cv2.resize(raw, (FRAME_WIDTH, height), interpolation=cv2.INTER_AREA)
+
+        _, jpeg = cv2.imencode('.jpg', frame, jpeg_opts)
+        publish(jpeg.tobytes())
+        frames += 1
+
+    source.close()
+
+    return frames / (time.perf_counter() - start)
+
+
+def pipelined(args, encoders):
+    source = make_source(args)
+    streamer = Streamer(source, publisher(args.publish_ms), encoders=encoders)
+
+    streamer.start()
+    time.sleep(args.seconds)
+    stats = streamer.stats()
+    report = streamer.report()
+    streamer.stop()
+    source.close()
+
+    return stats["stages"]["publish"]["fps"], report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="robot camera streaming benchmark")
+    parser.add_argument("--video", help="video file to stream instead of a synthetic pattern")
+    parser.add_argument("--width", type=int, default=1640, help="synthetic frame width")
+    parser.add_argument("--height", type=int, default=1232, help="synthetic frame height")
+    parser.add_argument("--fps", type=float, default=30, help="capture frame rate, 0 for as fast as possible")
+    parser.add_argument("--publish-ms", type=float, default=0, help="time each publish takes")
+    parser.add_argument("--seconds", type=float, default=5, help="duration of each run")
+    parser.add_argument("--max-encoders", type=int, default=4, help="largest encoder pool to try")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, capture at {args.fps or 'max'} fps, publish {args.publish_ms} ms")
+    print(f"serial:      {serial(args):5.1f} fps")
+
+    for encoders in range(1, args.max_encoders + 1):
+        fps, report = pipelined(args, encoders)
+        print(f"{encoders} encoder(s): {fps:5.1f} fps  {report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pybreezyslam
+
+from breezyslam.algorithms import RMHC_SLAM
+from breezyslam.sensors import Laser
+
+from scans import synthetic_run
+
+
+# Checks that every distanceScanToMap() kernel this CPU can run returns the same distances as the sisd kernel,
+# over poses all across the map and beyond its edges, then compares their speed. Exits with status 1 on a
+# mismatch. Run with pybreezyslam built: python benchmarks/distance_kernels.py [poses]
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    slam = RMHC_SLAM(Laser(360, 5, 359, 4000, 0, 0), 600, 5, random_seed=42)
+    for scan_mm, _ in synthetic_run(20):
+        slam.update(scan_mm)
+
+    # some map pixels at the far corner, where a 32-bit gather would overrun the map
+    map_pixels = np.empty((600, 600), dtype=np.uint16)
+    slam.map.get(map_pixels)
+    map_pixels[-1, -4:] = 0x1234
+    slam.map.set(map_pixels)
+
+    rng = np.random.default_rng(0)
+    near = np.array(slam.getpos()) + rng.normal(0, 1, (count // 2, 3)) * (100, 100, 10)
+    anywhere = rng.uniform((-2000, -2000, -180), (7000, 7000, 180), (count - count // 2, 3))
+    positions = np.concatenate((near, anywhere))
+
+    kernels = pybreezyslam.distanceKernels()
+    print(f"{count} poses, kernels {', '.join(kernels)}, using {pybreezyslam.distanceKernel()} by default")
+
+    reference = None
+    failed = False
+
+    for kernel in kernels:
+        pybreezyslam.setDistanceKernel(kernel)
+
+        distances = np.empty(count, dtype=np.int32)
+        start = time.perf_counter()
+        slam.getdistances(positions, distances)
+        elapsed = time.perf_counter() - start
+
+        if reference is None:
+            reference = distances
+            status = "reference"
+        else:
+            mismatches = np.count_nonzero(distances != reference)
+            failed |= mismatches > 0
+            status = f"{mismatches} mismatches" if mismatches else "identical"
+
+        print(f"{kernel:8s}: {count / elapsed:10.0f} poses/s, {status}")
+
+    pybreezyslam.setDistanceKernel(None)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import numpy as np
+import sys
+import timeit
+
+sys.path.insert(0, ".")
+
+from ei.laser_scan import LaserScan, Header, Time, decode_laser_scan
+
+
+# Compares the generic pycdr2 decoder, as the viewer used it, with the in-place numpy decoder.
+# Run from the repository root: python benchmarks/laser_scan_decode.py [count]
+
+def make_payload(count):
+    rng = np.random.default_rng(0)
+
+    scan = LaserScan(Header(Time(1, 2), "laser"), 0.0, 6.27, 0.0174, 0.0005, 0.2, 0.12, 3.5,
+                     rng.uniform(0.0, 3.5, count).astype(np.float32).tolist(),
+                     rng.uniform(0.0, 4000.0, count).astype(np.float32).tolist())
+
+    return scan.serialize()
+
+
+def generic(payload):
+    scan = LaserScan.deserialize(payload)
+    return list(map(lambda z: z * 1000.0, scan.ranges))
+
+
+def fast(payload):
+    scan = decode_laser_scan(payload)
+    return scan.ranges * 1000.0
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 360
+    payload = make_payload(count)
+
+    assert np.allclose(generic(payload), fast(payload))
+
+    for name, function in (("pycdr2 + list", generic), ("numpy view", fast)):
+        number, total = timeit.Timer(lambda: function(payload)).autorange()
+        print(f"{name:>14}: {total / number * 1e6:9.1f} us/scan ({count} ranges)")
+
+
+if __name__ == "__main__":
+    main()
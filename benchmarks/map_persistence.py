@@ -0,0 +1,75 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from breezyslam.algorithms import RMHC_SLAM
+from breezyslam.sensors import Laser
+
+from scans import synthetic_run
+
+
+# Time to save a map file, to load it (memory-mapped, so it should not grow with the map) and to create an empty
+# map of the same size, then checks that a persistent map resumes where it stopped.
+# Run with pybreezyslam built: python benchmarks/map_persistence.py
+
+MAP_SIZES_PIXELS = [600, 2000, 8000]
+
+
+def best_of(runs, function):
+    best = None
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+def main():
+    laser = Laser(360, 5, 359, 4000, 0, 0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "map.slam")
+
+        for size_pixels in MAP_SIZES_PIXELS:
+            slam = RMHC_SLAM(laser, size_pixels, size_pixels / 120, random_seed=42)
+
+            save, _ = best_of(3, lambda: slam.save(path))
+            load, _ = best_of(3, lambda: RMHC_SLAM.load(path))
+            new, _ = best_of(3, lambda: RMHC_SLAM(laser, size_pixels, size_pixels / 120))
+
+            print(f"{size_pixels:5d} x {size_pixels:<5d} pixels: save {1e3 * save:7.1f} ms, load {1e3 * load:5.2f} ms, "
+                  f"new map {1e3 * new:7.2f} ms")
+
+        scans = synthetic_run(40)
+
+        RMHC_SLAM(laser, 600, 5, random_seed=42).save(path)
+        persistent = RMHC_SLAM.load(path, persistent=True)
+
+        for scan_mm, _ in scans[:20]:
+            persistent.update(scan_mm)
+
+        persistent.close()
+
+        reference = RMHC_SLAM(laser, 600, 5, random_seed=42)
+        start = time.perf_counter()
+        resumed = RMHC_SLAM.load(path)
+        resume = time.perf_counter() - start
+
+        for slam in (reference, resumed):
+            for scan_mm, _ in scans[20 if slam is resumed else 0:]:
+                slam.update(scan_mm)
+
+        same = reference.getpos() == resumed.getpos()
+        print(f"resumed in {1e3 * resume:.2f} ms, {'same' if same else 'different'} position after 40 scans")
+
+        sys.exit(0 if same else 1)
+
+
+if __name__ == "__main__":
+    main()
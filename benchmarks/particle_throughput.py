@@ -0,0 +1,49 @@
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from breezyslam.algorithms import ParticleSLAM
+from breezyslam.sensors import Laser
+
+from scans import synthetic_run
+
+
+# Scans/sec, cost per particle and position error of ParticleSLAM from 100 to 10k particles; the cost per particle
+# should stay flat. Run with pybreezyslam built: python benchmarks/particle_throughput.py [scans] [num_threads]
+
+PARTICLE_COUNTS = [100, 300, 1000, 3000, 10000]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    num_threads = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    scans = synthetic_run(count)
+    laser = Laser(360, 5, 359, 4000, 0, 0)
+
+    print(f"{count} scans, num_threads={num_threads}")
+
+    for num_particles in PARTICLE_COUNTS:
+        slam = ParticleSLAM(laser, 600, 5, num_particles=num_particles, random_seed=42, num_threads=num_threads)
+
+        errors = []
+        start = time.perf_counter()
+
+        for scan_mm, truth in scans:
+            slam.update(scan_mm)
+
+            x, y, _ = slam.getpos()
+            errors.append(np.hypot(x - truth[0], y - truth[1]))
+
+        elapsed = time.perf_counter() - start
+
+        print(f"{num_particles:6d} particles: {count / elapsed:7.1f} scans/s, "
+              f"{1e6 * elapsed / (count * num_particles):5.2f} us/particle, "
+              f"mean position error {np.mean(errors):6.1f} mm")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pybreezyslam
+
+from breezyslam.algorithms import RMHC_SLAM
+from breezyslam.sensors import Laser
+
+from scans import synthetic_run
+
+
+# Poses scored per second with one distanceScanToMap() call per Position, and with CoreSLAM.getdistances().
+# Run with pybreezyslam built: python benchmarks/pose_batch.py [poses] [max_threads]
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    max_threads = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    slam = RMHC_SLAM(Laser(360, 5, 359, 4000, 0, 0), 600, 5, random_seed=42)
+    for scan_mm, _ in synthetic_run(20):
+        slam.update(scan_mm)
+
+    rng = np.random.default_rng(0)
+    positions = np.array(slam.getpos()) + rng.normal(0, 1, (count, 3)) * (100, 100, 10)
+    distances = np.empty(count, dtype=np.int32)
+
+    print(f"{count} poses, {os.cpu_count()} cpus")
+
+    start = time.perf_counter()
+    reference = [pybreezyslam.distanceScanToMap(slam.map, slam.scan_for_distance, pybreezyslam.Position(*p))
+                 for p in positions]
+    elapsed = time.perf_counter() - start
+    print(f"one call per pose: {count / elapsed:10.0f} poses/s")
+
+    threads = 1
+    while threads <= max_threads:
+        start = time.perf_counter()
+        slam.getdistances(positions, distances, threads)
+        elapsed = time.perf_counter() - start
+
+        assert np.array_equal(distances, reference)
+
+        print(f"batch, num_threads={threads:2d}: {count / elapsed:10.0f} poses/s")
+        threads *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from breezyslam.algorithms import RMHC_SLAM
+from breezyslam.sensors import Laser
+
+from scans import synthetic_run
+
+
+# Scans/sec and final pose error of RMHC_SLAM with the single-threaded search and with parallel chains.
+# Run with pybreezyslam built: python benchmarks/rmhc_threads.py [scans] [max_threads]
+
+def run(scans, num_threads, seed=42):
+    slam = RMHC_SLAM(Laser(360, 5, 359, 4000, 0, 0), 600, 5, random_seed=seed, num_threads=num_threads)
+
+    errors = []
+    start = time.perf_counter()
+
+    for scan_mm, truth in scans:
+        slam.update(scan_mm)
+
+        x, y, _ = slam.getpos()
+        errors.append(np.hypot(x - truth[0], y - truth[1]))
+
+    elapsed = time.perf_counter() - start
+
+    return len(scans) / elapsed, float(np.mean(errors)), slam.getpos()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    max_threads = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    scans = synthetic_run(count)
+
+    print(f"{count} scans, {os.cpu_count()} cpus")
+
+    threads = 1
+    while threads <= max_threads:
+        rate, error, pose = run(scans, threads)
+
+        # same seed and thread count must give the same trajectory
+        assert run(scans[:10], threads)[2] == run(scans[:10], threads)[2]
+
+        print(f"num_threads={threads:2d}: {rate:7.1f} scans/s, mean position error {error:6.1f} mm")
+        threads *= 2
+
+
+if __name__ == "__main__":
+    main()
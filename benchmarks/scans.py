@@ -0,0 +1,63 @@
+import numpy as np
+
+# Synthetic lidar scans for benchmarking SLAM without a robot: a 4 m x 3 m room with two boxes, seen from a
+# trajectory that starts at the centre of a 5 m map facing east, the way SinglePositionSLAM starts.
+
+ROOM = (500.0, 1000.0, 4500.0, 4000.0)
+BOXES = [(1200.0, 1400.0, 1700.0, 1900.0), (3300.0, 3000.0, 3800.0, 3300.0)]
+
+
+def _box_hits(x, y, dx, dy, box, inside):
+    # distance along each ray to an axis-aligned box (slab method); inside=True for the room walls
+    x0, y0, x1, y1 = box
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tx0, tx1 = (x0 - x) / dx, (x1 - x) / dx
+        ty0, ty1 = (y0 - y) / dy, (y1 - y) / dy
+
+    t_near = np.maximum(np.minimum(tx0, tx1), np.minimum(ty0, ty1))
+    t_far = np.minimum(np.maximum(tx0, tx1), np.maximum(ty0, ty1))
+
+    if inside:
+        return t_far
+
+    return np.where((t_near <= t_far) & (t_near > 0), t_near, np.inf)
+
+
+def cast(x_mm, y_mm, theta_degrees, scan_size=360, detection_angle_degrees=359, max_distance_mm=4000,
+         noise_mm=0.0, rng=None):
+    # ray angles follow the BreezySLAM scan convention: centred on the heading, counter-clockwise
+    k = np.arange(scan_size)
+    angles = np.radians(theta_degrees - detection_angle_degrees / 2 + k * detection_angle_degrees / (scan_size - 1))
+    dx, dy = np.cos(angles), np.sin(angles)
+
+    distances = _box_hits(x_mm, y_mm, dx, dy, ROOM, True)
+    for box in BOXES:
+        distances = np.minimum(distances, _box_hits(x_mm, y_mm, dx, dy, box, False))
+
+    if noise_mm and rng is not None:
+        distances = distances + rng.normal(0.0, noise_mm, scan_size)
+
+    # no return beyond the lidar range
+    return np.where(distances < max_distance_mm, distances, 0.0)
+
+
+def trajectory(count, step_mm=15.0, turn_degrees=1.5):
+    # a slow arc from the map centre
+    x, y, theta = 2500.0, 2500.0, 0.0
+    poses = []
+
+    for _ in range(count):
+        poses.append((x, y, theta))
+        x += step_mm * np.cos(np.radians(theta))
+        y += step_mm * np.sin(np.radians(theta))
+        theta += turn_degrees
+
+    return poses
+
+
+def synthetic_run(count, noise_mm=10.0, seed=0, **laser):
+    # list of (scan_mm, ground-truth (x_mm, y_mm, theta_degrees)) pairs
+    rng = np.random.default_rng(seed)
+
+    return [(cast(*pose, noise_mm=noise_mm, rng=rng, **laser), pose) for pose in trajectory(count)]
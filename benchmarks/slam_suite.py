@@ -0,0 +1,265 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pybreezyslam
+
+from breezyslam.algorithms import RMHC_SLAM, BranchAndBound_SLAM
+from breezyslam.sensors import Laser
+
+from scans import synthetic_run
+
+
+# SLAM benchmark suite: for each configuration, scans/sec, update latency percentiles, the time split between
+# Scan.update, the position search and Map.update, and position error against ground truth when there is one.
+# Configurations vary max_search_iter, map size and hole_width_mm one at a time around the viewer's settings, on
+# synthetic scans and on the turtle/lidar scans of logs recorded with turtle_log.py. Results go to JSON; --compare
+# checks them against an earlier run and exits with status 1 on a regression.
+# Run with pybreezyslam built: python benchmarks/slam_suite.py [--scans N] [--log run.log] [--output results.json]
+#                                                               [--compare earlier.json]
+
+BASELINE = {"algorithm": "RMHC_SLAM", "map_size_pixels": 600, "map_size_meters": 5, "hole_width_mm": 600,
+            "max_search_iter": 1000}
+
+SWEEPS = [
+    ("max_search_iter", [250, 500, 2000]),
+    ("map_size_pixels", [300, 1200]),
+    ("hole_width_mm", [200, 1000]),
+    ("algorithm", ["BranchAndBound_SLAM"]),
+]
+
+ALGORITHMS = {"RMHC_SLAM": RMHC_SLAM, "BranchAndBound_SLAM": BranchAndBound_SLAM}
+
+# the laser of the turtle, as the viewer sets it up
+LASER = Laser(360, 5, 359, 4000, 0, 0)
+LIDAR_KEY = "turtle/lidar"
+
+# ground truth of the synthetic scans starts at the centre of a 5 m map
+SYNTHETIC_ORIGIN_MM = 2500.0
+
+
+def configurations():
+    yield dict(BASELINE)
+
+    for name, values in SWEEPS:
+        for value in values:
+            yield dict(BASELINE, **{name: value})
+
+
+def config_name(config):
+    name = f"{config['algorithm']} {config['map_size_pixels']}px/{config['map_size_meters']}m " \
+           f"hole={config['hole_width_mm']}"
+
+    if config["algorithm"] == "RMHC_SLAM":
+        name += f" iter={config['max_search_iter']}"
+
+    return name
+
+
+def timed(cls):
+    # the class with the time spent in each stage of update() accumulated in self.stage_seconds
+    class Timed(cls):
+        def _scan_update(self, *args, **kwargs):
+            start = time.perf_counter()
+            cls._scan_update(self, *args, **kwargs)
+            self.stage_seconds["scan_update"] += time.perf_counter() - start
+
+        def _getNewPosition(self, start_position):
+            start = time.perf_counter()
+            position = cls._getNewPosition(self, start_position)
+            self.search_seconds = time.perf_counter() - start
+            self.stage_seconds["position_search"] += self.search_seconds
+
+            return position
+
+        def _updateMapAndPointcloud(self, *args):
+            self.search_seconds = 0
+            start = time.perf_counter()
+            cls._updateMapAndPointcloud(self, *args)
+            self.stage_seconds["map_update"] += time.perf_counter() - start - self.search_seconds
+
+    return Timed
+
+
+def make_slam(config):
+    slam_class = timed(ALGORITHMS[config["algorithm"]])
+
+    params = {"hole_width_mm": config["hole_width_mm"]}
+    if config["algorithm"] == "RMHC_SLAM":
+        params.update(random_seed=42, max_search_iter=config["max_search_iter"])
+
+    slam = slam_class(LASER, config["map_size_pixels"], config["map_size_meters"], **params)
+    slam.stage_seconds = dict.fromkeys(("scan_update", "position_search", "map_update"), 0.0)
+
+    return slam
+
+
+def synthetic_sequence(count):
+    scans = synthetic_run(count)
+
+    return {"name": f"synthetic-{count}", "updates": [((scan_mm,), {}) for scan_mm, _ in scans],
+            "truth": [pose for _, pose in scans]}
+
+
+def recorded_sequence(path, count):
+    # turtle/lidar scans of a log, in meters with one ray per degree, as the viewer feeds them
+    from ei.laser_scan import decode_laser_scan
+    from ei.recording import LogReader
+
+    scan_angles = np.arange(LASER.scan_size, dtype=np.float32)
+    updates = []
+
+    for record in LogReader(path).records(keys={LIDAR_KEY}):
+        ranges = decode_laser_scan(record.payload).ranges
+        updates.append(((ranges,), {"scan_angles_degrees": scan_angles, "distance_scale": 1000.0}))
+
+        if len(updates) == count:
+            break
+
+    return {"name": os.path.basename(path), "updates": updates, "truth": None}
+
+
+def run(config, sequence):
+    slam = make_slam(config)
+
+    latencies = []
+    positions = []
+
+    for args, kwargs in sequence["updates"]:
+        start = time.perf_counter()
+        slam.update(*args, **kwargs)
+        latencies.append(time.perf_counter() - start)
+
+        positions.append(slam.getpos())
+
+    latencies = np.array(latencies)
+    total = float(latencies.sum())
+
+    stages = dict((stage, seconds / total) for stage, seconds in slam.stage_seconds.items())
+    stages["other"] = max(0.0, 1 - sum(stages.values()))
+
+    result = {
+        "sequence": sequence["name"],
+        "config": config,
+        "name": config_name(config),
+        "scans": len(latencies),
+        "scans_per_second": len(latencies) / total,
+        "latency_ms": dict((f"p{q}", float(np.percentile(latencies, q) * 1e3)) for q in (50, 95, 99)),
+        "time_split": stages,
+        "error_mm": None,
+    }
+
+    result["latency_ms"]["max"] = float(latencies.max() * 1e3)
+
+    if sequence["truth"] is not None:
+        # the synthetic trajectory starts at the centre of the map, whatever its size
+        offset = config["map_size_meters"] * 500 - SYNTHETIC_ORIGIN_MM
+        positions = np.array(positions)[:, :2] - offset
+        errors = np.hypot(*(positions - np.array(sequence["truth"])[:, :2]).T)
+
+        result["error_mm"] = {"mean": float(errors.mean()), "rmse": float(np.sqrt(np.mean(errors ** 2))),
+                              "max": float(errors.max())}
+
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {"commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "machine": platform.machine(),
+            "processor": platform.processor(), "python": platform.python_version(),
+            "distance_kernel": pybreezyslam.distanceKernel(), "cpu_count": os.cpu_count()}
+
+
+def print_result(result):
+    latency = result["latency_ms"]
+    split = result["time_split"]
+    error = result["error_mm"]
+
+    print(f"{result['sequence']:16s} {result['name']:44s} {result['scans_per_second']:7.1f} scans/s  "
+          f"p50 {latency['p50']:6.2f} p95 {latency['p95']:6.2f} p99 {latency['p99']:6.2f} ms  "
+          f"scan {split['scan_update']:4.0%} search {split['position_search']:4.0%} "
+          f"map {split['map_update']:4.0%}  "
+          + (f"error {error['mean']:6.1f} mm" if error else "no ground truth"))
+
+
+def compare(results, baseline, tolerance):
+    # regressions: throughput down, or mean error up, by more than tolerance (and more than 5 mm for errors)
+    previous = dict(((result["sequence"], result["name"]), result) for result in baseline["results"])
+    regressions = 0
+
+    print(f"\nagainst {baseline['environment'].get('commit')}:")
+
+    for result in results:
+        before = previous.get((result["sequence"], result["name"]))
+        if before is None:
+            continue
+
+        speed = result["scans_per_second"] / before["scans_per_second"]
+        flags = []
+
+        if speed < 1 - tolerance:
+            flags.append("SLOWER")
+
+        if result["error_mm"] and before["error_mm"]:
+            growth = result["error_mm"]["mean"] - before["error_mm"]["mean"]
+            if growth > max(5.0, tolerance * before["error_mm"]["mean"]):
+                flags.append(f"LESS ACCURATE (+{growth:.1f} mm)")
+
+        regressions += bool(flags)
+        print(f"{result['sequence']:16s} {result['name']:44s} {speed:5.2f}x  {' '.join(flags)}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SLAM benchmark suite")
+    parser.add_argument("--scans", type=int, default=200, help="scans per sequence")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per configuration, the fastest is kept")
+    parser.add_argument("--log", action="append", default=[], help="log recorded with turtle_log.py; may repeat")
+    parser.add_argument("--no-synthetic", action="store_true", help="only run the recorded logs")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON results of an earlier run to check against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative regression")
+    args = parser.parse_args()
+
+    sequences = [] if args.no_synthetic else [synthetic_sequence(args.scans)]
+    sequences += [recorded_sequence(path, args.scans) for path in args.log]
+
+    results = []
+
+    for sequence in sequences:
+        for config in configurations():
+            # results only differ in timings: keep the run least disturbed by the rest of the machine
+            result = max((run(config, sequence) for _ in range(args.repeat)), key=lambda r: r["scans_per_second"])
+            results.append(result)
+            print_result(result)
+
+    report = {"environment": environment(), "repeat": args.repeat, "results": results}
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
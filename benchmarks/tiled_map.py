@@ -0,0 +1,88 @@
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from breezyslam.algorithms import RMHC_SLAM
+from breezyslam.sensors import Laser
+
+from scans import synthetic_run
+
+
+# Dense against tiled maps: scans/sec, poses scored per second and pixel memory on the same 5 m map, then position
+# error when the map is only 2.5 m wide, so that the room spills past its edges, which a dense map drops. Rates are
+# the best of three runs, each on a new map.
+# Run with pybreezyslam built: python benchmarks/tiled_map.py [scans] [tile_size_pixels]
+
+REPEAT = 3
+
+def run(slam, scans, offset_mm=0):
+    errors = []
+    start = time.perf_counter()
+
+    for scan_mm, truth in scans:
+        slam.update(scan_mm)
+
+        x, y, _ = slam.getpos()
+        errors.append(np.hypot(x - truth[0] + offset_mm, y - truth[1] + offset_mm))
+
+    return len(scans) / (time.perf_counter() - start), float(np.mean(errors))
+
+
+def best_run(laser, scans, size_pixels, size_meters, tile_size_pixels, offset_mm=0):
+    # fastest of REPEAT runs, and its SLAM; runs are deterministic, so errors do not change
+    runs = []
+
+    for _ in range(REPEAT):
+        slam = RMHC_SLAM(laser, size_pixels, size_meters, random_seed=42, map_tile_size_pixels=tile_size_pixels)
+        runs.append(run(slam, scans, offset_mm) + (slam,))
+
+    return max(runs, key=lambda result: result[0])
+
+
+def score_rate(slam, count=100000):
+    positions = np.array(slam.getpos()) + np.random.default_rng(0).normal(0, 1, (count, 3)) * (100, 100, 10)
+    distances = np.empty(count, dtype=np.int32)
+    elapsed = []
+
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        slam.getdistances(positions, distances)
+        elapsed.append(time.perf_counter() - start)
+
+    return count / min(elapsed)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    tile_size_pixels = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+
+    scans = synthetic_run(count)
+    laser = Laser(360, 5, 359, 4000, 0, 0)
+
+    print(f"{count} scans, tiles of {tile_size_pixels} x {tile_size_pixels} pixels")
+
+    rates = {}
+
+    for name, tiles in (("dense", 0), ("tiled", tile_size_pixels)):
+        rate, error, slam = best_run(laser, scans, 600, 5, tiles)
+        rates[name] = rate, score_rate(slam)
+
+        print(f"5 m map, {name}: {rate:6.1f} scans/s, {rates[name][1]:9.0f} poses/s, "
+              f"{slam.map.memory() / 1024:6.0f} KiB, position error {error:6.1f} mm")
+
+    print(f"5 m map, tiled / dense: {rates['tiled'][0] / rates['dense'][0]:.2f} scans/s, "
+          f"{rates['tiled'][1] / rates['dense'][1]:.2f} poses/s")
+
+    # the trajectory starts at the centre of the 5 m map, SLAM at the centre of the 2.5 m one
+    for name, tiles in (("dense", 0), ("tiled", tile_size_pixels)):
+        rate, error, slam = best_run(laser, scans, 300, 2.5, tiles, 1250)
+
+        print(f"2.5 m map, {name}: {rate:6.1f} scans/s, {slam.map.memory() / 1024:6.0f} KiB, "
+              f"position error {error:6.1f} mm")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import cv2
+import numpy as np
+import threading
+
+from dataclasses import dataclass
+
+# fraction of the previous quad size added around it when searching in tracking mode
+TRACKING_PADDING = 0.5
+
+# one detector per worker thread (and per process when the pipeline runs on a process pool)
+_local = threading.local()
+
+
+def qr_code_detector():
+    if not hasattr(_local, "qcd"):
+        _local.qcd = cv2.QRCodeDetector()
+
+    return _local.qcd
+
+
+@dataclass
+class CameraFrame:
+    image: np.ndarray
+    quad: np.ndarray
+    qr_code_center_x: float
+    distance_to_qr_code: float
+    tracked: bool
+
+
+def calculate_qr_code_coords(quad, camera_matrix, camera_distortion):
+    # Selected coordinate points for each corner of QR code.
+    qr_edges = np.array([[0, 0, 0],
+                         [0, 1, 0],
+                         [1, 1, 0],
+                         [1, 0, 0]], dtype='float32').reshape((4, 1, 3))
+
+    # determine the orientation of QR code coordinate system with respect to camera coorindate system.
+    ret, rvec, tvec = cv2.solvePnP(qr_edges, quad, camera_matrix, camera_distortion)
+
+    # Define unit xyz axes. These are then projected to camera view using the rotation matrix and translation
+    # vector.
+
+    unitv_points = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype='float32').reshape((4, 1, 3))
+    if ret:
+        points, jac = cv2.projectPoints(unitv_points, rvec, tvec, camera_matrix, camera_distortion)
+        # the returned points are pixel coordinates of each unit vector.
+        return points, rvec, tvec
+
+    # return empty arrays if rotation and translation values not found
+    else:
+        return [], [], []
+
+
+def track_qr_code(image, previous_quad, padding=TRACKING_PADDING):
+    # search a padded region of interest around the previous quad instead of the whole frame
+    x, y, w, h = cv2.boundingRect(np.asarray(previous_quad, dtype=np.float32))
+    pad = int(max(w, h) * padding)
+
+    x0, y0 = max(x - pad, 0), max(y - pad, 0)
+    x1, y1 = min(x + w + pad, image.shape[1]), min(y + h + pad, image.shape[0])
+
+    if x1 - x0 < 21 or y1 - y0 < 21:
+        return None
+
+    ret, points = qr_code_detector().detect(image[y0:y1, x0:x1])
+
+    if not ret or points is None:
+        return None
+
+    return points.reshape((1, 4, 2)) + np.array([x0, y0], dtype=np.float32)
+
+
+def process_camera_frame(payload, previous_quad, camera_matrix, camera_distortion):
+    # previous_quad follows the frame, as LatestFramePipeline.submit() passes them; None for a full-frame search
+    image = np.frombuffer(payload, dtype=np.uint8)
+    image = cv2.imdecode(image, 1)
+    image = cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    image = cv2.flip(image, 0)
+
+    points = track_qr_code(image, previous_quad) if previous_quad is not None else None
+    tracked = points is not None
+
+    # full-frame detection when tracking is not requested or the target was lost
+    if not tracked:
+        ret_qr, decoded_info, points, _ = qr_code_detector().detectAndDecodeMulti(image)
+
+    quad = points[0] if points is not None else None
+
+    qr_code_center_x = 0
+    distance_to_qr_code = 0
+
+    if points is not None:
+        image = cv2.polylines(image, points.astype(int), True, (255, 0, 0), 3)
+
+        qr_code_center_x = np.mean(quad[:, 1])
+
+        axis_points, rvec, tvec = calculate_qr_code_coords(quad, camera_matrix, camera_distortion)
+        distance_to_qr_code = np.linalg.norm(tvec) * 4
+
+        # BGR color format
+        colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (0, 0, 0)]
+
+        # check axes points are projected to camera view.
+        if len(axis_points) > 0:
+            axis_points = axis_points.reshape((4, 2))
+
+            origin = (int(axis_points[0][0]), int(axis_points[0][1]))
+
+            for p, c in zip(axis_points[1:], colors[:3]):
+                p = (int(p[0]), int(p[1]))
+
+                # Sometimes qr detector will make a mistake and projected point will overflow integer value. We skip
+                # these cases.
+                if origin[0] > 5 * image.shape[1] or origin[1] > 5 * image.shape[1]: break
+                if p[0] > 5 * image.shape[1] or p[1] > 5 * image.shape[1]: break
+
+                cv2.line(image, origin, p, c, 5)
+
+    return CameraFrame(image, quad, qr_code_center_x, distance_to_qr_code, tracked)
@@ -0,0 +1,98 @@
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+class LatestFramePipeline:
+    # Keeps a single pending slot: a frame that arrives while the previous one is still waiting is replaced, so the
+    # workers always start on the newest frame and results are never published out of order.
+    def __init__(self, process, on_result, workers=1, use_processes=False):
+        self.process = process
+        self.on_result = on_result
+
+        self.condition = threading.Condition()
+        self.publish_lock = threading.Lock()
+
+        self.pending = None
+        self.sequence = 0
+        self.last_published = 0
+        self.running = True
+
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.latency = 0.0
+        self.average_latency = 0.0
+
+        self.executor = ProcessPoolExecutor(workers) if use_processes else None
+
+        self.workers = [threading.Thread(target=self.run, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, *frame):
+        with self.condition:
+            if self.pending is not None:
+                self.dropped += 1
+
+            self.sequence += 1
+            self.received += 1
+            self.pending = (self.sequence, time.perf_counter(), frame)
+
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and self.pending is None:
+                    self.condition.wait()
+
+                if not self.running:
+                    return
+
+                sequence, received_at, frame = self.pending
+                self.pending = None
+
+            try:
+                if self.executor is not None:
+                    result = self.executor.submit(self.process, *frame).result()
+                else:
+                    result = self.process(*frame)
+            except Exception as e:
+                print(f"[WARN] Frame processing failed: {e}")
+                continue
+
+            with self.publish_lock:
+                # another worker already published a newer frame
+                if sequence < self.last_published:
+                    self.dropped += 1
+                    continue
+
+                self.last_published = sequence
+
+                self.processed += 1
+                self.latency = time.perf_counter() - received_at
+                self.average_latency += (self.latency - self.average_latency) / min(self.processed, 30)
+
+                self.on_result(result)
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "latency": self.latency,
+            "average_latency": self.average_latency,
+        }
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        for worker in self.workers:
+            worker.join(timeout=1.0)
+
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
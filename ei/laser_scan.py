@@ -0,0 +1,101 @@
+import numpy as np
+import struct
+
+from dataclasses import dataclass
+
+from pycdr2 import IdlStruct
+from pycdr2.types import uint32, float32
+from typing import List
+
+
+@dataclass
+class Time(IdlStruct, typename="Time"):
+    sec: uint32
+    nsec: uint32
+
+
+@dataclass
+class Header(IdlStruct, typename="Header"):
+    stamp: Time
+    frame_id: str
+
+
+@dataclass
+class LaserScan(IdlStruct, typename="LaserScan"):
+    header: Header
+    angle_min: float32
+    angle_max: float32
+    angle_increment: float32
+    time_increment: float32
+    scan_time: float32
+    range_min: float32
+    range_max: float32
+    ranges: List[float32]
+    intensities: List[float32]
+
+
+# CDR encapsulation identifiers -> byte order
+_ENCAPSULATIONS = {b"\x00\x00": ">", b"\x00\x01": "<"}
+
+# offset of the CDR body: alignment is relative to it
+_BODY = 4
+
+
+def _align(pos, alignment):
+    return _BODY + (pos - _BODY + alignment - 1) // alignment * alignment
+
+
+def _decode_fast(payload):
+    order = _ENCAPSULATIONS[bytes(payload[:2])]
+
+    sec, nsec, length = struct.unpack_from(order + "3I", payload, _BODY)
+    pos = _BODY + 12
+
+    frame_id = bytes(payload[pos:pos + length - 1]).decode()
+    pos = _align(pos + length, 4)
+
+    limits = struct.unpack_from(order + "7f", payload, pos)
+    pos += 28
+
+    # sequences of float32 become numpy views over the payload (copied only if not in native byte order)
+    arrays = []
+    for _ in range(2):
+        count, = struct.unpack_from(order + "I", payload, pos)
+        pos += 4
+
+        array = np.frombuffer(payload, dtype=order + "f4", count=count, offset=pos)
+        arrays.append(array.astype(np.float32, copy=False))
+        pos += 4 * count
+
+    return LaserScan(Header(Time(sec, nsec), frame_id), *limits, *arrays)
+
+
+def decode_laser_scan(payload):
+    # LaserScan with ranges and intensities as float32 numpy arrays, read in place from the payload when it
+    # has the layout the lidar node publishes; anything else goes through the generic decoder.
+    try:
+        return _decode_fast(payload)
+    except (KeyError, ValueError, struct.error, UnicodeDecodeError):
+        scan = LaserScan.deserialize(bytes(payload))
+        scan.ranges = np.asarray(scan.ranges, dtype=np.float32)
+        scan.intensities = np.asarray(scan.intensities, dtype=np.float32)
+
+        return scan
+
+
+def encode_laser_scan(stamp_ns, ranges, intensities, angle_increment, time_increment, scan_time, range_min,
+                      range_max, frame_id="laser"):
+    # little-endian CDR LaserScan, as the lidar node serializes it, built straight from float32 arrays
+    ranges = np.asarray(ranges, dtype="<f4")
+    intensities = np.asarray(intensities, dtype="<f4")
+    frame_id = frame_id.encode() + b"\0"
+
+    head = b"\x00\x01\x00\x00" + struct.pack("<3I", stamp_ns // 1_000_000_000, stamp_ns % 1_000_000_000,
+                                              len(frame_id)) + frame_id
+    head += b"\0" * (_align(len(head), 4) - len(head))
+
+    angle_max = angle_increment * (len(ranges) - 1)
+    limits = struct.pack("<7f", 0.0, angle_max, angle_increment, time_increment, scan_time, range_min, range_max)
+
+    return b"".join((head, limits, struct.pack("<I", len(ranges)), ranges.tobytes(),
+                     struct.pack("<I", len(intensities)), intensities.tobytes()))
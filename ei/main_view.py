@@ -1,48 +1,24 @@
-import cv2
 import numpy as np
 import pygame.image
 
-from dataclasses import dataclass
-
 from gfs.gui.interface import Interface
 from gfs.gui.used import Used
-from gfs.fonts import MOTO_MANGUCODE_10
+from gfs.fonts import MOTO_MANGUCODE_10, GlyphAtlas
+from gfs.image import Image
 from gfs.gui.button import *
+from gfs.surface import request_redraw
 
-from pycdr2 import IdlStruct
-from pycdr2.types import uint32, float32
-from typing import List
-
-from breezyslam.algorithms import RMHC_SLAM
 from breezyslam.sensors import Laser
 
 import time
+import functools
+import threading
 
-
-@dataclass
-class Time(IdlStruct, typename="Time"):
-    sec: uint32
-    nsec: uint32
-
-
-@dataclass
-class Header(IdlStruct, typename="Header"):
-    stamp: Time
-    frame_id: str
-
-
-@dataclass
-class LaserScan(IdlStruct, typename="LaserScan"):
-    header: Header
-    angle_min: float32
-    angle_max: float32
-    angle_increment: float32
-    time_increment: float32
-    scan_time: float32
-    range_min: float32
-    range_max: float32
-    ranges: List[float32]
-    intensities: List[float32]
+from ei.camera import process_camera_frame
+from ei.frame_pipeline import LatestFramePipeline
+from ei.laser_scan import decode_laser_scan
+from ei.rendering import LidarScanRenderer, MapRenderer
+from ei.slam_service import SlamClient, open_slam
 
 
 def message_callback(sample):
@@ -78,31 +54,67 @@ STATE_FINISH = 5
 # go to position
 LIDAR_MODE = 2
 
+# camera frames are decoded and searched for QR codes on this many workers, newest frame first
+CAMERA_WORKERS = 2
+CAMERA_USE_PROCESSES = False
+
+# search the QR code around its last position, with a full-frame detection every QR_REDETECT_INTERVAL frames
+QR_TRACKING = True
+QR_REDETECT_INTERVAL = 15
+
+# consume pose and map from a running slam_service.py instead of running SLAM in the viewer
+SLAM_SERVICE = False
+
+# keep the SLAM map in this file and resume from it when the viewer restarts; None starts from an empty map
+MAP_FILE = None
+
 
 class MainView:
-    def __init__(self, width, height, session):
+    def __init__(self, width, height, session, slam_service=SLAM_SERVICE, map_file=MAP_FILE):
         self.surface_configuration = (width, height)
         self.next_state = None
         self.session = session
 
-        self.qcd = cv2.QRCodeDetector()
+        # streaming images, written in place by the callbacks and drawn by render() under images_lock
+        self.images_lock = threading.Lock()
+        self.camera_image = Image()
 
-        self.camera_image_subscriber = self.session.declare_subscriber("turtle/camera", self.camera_image_callback)
-        self.camera_image = None
+        self.lidar_renderer = LidarScanRenderer()
+        self.lidar_image = Image()
+        self.map_image = Image()
 
-        self.lidar_image_subscriber = self.session.declare_subscriber("turtle/lidar", self.lidar_scan_callback)
-        self.lidar_image = None
-        self.map_image = None
+        # what render() last drew, to only draw what changed
+        self.drawn_images = {}
+        self.drawn_distance = None
+        self.distance_rect = None
+
+        # the distance changes with every camera frame: drawn glyph by glyph rather than rendered each time
+        self.distance_glyphs = GlyphAtlas(MOTO_MANGUCODE_30, (0, 0, 0), IVORY)
 
         self.lidar_text = render_font(MOTO_MANGUCODE_10, "Instant Lidar Data", (0, 0, 0))
         self.map_text = render_font(MOTO_MANGUCODE_10, "Slam Map Data", (0, 0, 0))
 
         self.laser = Laser(360, 5, 359, 4000, 0, 0)
+        self.scan_angles = np.arange(360, dtype=np.float32)
         self.map_size_meters = 5
-        self.slam = RMHC_SLAM(self.laser, 600, self.map_size_meters)
-        self.map = bytearray(600 * 600)
+        self.map_renderer = MapRenderer(600, 300)
         self.pos = (0, 0, 0)
 
+        if slam_service:
+            self.slam = None
+            self.slam_client = SlamClient(self.session, self.apply_slam_update, 600)
+        else:
+            self.slam = open_slam(self.laser, 600, self.map_size_meters, map_file)
+            self.slam_client = None
+            # live, read-only view of the SLAM map pixels
+            self.map_pixels = np.asarray(self.slam.map)
+
+        # scans update the local SLAM one at a time, and not once quit() has closed it
+        self.slam_lock = threading.Lock()
+        self.slam_running = True
+
+        self.lidar_image_subscriber = self.session.declare_subscriber("turtle/lidar", self.lidar_scan_callback)
+
         self.cmd_vel_publisher = self.session.declare_publisher("turtle/cmd_vel")
         self.message_publisher = self.session.declare_publisher("turtle/debug_message")
         self.message_subscriber = self.session.declare_subscriber("turtle/debug_message", message_callback)
@@ -135,6 +147,7 @@ class MainView:
         self.errSum_l = 0
 
         self.last_points = []
+        self.frames_since_detection = 0
         self.state = STATE_FINISH
         self.last_state = -1
 
@@ -158,126 +171,94 @@ class MainView:
         self.camera_distortion = np.array(
             [0.0212284835698144, 0.8546829039917951, 0.0034281408326615323, 0.0005749116561059772, -3.217248182814475])
 
+        self.camera_pipeline = self.open_camera_pipeline()
+        self.camera_image_subscriber = self.session.declare_subscriber("turtle/camera", self.camera_image_callback)
+
     def quit(self):
         self.camera_image_subscriber.undeclare()
+        self.camera_pipeline.close()
         self.lidar_image_subscriber.undeclare()
+        if self.slam_client is not None:
+            self.slam_client.quit()
+        if self.slam is not None:
+            # a scan already in the callback finishes with the SLAM it started with
+            with self.slam_lock:
+                self.slam_running = False
+                self.map_pixels = None
+                self.slam.close()
         self.cmd_vel_publisher.undeclare()
         self.message_publisher.undeclare()
         self.message_subscriber.undeclare()
 
-    def calculate_qr_code_coords(self, quad):
-
-        # Selected coordinate points for each corner of QR code.
-        qr_edges = np.array([[0, 0, 0],
-                             [0, 1, 0],
-                             [1, 1, 0],
-                             [1, 0, 0]], dtype='float32').reshape((4, 1, 3))
-
-        # determine the orientation of QR code coordinate system with respect to camera coorindate system.
-        ret, rvec, tvec = cv2.solvePnP(qr_edges, quad, self.camera_matrix, self.camera_distortion)
-
-        # Define unit xyz axes. These are then projected to camera view using the rotation matrix and translation
-        # vector.
-
-        unitv_points = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype='float32').reshape((4, 1, 3))
-        if ret:
-            points, jac = cv2.projectPoints(unitv_points, rvec, tvec, self.camera_matrix, self.camera_distortion)
-            # the returned points are pixel coordinates of each unit vector.
-            return points, rvec, tvec
-
-        # return empty arrays if rotation and translation values not found
-        else:
-            return [], [], []
+    def open_camera_pipeline(self):
+        # frames are submitted as (payload, previous_quad), the calibration is bound here
+        return LatestFramePipeline(
+            functools.partial(process_camera_frame, camera_matrix=self.camera_matrix,
+                              camera_distortion=self.camera_distortion),
+            self.apply_camera_frame, CAMERA_WORKERS, CAMERA_USE_PROCESSES)
 
     def camera_image_callback(self, sample):
-        image = np.frombuffer(bytes(sample.value.payload), dtype=np.uint8)
-        image = cv2.imdecode(image, 1)
-        image = cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
-        image = cv2.flip(image, 0)
+        previous_quad = None
 
-        ret_qr, decoded_info, points, _ = self.qcd.detectAndDecodeMulti(image)
-        quad = points[0] if points is not None else None
+        if QR_TRACKING and len(self.last_points) > 0 and self.frames_since_detection < QR_REDETECT_INTERVAL:
+            previous_quad = self.last_points
 
-        if points is not None:
-            image = cv2.polylines(image, points.astype(int), True, (255, 0, 0), 3)
+        self.camera_pipeline.submit(bytes(sample.value.payload), previous_quad)
 
-            self.qr_code_center_x = np.mean(quad[:, 1])
+    def apply_camera_frame(self, frame):
+        if frame.quad is not None:
+            self.qr_code_center_x = frame.qr_code_center_x
+            self.distance_to_qr_code = frame.distance_to_qr_code
 
-            axis_points, rvec, tvec = self.calculate_qr_code_coords(quad)
-            self.distance_to_qr_code = np.linalg.norm(tvec) * 4
-
-            # BGR color format
-            colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (0, 0, 0)]
+            self.last_points = frame.quad
+            self.frames_since_detection = self.frames_since_detection + 1 if frame.tracked else 0
+        else:
+            self.last_points = []
 
-            # check axes points are projected to camera view.
-            if len(axis_points) > 0:
-                axis_points = axis_points.reshape((4, 2))
+        self.update_state(frame.image.shape, frame.quad)
 
-                origin = (int(axis_points[0][0]), int(axis_points[0][1]))
+        with self.images_lock:
+            self.camera_image.write_array(frame.image)
 
-                for p, c in zip(axis_points[1:], colors[:3]):
-                    p = (int(p[0]), int(p[1]))
+        request_redraw()
 
-                    # Sometimes qr detector will make a mistake and projected point will overflow integer value. We skip
-                    # these cases.
-                    if origin[0] > 5 * image.shape[1] or origin[1] > 5 * image.shape[1]: break
-                    if p[0] > 5 * image.shape[1] or p[1] > 5 * image.shape[1]: break
+    def lidar_scan_callback(self, sample):
+        scan = decode_laser_scan(sample.payload)
 
-                    cv2.line(image, origin, p, c, 5)
+        ranges = scan.ranges
 
-        self.update_state(image.shape, quad)
+        if self.slam is not None:
+            with self.slam_lock:
+                if self.slam_running:
+                    # ranges are in meters; SLAM reads the array in place and scales it to millimeters
+                    self.slam.update(scans_mm=ranges, scan_angles_degrees=self.scan_angles, distance_scale=1000.0)
 
-        self.camera_image = pygame.surfarray.make_surface(image)
+                    self.apply_slam_update(self.slam.getpos(), self.map_pixels, self.slam.getdirty())
 
-    def lidar_scan_callback(self, sample):
-        scan = LaserScan.deserialize(sample.payload)
+        # draw instant scan on a pygame image
+        lidar_image = self.lidar_renderer.render(ranges * 1000.0)
 
-        angles = list(range(0, 360))
-        distances = list(map(lambda z: z * 1000.0, scan.ranges))
+        with self.images_lock:
+            self.lidar_image.write_array(lidar_image)
 
-        self.slam.update(scans_mm=distances, scan_angles_degrees=angles)
-        self.slam.getmap(self.map)
+        request_redraw()
 
+    def apply_slam_update(self, position, map_pixels, dirty_rect):
         # transform into meters + translate in order to center the map
-        self.pos = self.slam.getpos()
-        self.pos = (self.pos[0] / 10, self.pos[1] / 10, self.pos[2])
+        self.pos = (position[0] / 10, position[1] / 10, position[2])
         self.pos = (
             self.pos[0] - self.map_size_meters * 100 / 2, self.pos[1] - self.map_size_meters * 100 / 2, self.pos[2])
 
-        # transform map bytearray into a pygame image
-        map_image = np.array(self.map).reshape((600, 600))
-        _, map_image = cv2.threshold(map_image, 100, 255, cv2.THRESH_BINARY)
-        map_image = cv2.rotate(map_image, cv2.ROTATE_90_COUNTERCLOCKWISE)
-        map_image = cv2.cvtColor(map_image, cv2.COLOR_GRAY2RGB)
-
+        # re-render only the part of the map this scan changed into the persistent map image
         x = int(300 + self.pos[1])
         y = int(300 - self.pos[0])
 
-        map_image = cv2.circle(map_image, (x, y), 10, (0, 0, 255), -1)
+        map_image = self.map_renderer.update(map_pixels, dirty_rect, (x, y))
 
-        map_image = cv2.resize(map_image, (300, 300))
-
-        self.map_image = pygame.surfarray.make_surface(map_image)
-
-        # draw instant scan on a pygame image
+        with self.images_lock:
+            self.map_image.write_array(map_image)
 
-        lidar_image = np.zeros((600, 600, 3), dtype=np.uint8)
-
-        for i, distance in enumerate(distances):
-            if distance < 750:
-                # fit the distance inside the window
-                real_distance = distance / 750.0 * 300.0
-
-                angle = np.radians(angles[i])
-                x = int(300.0 + real_distance * np.cos(angle))
-                y = int(300.0 + real_distance * np.sin(angle))
-
-                lidar_image = cv2.circle(lidar_image, (x, y), 10, (0, 255, 0), -1)
-
-        lidar_image = cv2.circle(lidar_image, (300, 300), 10, (255, 255, 255), -1)
-        lidar_image = cv2.rotate(lidar_image, cv2.ROTATE_90_COUNTERCLOCKWISE)
-        lidar_image = cv2.resize(lidar_image, (300, 300))
-        self.lidar_image = pygame.surfarray.make_surface(lidar_image)
+        request_redraw()
 
     def update_state(self, image_shape, quad):
         alignment_tolerance = 50
@@ -409,7 +390,7 @@ class MainView:
                 self.cmd_vel_publisher.put(("Forward", 0.0))
                 self.cmd_vel_publisher.put(("Rotate", 0.0))
 
-                err_w = -self.qr_code_center_x + self.camera_image.get_width() / 2
+                err_w = -self.qr_code_center_x + self.camera_image.width / 2
                 err_l = self.distance_to_qr_code - 30
 
                 dErr_w = err_w - self.lastErr_w
@@ -444,30 +425,53 @@ class MainView:
         elif self.mode == LIDAR_MODE:
             self.go_to_destination()
 
+    def render_panel(self, surface, image, x, y):
+        # draws image in its frame at (x, y) if it changed since it was drawn; True when the frame was drawn as well
+        previous = self.drawn_images.get((x, y))
+        size = (image.width, image.height)
+
+        if not image.version or previous == (image.version, size):
+            return False
+
+        self.drawn_images[(x, y)] = (image.version, size)
+
+        if previous is not None and previous[1] == size:
+            surface.draw_image(image, x, y)
+            return False
+
+        if previous is not None:
+            surface.draw_rect(IVORY, pygame.Rect(x - 5, y - 5, previous[1][0] + 10, previous[1][1] + 10))
+
+        surface.draw_rect(DARKBLUE, pygame.Rect(x - 5, y - 5, image.width + 10, image.height + 10))
+        surface.draw_image(image, x, y)
+
+        return True
+
     def render(self, surface):
-        surface.fill(IVORY)
+        # only what changed since the last frame is drawn, everything when the surface asks for a full redraw
+        if surface.full_redraw:
+            surface.fill(IVORY)
 
-        if self.camera_image is not None:
-            surface.draw_rect(DARKBLUE, pygame.Rect(10, 10, self.camera_image.get_width() + 10,
-                                                    self.camera_image.get_height() + 10))
-            surface.blit(self.camera_image, 15, 15)
+            self.drawn_images = {}
+            self.drawn_distance = None
+            self.distance_rect = None
 
-        if self.lidar_image is not None:
-            surface.draw_rect(DARKBLUE, pygame.Rect(960, 20, self.lidar_image.get_width() + 10,
-                                                    self.lidar_image.get_height() + 10))
-            surface.blit(self.lidar_image, 965, 25)
+        with self.images_lock:
+            self.render_panel(surface, self.camera_image, 15, 15)
 
-            surface.draw_image(self.lidar_text, 1050, 335)
+            if self.render_panel(surface, self.lidar_image, 965, 25):
+                surface.draw_image(self.lidar_text, 1050, 335)
 
-        if self.map_image is not None:
-            surface.draw_rect(DARKBLUE, pygame.Rect(960, 400, self.map_image.get_width() + 10,
-                                                    self.map_image.get_height() + 10))
-            surface.blit(self.map_image, 965, 405)
+            if self.render_panel(surface, self.map_image, 965, 405):
+                surface.draw_image(self.map_text, 1075, 385)
 
-            surface.draw_image(self.map_text, 1075, 385)
+        distance = f'Distance: {self.distance_to_qr_code:.2f}cm'
 
-        text = render_font(MOTO_MANGUCODE_30, f'Distance: {self.distance_to_qr_code:.2f}cm', (0, 0, 0))
+        if distance != self.drawn_distance:
+            if self.distance_rect is not None:
+                surface.draw_rect(IVORY, self.distance_rect)
 
-        surface.draw_image(text, 50, 400)
+            self.drawn_distance = distance
+            self.distance_rect = self.distance_glyphs.draw(surface, distance, 50, 400)
 
         self.interface.render(surface)
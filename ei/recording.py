@@ -0,0 +1,274 @@
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+
+from collections import namedtuple
+
+# A log is a file of records, appended as samples arrive: timestamp (ns since the epoch), key length, payload
+# length, then the key and the raw payload. Every record stands alone, so a log cut short by a crash only loses its
+# last, incomplete record. Next to it, path + INDEX_SUFFIX holds (timestamp, offset) entries of one record every
+# INDEX_INTERVAL_NS, for seeking without reading the log.
+LOG_MAGIC = b"EILOG001"
+INDEX_MAGIC = b"EIIDX001"
+INDEX_SUFFIX = ".idx"
+INDEX_INTERVAL_NS = 1_000_000_000
+
+RECORD_KEYS = "turtle/**"
+
+_RECORD = struct.Struct("<qHI")
+_INDEX_ENTRY = struct.Struct("<qQ")
+
+# records are written to disk at least this often, and when the recorder closes
+_FLUSH_INTERVAL_NS = 1_000_000_000
+
+Record = namedtuple("Record", "timestamp_ns key payload")
+
+
+def sample_payload(sample):
+    # zenoh samples carry their payload either directly or in their value, depending on the version
+    payload = getattr(sample, "payload", None)
+
+    return payload if payload is not None else sample.value.payload
+
+
+class LogWriter:
+    # Appends records to a log and its index; safe to call from several zenoh callback threads.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+        self.file = open(path, "wb")
+        self.index = open(path + INDEX_SUFFIX, "wb")
+
+        self.file.write(LOG_MAGIC)
+        self.index.write(INDEX_MAGIC)
+
+        # wall clock at open plus the monotonic time since, so that an NTP step cannot make the stamps go backwards
+        self.clock_offset_ns = time.time_ns() - time.monotonic_ns()
+        self.last_ns = 0
+
+        self.offset = len(LOG_MAGIC)
+        self.next_index_ns = 0
+        self.next_flush_ns = 0
+        self.records = 0
+
+    def write(self, key, payload, timestamp_ns=None):
+        key = key.encode()
+
+        with self.lock:
+            # stamped under the lock, so that records from different threads stay in order
+            if timestamp_ns is None:
+                timestamp_ns = time.monotonic_ns() + self.clock_offset_ns
+
+            # the reader bisects the index by time: given stamps must not go backwards either
+            timestamp_ns = self.last_ns = max(timestamp_ns, self.last_ns)
+
+            if timestamp_ns >= self.next_index_ns:
+                self.index.write(_INDEX_ENTRY.pack(timestamp_ns, self.offset))
+                self.next_index_ns = timestamp_ns + INDEX_INTERVAL_NS
+
+            self.file.write(_RECORD.pack(timestamp_ns, len(key), len(payload)))
+            self.file.write(key)
+            self.file.write(payload)
+
+            self.offset += _RECORD.size + len(key) + len(payload)
+            self.records += 1
+
+            if timestamp_ns >= self.next_flush_ns:
+                self.file.flush()
+                self.index.flush()
+                self.next_flush_ns = timestamp_ns + _FLUSH_INTERVAL_NS
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+            self.index.close()
+
+
+class LogReader:
+    # Reads a log through a read-only memory map: payloads are memoryviews into it, so a log of any size replays
+    # without being loaded, and the pages read are left for the system to reclaim.
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as file:
+            # a recorder that died before writing the magic leaves an empty file, which cannot be mapped
+            if os.fstat(file.fileno()).st_size < len(LOG_MAGIC):
+                raise ValueError(f"{path} is not a log")
+
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mmap[:len(LOG_MAGIC)] != LOG_MAGIC:
+            raise ValueError(f"{path} is not a log")
+
+        self.view = memoryview(self.mmap)
+        self.index_timestamps, self.index_offsets = self.read_index()
+
+    def read_index(self):
+        # falls back on scanning the log when the index is missing, or points past the end of the log
+        timestamps, offsets = [], []
+
+        try:
+            with open(self.path + INDEX_SUFFIX, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            data = b""
+
+        if data[:len(INDEX_MAGIC)] == INDEX_MAGIC:
+            entries = data[len(INDEX_MAGIC):]
+            entries = entries[:len(entries) // _INDEX_ENTRY.size * _INDEX_ENTRY.size]
+
+            for timestamp_ns, offset in _INDEX_ENTRY.iter_unpack(entries):
+                if offset >= len(self.mmap):
+                    break
+
+                timestamps.append(timestamp_ns)
+                offsets.append(offset)
+
+        if not offsets:
+            next_index_ns = 0
+
+            for offset, record in self.scan(len(LOG_MAGIC)):
+                if record.timestamp_ns >= next_index_ns:
+                    timestamps.append(record.timestamp_ns)
+                    offsets.append(offset)
+                    next_index_ns = record.timestamp_ns + INDEX_INTERVAL_NS
+
+        return timestamps, offsets
+
+    def scan(self, offset):
+        # (offset, record) from offset on, up to the last complete record
+        end = len(self.mmap)
+
+        while offset + _RECORD.size <= end:
+            timestamp_ns, key_length, payload_length = _RECORD.unpack_from(self.mmap, offset)
+
+            key_start = offset + _RECORD.size
+            payload_start = key_start + key_length
+            next_offset = payload_start + payload_length
+
+            if next_offset > end:
+                return
+
+            key = bytes(self.view[key_start:payload_start]).decode()
+
+            yield offset, Record(timestamp_ns, key, self.view[payload_start:next_offset])
+
+            offset = next_offset
+
+    @property
+    def start_ns(self):
+        return self.index_timestamps[0] if self.index_timestamps else None
+
+    def records(self, start_ns=None, end_ns=None, keys=None):
+        # records in [start_ns, end_ns), only those with a key in keys if given; starts from the index entry before
+        # start_ns rather than from the beginning of the log
+        offset = len(LOG_MAGIC)
+
+        if start_ns is not None and self.index_timestamps:
+            entry = bisect.bisect_right(self.index_timestamps, start_ns) - 1
+            offset = self.index_offsets[max(entry, 0)]
+
+        for _, record in self.scan(offset):
+            if start_ns is not None and record.timestamp_ns < start_ns:
+                continue
+            if end_ns is not None and record.timestamp_ns >= end_ns:
+                return
+            if keys is None or record.key in keys:
+                yield record
+
+    def __iter__(self):
+        return self.records()
+
+    def close(self):
+        # payloads still in use keep the map open until they go
+        self.view.release()
+
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass
+
+
+class Recorder:
+    # Records every sample published under key_expr to a log.
+    def __init__(self, session, path, key_expr=RECORD_KEYS):
+        self.writer = LogWriter(path)
+        self.subscriber = session.declare_subscriber(key_expr, self.callback)
+
+    def callback(self, sample):
+        self.writer.write(str(sample.key_expr), bytes(sample_payload(sample)))
+
+    def close(self):
+        self.subscriber.undeclare()
+        self.writer.close()
+
+
+class ReplayedSample:
+    # Stands in for a zenoh sample in subscriber callbacks, whichever way they read the payload.
+    def __init__(self, key_expr, payload, timestamp_ns):
+        self.key_expr = key_expr
+        self.payload = payload
+        self.value = self
+        self.timestamp_ns = timestamp_ns
+
+
+class ZenohSink:
+    # Republishes replayed records on the session, under their recorded keys.
+    def __init__(self, session):
+        self.session = session
+        self.publishers = {}
+
+    def __call__(self, record):
+        publisher = self.publishers.get(record.key)
+
+        if publisher is None:
+            publisher = self.publishers[record.key] = self.session.declare_publisher(record.key)
+
+        publisher.put(bytes(record.payload))
+
+    def close(self):
+        for publisher in self.publishers.values():
+            publisher.undeclare()
+
+
+class CallbackSink:
+    # Calls subscriber callbacks directly, e.g. {"turtle/lidar": main_view.lidar_scan_callback}; records with no
+    # callback are skipped. Payloads stay memoryviews into the log.
+    def __init__(self, callbacks):
+        self.callbacks = callbacks
+
+    def __call__(self, record):
+        callback = self.callbacks.get(record.key)
+
+        if callback is not None:
+            callback(ReplayedSample(record.key, record.payload, record.timestamp_ns))
+
+    def close(self):
+        pass
+
+
+def replay(reader, sink, speed=1.0, start_ns=None, end_ns=None, keys=None):
+    # Feeds the records of reader to sink, spaced as they were recorded divided by speed; speed None or 0 replays
+    # as fast as the sink takes them. Returns the number of records replayed.
+    count = 0
+    first_ns = None
+    started = time.perf_counter()
+
+    for record in reader.records(start_ns, end_ns, keys):
+        if speed:
+            if first_ns is None:
+                first_ns = record.timestamp_ns
+
+            delay = (record.timestamp_ns - first_ns) / 1e9 / speed - (time.perf_counter() - started)
+
+            if delay > 0:
+                time.sleep(delay)
+
+        sink(record)
+        count += 1
+
+    return count
@@ -0,0 +1,113 @@
+import cv2
+import numpy as np
+
+
+class LidarScanRenderer:
+    # Draws an instant scan straight at display resolution, already rotated the way the view expects it: the robot
+    # faces up and the scan turns counter-clockwise, one ray per degree.
+    def __init__(self, size=300, max_distance_mm=750, point_radius=5):
+        self.size = size
+        self.center = size // 2
+        self.max_distance_mm = max_distance_mm
+        self.scale = (size / 2) / max_distance_mm
+        self.point_radius = point_radius
+
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * point_radius + 1, 2 * point_radius + 1))
+        self.mask = np.zeros((size, size), dtype=np.uint8)
+
+        self.cos = None
+        self.sin = None
+
+    def lookup_tables(self, count):
+        if self.cos is None or len(self.cos) != count:
+            angles = np.radians(np.arange(count, dtype=np.float32))
+            self.cos = np.cos(angles)
+            self.sin = np.sin(angles)
+
+    def render(self, distances_mm):
+        distances = np.asarray(distances_mm, dtype=np.float32)
+        self.lookup_tables(len(distances))
+
+        visible = (distances > 0) & (distances < self.max_distance_mm)
+        radius = distances[visible] * self.scale
+
+        cols = (self.center + radius * self.sin[visible]).astype(np.intp)
+        rows = (self.center - radius * self.cos[visible]).astype(np.intp)
+
+        # plot every hit in one go, then grow them into disks with a single dilation
+        self.mask.fill(0)
+        self.mask[rows, cols] = 255
+
+        image = np.zeros((self.size, self.size, 3), dtype=np.uint8)
+        image[:, :, 1] = cv2.dilate(self.mask, self.kernel)
+
+        return cv2.circle(image, (self.center, self.center), self.point_radius, (255, 255, 255), -1)
+
+
+class MapRenderer:
+    # Keeps the thresholded, rotated and downscaled map in a persistent display buffer and only re-processes the
+    # region of the map that changed, plus the area under the old and new robot marker.
+    def __init__(self, map_size_pixels=600, size=300, marker_radius=5):
+        self.map_size_pixels = map_size_pixels
+        self.size = size
+        self.factor = map_size_pixels // size
+        self.marker_radius = marker_radius
+
+        # map without the robot marker, and what is displayed
+        self.base = np.zeros((size, size), dtype=np.uint8)
+        self.image = np.zeros((size, size, 3), dtype=np.uint8)
+
+        self.marker_rect = None
+
+    def display_rect(self, rect):
+        # map rect (x, y, width, height) -> display rows/cols, rotated counter-clockwise and aligned on the scale
+        x, y, width, height = rect
+        f = self.factor
+
+        x0, y0 = x // f * f, y // f * f
+        x1 = min(-(-(x + width) // f) * f, self.map_size_pixels)
+        y1 = min(-(-(y + height) // f) * f, self.map_size_pixels)
+
+        rows = slice((self.map_size_pixels - x1) // f, (self.map_size_pixels - x0) // f)
+        cols = slice(y0 // f, y1 // f)
+
+        return (x0, y0, x1, y1), rows, cols
+
+    def update_region(self, map_pixels, rect):
+        (x0, y0, x1, y1), rows, cols = self.display_rect(rect)
+
+        region = map_pixels[y0:y1, x0:x1]
+
+        # raw 16-bit SLAM pixels: keep the same top byte Map.get() would give
+        if region.dtype == np.uint16:
+            region = (region >> 8).astype(np.uint8)
+
+        _, region = cv2.threshold(region, 100, 255, cv2.THRESH_BINARY)
+        region = cv2.rotate(region, cv2.ROTATE_90_COUNTERCLOCKWISE)
+
+        self.base[rows, cols] = cv2.resize(region, (cols.stop - cols.start, rows.stop - rows.start))
+
+        return rows, cols
+
+    def update(self, map_pixels, dirty_rect, marker):
+        regions = []
+
+        if dirty_rect is not None:
+            regions.append(self.update_region(map_pixels, dirty_rect))
+
+        x, y = int(marker[0]) // self.factor, int(marker[1]) // self.factor
+        r = self.marker_radius
+        marker_rect = (max(x - r, 0), max(y - r, 0), min(x + r + 1, self.size), min(y + r + 1, self.size))
+
+        # restore the map under the previous marker
+        for rect in (self.marker_rect, marker_rect):
+            if rect is not None:
+                regions.append((slice(rect[1], rect[3]), slice(rect[0], rect[2])))
+
+        for rows, cols in regions:
+            self.image[rows, cols] = self.base[rows, cols, np.newaxis]
+
+        self.marker_rect = marker_rect
+        cv2.circle(self.image, (x, y), r, (0, 0, 255), -1)
+
+        return self.image
@@ -0,0 +1,282 @@
+import heapq
+import json
+import math
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from ei.laser_scan import encode_laser_scan
+
+# The world: a 6 m x 6 m room on a 1 cm occupancy grid, with three boxes and a QR code on the north wall. Robots
+# start a meter from the code, facing it.
+WORLD_SIZE_M = 6.0
+CELL_M = 0.01
+WALL_M = 0.05
+BOXES_M = [(1.2, 1.0, 1.8, 1.5), (3.8, 3.6, 4.5, 4.0), (4.4, 1.2, 4.7, 2.4)]
+
+QR_TEXT = "turtle"
+QR_CENTER_M = (3.0, WORLD_SIZE_M - WALL_M)
+QR_SIDE_M = 0.25
+QR_HEIGHT_M = 0.2
+
+ROBOT_RADIUS_M = 0.1
+START_POSE = (WORLD_SIZE_M / 2, WORLD_SIZE_M - 1.2, math.pi / 2)
+
+# LDS-01 lidar: one ray per degree, counter-clockwise from the heading
+LIDAR_RAYS = 360
+LIDAR_RANGE_MIN_M = 0.12
+LIDAR_RANGE_MAX_M = 3.5
+LIDAR_NOISE_M = 0.01
+
+# camera: horizontal field of view and height of the Raspberry Pi camera on the robot
+CAMERA_FOV_DEGREES = 62.0
+CAMERA_HEIGHT_M = 0.1
+JPEG_QUALITY = 95
+
+# turtle/cmd_vel values go to the motor board as integers in these units
+LINEAR_UNIT_M_S = 0.01
+ANGULAR_UNIT_RAD_S = 0.01
+
+
+def occupancy_grid():
+    cells = int(round(WORLD_SIZE_M / CELL_M))
+    wall = int(round(WALL_M / CELL_M))
+
+    grid = np.zeros((cells, cells), dtype=bool)
+    grid[:wall, :] = grid[-wall:, :] = grid[:, :wall] = grid[:, -wall:] = True
+
+    for x0, y0, x1, y1 in BOXES_M:
+        grid[int(y0 / CELL_M):int(y1 / CELL_M), int(x0 / CELL_M):int(x1 / CELL_M)] = True
+
+    return grid
+
+
+class World:
+    # The occupancy grid (rows along y) and its ray caster, shared by all robots.
+    def __init__(self):
+        self.grid = occupancy_grid()
+
+        self.cells = self.grid.ravel()
+        self.steps_m = np.arange(LIDAR_RANGE_MIN_M, LIDAR_RANGE_MAX_M, CELL_M, dtype=np.float32)
+        angles = np.radians(np.arange(LIDAR_RAYS, dtype=np.float32))
+        self.ray_cos, self.ray_sin = np.cos(angles), np.sin(angles)
+
+        self.rng = np.random.default_rng()
+
+    def occupied(self, x_m, y_m):
+        col, row = int(x_m / CELL_M), int(y_m / CELL_M)
+
+        return not (0 <= row < self.grid.shape[0] and 0 <= col < self.grid.shape[1]) or self.grid[row, col]
+
+    def cast(self, poses):
+        # ranges in meters of every ray of every pose (x_m, y_m, theta), all marched at once cell by cell; 0 where
+        # nothing is in range, as the lidar reports it
+        poses = np.asarray(poses, dtype=np.float32).reshape(-1, 3)
+        x, y, theta = poses[:, 0, None], poses[:, 1, None], poses[:, 2, None]
+
+        cos, sin = np.cos(theta), np.sin(theta)
+        dx = cos * self.ray_cos - sin * self.ray_sin
+        dy = sin * self.ray_cos + cos * self.ray_sin
+
+        # the border of the grid is wall: rays leaving it are clamped onto it
+        rows, cols = self.grid.shape
+        col = np.clip((x[..., None] + dx[..., None] * self.steps_m) * (1 / CELL_M), 0, cols - 1).astype(np.int32)
+        row = np.clip((y[..., None] + dy[..., None] * self.steps_m) * (1 / CELL_M), 0, rows - 1).astype(np.int32)
+
+        hits = self.cells[row * cols + col]
+
+        first = hits.argmax(axis=-1)
+        ranges = np.where(hits.any(axis=-1), self.steps_m[first], 0)
+
+        if LIDAR_NOISE_M:
+            ranges = np.where(ranges > 0, ranges + self.rng.normal(0, LIDAR_NOISE_M, ranges.shape), 0)
+
+        return ranges.astype(np.float32)
+
+
+class CameraRenderer:
+    # Frames of the room as the robot camera sees them: wall and floor, and the QR code projected with a pinhole
+    # camera model when it is in view. Boxes are not drawn and do not hide the code.
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        self.focal = width / 2 / math.tan(math.radians(CAMERA_FOV_DEGREES) / 2)
+
+        self.background = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.background[:self.height // 2] = (200, 200, 190)
+        self.background[self.height // 2:] = (90, 110, 120)
+
+        code = cv2.QRCodeEncoder.create().encode(QR_TEXT)
+        self.code = cv2.cvtColor(cv2.resize(code, (code.shape[1] * 8, code.shape[0] * 8),
+                                            interpolation=cv2.INTER_NEAREST), cv2.COLOR_GRAY2BGR)
+
+        # corners of the code on the wall, in the order of the code image corners: top left, top right,
+        # bottom right, bottom left, seen from inside the room
+        cx, cy = QR_CENTER_M
+        half = QR_SIDE_M / 2
+        self.corners = np.array([(cx - half, cy, QR_HEIGHT_M + half), (cx + half, cy, QR_HEIGHT_M + half),
+                                 (cx + half, cy, QR_HEIGHT_M - half), (cx - half, cy, QR_HEIGHT_M - half)])
+
+        side = self.code.shape[0]
+        self.code_corners = np.float32([(0, 0), (side, 0), (side, side), (0, side)])
+
+    def render(self, pose):
+        x, y, theta = pose
+        frame = self.background.copy()
+
+        forward = (self.corners[:, 0] - x) * math.cos(theta) + (self.corners[:, 1] - y) * math.sin(theta)
+        left = -(self.corners[:, 0] - x) * math.sin(theta) + (self.corners[:, 1] - y) * math.cos(theta)
+
+        if forward.min() > 0.05:
+            u = self.width / 2 - self.focal * left / forward
+            v = self.height / 2 - self.focal * (self.corners[:, 2] - CAMERA_HEIGHT_M) / forward
+
+            quad = np.float32(np.stack((u, v), axis=1))
+
+            if quad[:, 0].max() > 0 and quad[:, 0].min() < self.width:
+                homography = cv2.getPerspectiveTransform(self.code_corners, quad)
+                cv2.warpPerspective(self.code, homography, (self.width, self.height), frame,
+                                    borderMode=cv2.BORDER_TRANSPARENT)
+
+        return frame
+
+
+class SimulatedTurtle:
+    # One robot: integrates the commands it receives on <prefix>/cmd_vel, and publishes what its lidar and camera
+    # would see on <prefix>/lidar and <prefix>/camera.
+    def __init__(self, session, world, renderer, prefix="turtle", pose=START_POSE):
+        self.session = session
+        self.world = world
+        self.renderer = renderer
+        self.prefix = prefix
+
+        self.pose = np.array(pose, dtype=np.float64)
+        self.linear_m_s = 0.0
+        self.angular_rad_s = 0.0
+        self.moved_at = time.perf_counter()
+        self.lock = threading.Lock()
+
+        self.lidar_publisher = session.declare_publisher(prefix + "/lidar")
+        self.camera_publisher = session.declare_publisher(prefix + "/camera")
+        self.cmd_vel_subscriber = session.declare_subscriber(prefix + "/cmd_vel", self.cmd_vel_callback)
+
+        self.scans = 0
+        self.frames = 0
+
+    def quit(self):
+        self.cmd_vel_subscriber.undeclare()
+        self.lidar_publisher.undeclare()
+        self.camera_publisher.undeclare()
+
+    def cmd_vel_callback(self, sample):
+        command, value = json.loads(bytes(sample.payload).decode("utf-8"))
+
+        with self.lock:
+            self.move()
+
+            if command == "Forward":
+                self.linear_m_s = float(value) * LINEAR_UNIT_M_S
+            elif command == "Rotate":
+                self.angular_rad_s = float(value) * ANGULAR_UNIT_RAD_S
+
+    def move(self):
+        # integrates the current velocities up to now; a robot that would hit something stays where it is
+        now = time.perf_counter()
+        dt, self.moved_at = now - self.moved_at, now
+
+        x, y, theta = self.pose
+        theta += self.angular_rad_s * dt
+        x += self.linear_m_s * dt * math.cos(theta)
+        y += self.linear_m_s * dt * math.sin(theta)
+
+        ahead = math.copysign(ROBOT_RADIUS_M, self.linear_m_s)
+        if self.linear_m_s and self.world.occupied(x + ahead * math.cos(theta), y + ahead * math.sin(theta)):
+            x, y = self.pose[:2]
+
+        self.pose[:] = x, y, theta
+
+    def current_pose(self):
+        with self.lock:
+            self.move()
+
+            return tuple(self.pose)
+
+    def publish_scan(self, ranges, scan_time):
+        payload = encode_laser_scan(time.time_ns(), ranges, np.zeros(LIDAR_RAYS, dtype=np.float32),
+                                    2 * math.pi / LIDAR_RAYS, scan_time / LIDAR_RAYS, scan_time,
+                                    LIDAR_RANGE_MIN_M, LIDAR_RANGE_MAX_M)
+        self.lidar_publisher.put(payload)
+        self.scans += 1
+
+    def publish_frame(self):
+        frame = self.renderer.render(self.current_pose())
+        _, jpeg = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY])
+
+        self.camera_publisher.put(jpeg.tobytes())
+        self.frames += 1
+
+
+class Simulation:
+    # Runs robots at the requested rates from one thread: lidar scans of all robots are cast together, camera
+    # frames are rendered one by one. Rates no machine can keep up with just run as fast as they can.
+    def __init__(self, session, robots=1, lidar_hz=5.0, camera_fps=10.0, width=400, height=300,
+                 prefixes=None):
+        self.world = World()
+        self.renderer = CameraRenderer(width, height)
+
+        prefixes = prefixes or ["turtle"] + [f"turtle{i}" for i in range(1, robots)]
+        self.robots = [SimulatedTurtle(session, self.world, self.renderer, prefix) for prefix in prefixes]
+
+        self.lidar_period = 1 / lidar_hz if lidar_hz else None
+        self.camera_period = 1 / camera_fps if camera_fps else None
+
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def quit(self):
+        self.running = False
+
+        if self.thread is not None:
+            self.thread.join()
+
+        for robot in self.robots:
+            robot.quit()
+
+    def run(self):
+        now = time.perf_counter()
+        due = []
+
+        if self.lidar_period:
+            heapq.heappush(due, (now, "lidar", -1))
+
+        if self.camera_period:
+            # frames of different robots are spread over the period
+            for i in range(len(self.robots)):
+                heapq.heappush(due, (now + self.camera_period * i / len(self.robots), "camera", i))
+
+        while self.running and due:
+            at, kind, i = heapq.heappop(due)
+
+            delay = at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            if kind == "lidar":
+                ranges = self.world.cast([robot.current_pose() for robot in self.robots])
+
+                for robot, robot_ranges in zip(self.robots, ranges):
+                    robot.publish_scan(robot_ranges, self.lidar_period)
+
+                period = self.lidar_period
+            else:
+                self.robots[i].publish_frame()
+                period = self.camera_period
+
+            # behind schedule: carry on from now instead of bursting to catch up
+            heapq.heappush(due, (max(at + period, time.perf_counter()), kind, i))
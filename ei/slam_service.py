@@ -0,0 +1,313 @@
+import os
+import struct
+import sys
+import threading
+
+import numpy as np
+
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from breezyslam.algorithms import RMHC_SLAM
+from breezyslam.sensors import Laser
+
+from ei.laser_scan import decode_laser_scan
+
+POSE_KEY = "turtle/slam/pose"
+MAP_KEY = "turtle/slam/map"
+
+# name of the shared-memory segment holding the map when the service runs on the viewer's host
+SHARED_MAP_NAME = "turtle_slam_map"
+
+# remote viewers get the whole map every FULL_MAP_INTERVAL scans, so they can join at any time
+FULL_MAP_INTERVAL = 50
+
+# sequence, x_mm, y_mm, theta_degrees, dirty rect (x, y, width, height; width 0 when nothing changed)
+_POSE = struct.Struct("<Idddiiii")
+
+# sequence, map size in pixels, rect (x, y, width, height), followed by the rect's pixels, one byte each
+_MAP_PATCH = struct.Struct("<Iiiiii")
+
+# size in pixels, sequence of the last update; the 16-bit pixels follow
+_SHARED_HEADER = struct.Struct("<II")
+_SHARED_HEADER_SIZE = 16
+
+# segments created by this process, which the resource tracker must keep tracking when it also attaches them
+_created_maps = set()
+
+
+def open_slam(laser, map_size_pixels, map_size_meters, map_file=None, **params):
+    # RMHC_SLAM kept in map_file when one is given, so that a restart resumes it: loaded from the file if it exists,
+    # saved there first otherwise. The file's map size wins over the one asked for.
+    if map_file is None:
+        return RMHC_SLAM(laser, map_size_pixels, map_size_meters, **params)
+
+    if not os.path.exists(map_file):
+        RMHC_SLAM(laser, map_size_pixels, map_size_meters, **params).save(map_file)
+
+    return RMHC_SLAM.load(map_file, persistent=True, **params)
+
+
+def encode_pose(sequence, position, dirty_rect):
+    return _POSE.pack(sequence, *position, *(dirty_rect or (0, 0, 0, 0)))
+
+
+def decode_pose(payload):
+    sequence, x_mm, y_mm, theta_degrees, *rect = _POSE.unpack_from(payload)
+
+    return sequence, (x_mm, y_mm, theta_degrees), tuple(rect) if rect[2] > 0 else None
+
+
+def encode_map_patch(sequence, map_pixels, rect):
+    x, y, width, height = rect
+    region = (map_pixels[y:y + height, x:x + width] >> 8).astype(np.uint8)
+
+    return _MAP_PATCH.pack(sequence, len(map_pixels), *rect) + region.tobytes()
+
+
+def decode_map_patch(payload):
+    sequence, size_pixels, x, y, width, height = _MAP_PATCH.unpack_from(payload)
+    region = np.frombuffer(payload, dtype=np.uint8, count=width * height, offset=_MAP_PATCH.size)
+
+    return sequence, size_pixels, (x, y, width, height), region.reshape((height, width))
+
+
+def union_rect(a, b):
+    if a is None or b is None:
+        return a or b
+
+    x0, y0 = min(a[0], b[0]), min(a[1], b[1])
+    x1, y1 = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+
+    return x0, y0, x1 - x0, y1 - y0
+
+
+class SharedMap:
+    # A square uint16 map in a named shared-memory segment: the service writes the pixels that changed after each
+    # scan, viewers on the same host render straight from it. Readers may see a region half-way through an update;
+    # the next update rewrites it, which is fine for display.
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+
+        size_pixels, _ = _SHARED_HEADER.unpack_from(shm.buf)
+        self.pixels = np.ndarray((size_pixels, size_pixels), dtype=np.uint16, buffer=shm.buf,
+                                 offset=_SHARED_HEADER_SIZE)
+
+    @classmethod
+    def create(cls, name, size_pixels):
+        size = _SHARED_HEADER_SIZE + size_pixels * size_pixels * 2
+
+        try:
+            shm = SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # left over by a service that did not exit cleanly
+            stale = SharedMemory(name)
+            stale.close()
+            stale.unlink()
+
+            shm = SharedMemory(name, create=True, size=size)
+
+        _SHARED_HEADER.pack_into(shm.buf, 0, size_pixels, 0)
+        _created_maps.add(shm.name)
+
+        return cls(shm, True)
+
+    @classmethod
+    def attach(cls, name):
+        # returns None when no service shares its map on this host. Only the creator may unlink the segment, but the
+        # resource tracker would do it when this process exits, so attached segments are not tracked.
+        try:
+            if sys.version_info >= (3, 13):
+                shm = SharedMemory(name, track=False)
+            else:
+                shm = SharedMemory(name)
+        except FileNotFoundError:
+            return None
+
+        # before 3.13 the segment is tracked anyway, once per process: the service unregisters it itself when it runs
+        # here, and the tracker knows it by its name with a leading slash
+        if sys.version_info < (3, 13) and os.name == "posix" and shm.name not in _created_maps:
+            resource_tracker.unregister("/" + shm.name, "shared_memory")
+
+        return cls(shm, False)
+
+    def write(self, sequence, map_pixels, rect):
+        x, y, width, height = rect
+        self.pixels[y:y + height, x:x + width] = map_pixels[y:y + height, x:x + width]
+
+        _SHARED_HEADER.pack_into(self.shm.buf, 0, len(self.pixels), sequence)
+
+    def close(self):
+        # views must go before the segment can be closed
+        del self.pixels
+        self.shm.close()
+
+        if self.owner:
+            self.shm.unlink()
+            _created_maps.discard(self.shm.name)
+
+
+class SlamService:
+    # Runs RMHC_SLAM on turtle/lidar and publishes the pose, plus the map for viewers on other hosts. On the same
+    # host the map is also shared through memory, so viewers read it without any copy. With a map_file, the map
+    # lives in that file and the service resumes from it when restarted.
+    def __init__(self, session, map_size_pixels=600, map_size_meters=5, shared_map_name=SHARED_MAP_NAME,
+                 publish_map=True, num_threads=1, map_file=None):
+        self.session = session
+        self.publish_map = publish_map
+
+        self.laser = Laser(360, 5, 359, 4000, 0, 0)
+        self.scan_angles = np.arange(360, dtype=np.float32)
+        self.slam = open_slam(self.laser, map_size_pixels, map_size_meters, map_file, num_threads=num_threads)
+        self.map_pixels = np.asarray(self.slam.map)
+        self.full_rect = (0, 0, len(self.map_pixels), len(self.map_pixels))
+
+        self.shared_map = SharedMap.create(shared_map_name, len(self.map_pixels)) if shared_map_name else None
+
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.running = True
+
+        self.pose_publisher = self.session.declare_publisher(POSE_KEY)
+        self.map_publisher = self.session.declare_publisher(MAP_KEY) if publish_map else None
+        self.lidar_subscriber = self.session.declare_subscriber("turtle/lidar", self.lidar_scan_callback)
+
+    def quit(self):
+        self.lidar_subscriber.undeclare()
+        self.pose_publisher.undeclare()
+
+        if self.map_publisher is not None:
+            self.map_publisher.undeclare()
+
+        # a scan already in the callback finishes with the shared map and the SLAM it started with
+        with self.lock:
+            self.running = False
+
+            if self.shared_map is not None:
+                self.shared_map.close()
+                self.shared_map = None
+
+            # the map file unmaps once nothing views it
+            self.map_pixels = None
+            self.slam.close()
+
+    def lidar_scan_callback(self, sample):
+        scan = decode_laser_scan(sample.payload)
+
+        # scans are processed one at a time, in the order they arrive; those still queued at quit are dropped
+        with self.lock:
+            if not self.running:
+                return
+
+            self.slam.update(scans_mm=scan.ranges, scan_angles_degrees=self.scan_angles, distance_scale=1000.0)
+
+            self.sequence += 1
+            dirty_rect = self.slam.getdirty()
+
+            if self.shared_map is not None and dirty_rect is not None:
+                self.shared_map.write(self.sequence, self.map_pixels, dirty_rect)
+
+            if self.map_publisher is not None:
+                rect = self.full_rect if self.sequence % FULL_MAP_INTERVAL == 1 else dirty_rect
+
+                if rect is not None:
+                    self.map_publisher.put(encode_map_patch(self.sequence, self.map_pixels, rect))
+
+            self.pose_publisher.put(encode_pose(self.sequence, self.slam.getpos(), dirty_rect))
+
+
+class SlamClient:
+    # Consumes a SlamService: calls on_update(position, map_pixels, dirty_rect) for every pose. The map comes from
+    # the shared-memory segment when the service runs on this host, otherwise from the published map patches.
+    def __init__(self, session, on_update, map_size_pixels=600, shared_map_name=SHARED_MAP_NAME):
+        self.session = session
+        self.on_update = on_update
+        self.map_size_pixels = map_size_pixels
+        self.shared_map_name = shared_map_name
+
+        self.shared_map = None
+        self.map_subscriber = None
+        self.last_sequence = 0
+        self.lock = threading.Lock()
+
+        self.open_map()
+
+        self.pose_subscriber = self.session.declare_subscriber(POSE_KEY, self.pose_callback)
+
+    def open_map(self):
+        self.shared_map = SharedMap.attach(self.shared_map_name) if self.shared_map_name else None
+
+        # a service sharing a map of another size is followed through its published patches, which say so too
+        if self.shared_map is not None and len(self.shared_map.pixels) != self.map_size_pixels:
+            size_pixels = len(self.shared_map.pixels)
+            print(f"[WARN] Ignoring {size_pixels}x{size_pixels} shared SLAM map, expected {self.map_size_pixels}")
+
+            self.shared_map.close()
+            self.shared_map = None
+
+        if self.shared_map is not None:
+            self.map_pixels = self.shared_map.pixels
+
+            # the first update renders the whole map
+            size_pixels = len(self.map_pixels)
+            self.pending_rect = (0, 0, size_pixels, size_pixels)
+        else:
+            self.map_pixels = np.zeros((self.map_size_pixels, self.map_size_pixels), dtype=np.uint8)
+            self.pending_rect = None
+
+            if self.map_subscriber is None:
+                self.map_subscriber = self.session.declare_subscriber(MAP_KEY, self.map_callback)
+
+    def quit(self):
+        self.pose_subscriber.undeclare()
+
+        if self.map_subscriber is not None:
+            self.map_subscriber.undeclare()
+
+        # callbacks still running see no map and return; the pixels view the segment, so they go before it closes
+        with self.lock:
+            self.map_pixels = None
+
+            if self.shared_map is not None:
+                self.shared_map.close()
+                self.shared_map = None
+
+    def map_callback(self, sample):
+        _, size_pixels, rect, region = decode_map_patch(bytes(sample.payload))
+        x, y, width, height = rect
+
+        with self.lock:
+            if self.map_pixels is None:
+                return
+
+            if size_pixels != len(self.map_pixels):
+                print(f"[WARN] Ignoring {size_pixels}x{size_pixels} SLAM map, expected {len(self.map_pixels)}")
+                return
+
+            self.map_pixels[y:y + height, x:x + width] = region
+            self.pending_rect = union_rect(self.pending_rect, rect)
+
+    def pose_callback(self, sample):
+        sequence, position, dirty_rect = decode_pose(bytes(sample.payload))
+
+        with self.lock:
+            if self.map_pixels is None:
+                return
+
+            # a restarted service counts from 1 again, in a segment it created anew: the old one no longer changes
+            if self.shared_map is not None and sequence < self.last_sequence:
+                self.map_pixels = None
+                self.shared_map.close()
+                self.open_map()
+
+            self.last_sequence = sequence
+
+            if self.shared_map is not None:
+                rect = union_rect(self.pending_rect, dirty_rect)
+            else:
+                rect = self.pending_rect
+
+            self.pending_rect = None
+
+            self.on_update(position, self.map_pixels, rect)
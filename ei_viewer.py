@@ -1,4 +1,5 @@
 from ei.main_view import MainView
+from gfs.surface import request_redraw
 
 import zenoh
 
@@ -13,6 +14,7 @@ class EiViewer:
         ]
 
         self.current_state = 0
+        self.rendered_state = None
 
     def quit(self):
         for state in self.state:
@@ -23,6 +25,7 @@ class EiViewer:
         if next_state is not None:
             self.state[self.current_state].next_state = None
             self.current_state = next_state
+            request_redraw()
 
     def update(self):
         self.state[self.current_state].update()
@@ -41,4 +44,9 @@ class EiViewer:
         self.next_state()
 
     def render(self, surface):
+        # a state only draws what changed since it last rendered: the one switched to redraws everything
+        if self.rendered_state != self.current_state:
+            self.rendered_state = self.current_state
+            surface.invalidate()
+
         self.state[self.current_state].render(surface)
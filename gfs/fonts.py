@@ -1,5 +1,7 @@
 import pygame
 
+from collections import OrderedDict
+
 from gfs.image import Image
 
 pygame.font.init()
@@ -9,11 +11,131 @@ MOTO_MANGUCODE_30 = pygame.font.Font("assets/fonts/MotomangucodeBold-3zde3.ttf",
 MOTO_MANGUCODE_10 = pygame.font.Font("assets/fonts/MotomangucodeBold-3zde3.ttf", 10)
 BULLET_TRACE_30 = pygame.font.Font("assets/fonts/BulletTrace7-rppO.ttf", 30)
 
+# bounds of the render_font cache: the least recently used texts go first when either is exceeded
+TEXT_CACHE_ENTRIES = 256
+TEXT_CACHE_BYTES = 8 * 1024 * 1024
+
+
+def surface_bytes(py_surface):
+    return py_surface.get_pitch() * py_surface.get_height()
+
+
+class TextCache:
+    # Rendered texts by (font, text, color), least recently used first.
+    def __init__(self, max_entries=TEXT_CACHE_ENTRIES, max_bytes=TEXT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.images = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, font, text, color):
+        key = (font, text, tuple(color))
+        image = self.images.get(key)
+
+        if image is not None:
+            self.images.move_to_end(key)
+            self.hits += 1
+            return image
+
+        self.misses += 1
+
+        image = Image()
+        image.load(font.render(text, True, color))
+
+        self.images[key] = image
+        self.bytes += surface_bytes(image.py_image)
+
+        while len(self.images) > self.max_entries or (self.bytes > self.max_bytes and len(self.images) > 1):
+            _, evicted = self.images.popitem(last=False)
+            self.bytes -= surface_bytes(evicted.py_image)
+            self.evictions += 1
+
+        return image
+
+    def clear(self):
+        self.images.clear()
+        self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+
+        return {"entries": len(self.images), "bytes": self.bytes, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+text_cache = TextCache()
+
 
 def render_font(font, text, color):
-    py_image = font.render(text, True, color)
+    # the image is shared with every other caller asking for the same text: draw it, do not draw on it
+    return text_cache.get(font, text, color)
+
+
+class GlyphAtlas:
+    # Draws text one cached glyph at a time, for fields that change every frame (numbers, timers) and would
+    # otherwise fill the text cache with strings seen once. Glyphs are placed side by side on their advance, without
+    # kerning, which suits the monospaced fonts above. Glyphs rendered on the background they are drawn on, when it is
+    # given, are opaque and blit faster.
+    def __init__(self, font, color, background=None, characters="0123456789.,-+:% "):
+        self.font = font
+        self.color = color
+        self.background = background
+
+        self.glyphs = {}
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        for character in characters:
+            self.add(character)
+
+    def add(self, character):
+        py_glyph = self.font.render(character, True, self.color, self.background)
+        metrics = self.font.metrics(character)[0]
+
+        glyph = self.glyphs[character] = (py_glyph, metrics[4] if metrics else py_glyph.get_width())
+        self.bytes += surface_bytes(py_glyph)
+
+        return glyph
+
+    def glyph(self, character):
+        glyph = self.glyphs.get(character)
+
+        if glyph is not None:
+            self.hits += 1
+            return glyph
+
+        self.misses += 1
+
+        return self.add(character)
+
+    def size(self, text):
+        return sum(self.glyph(character)[1] for character in text), self.font.get_height()
+
+    def draw(self, surface, text, x, y):
+        # draws on a gfs Surface or Image, returns the rect covered
+        start = right = x
+        blits = []
+
+        for character in text:
+            py_glyph, advance = self.glyph(character)
+            blits.append((py_glyph, (x, y)))
+
+            right = max(right, x + py_glyph.get_width())
+            x += advance
+
+        surface.blits(blits)
+
+        return pygame.Rect(start, y, max(right, x) - start, self.font.get_height())
 
-    image = Image()
-    image.load(py_image)
+    def stats(self):
+        lookups = self.hits + self.misses
 
-    return image
+        return {"glyphs": len(self.glyphs), "bytes": self.bytes, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
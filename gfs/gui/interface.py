@@ -1,26 +1,125 @@
+from collections import defaultdict
+
+from gfs.image import Image
+
+# side in pixels of the cells of the grid used to find the widgets under the mouse
+GRID_CELL = 64
+
+
 class Interface:
+    # Events only go to the widgets they concern: keyboard events to the widgets with their key, mouse buttons to
+    # the widgets under the mouse, found through a grid over the widget rects, and mouse motion to the widgets the
+    # mouse enters or leaves. Widgets without a key get no keyboard events.
+    #
+    # Widgets are composited into a cached, transparent layer covering all of them. Widgets that change state
+    # (hovered, pressed) are redrawn into it and drawn again, the whole layer only when the surface is redrawn in full.
     def __init__(self):
         self.gui = []
 
+        self.keys = defaultdict(list)
+        self.grid = defaultdict(list)
+        self.hovered = set()
+
+        self.layer = None
+        self.layer_rect = None
+        self.changed = set()
+
     def add_gui(self, gui):
         self.gui.append(gui)
 
+        if getattr(gui, "key", None) is not None:
+            self.keys[gui.key].append(gui)
+
+        for cell in self.cells(gui.rect):
+            self.grid[cell].append(gui)
+
+        self.layer = None
+
+    def cells(self, rect):
+        for cy in range(rect.top // GRID_CELL, (rect.bottom - 1) // GRID_CELL + 1):
+            for cx in range(rect.left // GRID_CELL, (rect.right - 1) // GRID_CELL + 1):
+                yield cx, cy
+
+    def at(self, pos):
+        # widgets whose rect holds pos
+        cell = (pos[0] // GRID_CELL, pos[1] // GRID_CELL)
+
+        return [gui for gui in self.grid.get(cell, ()) if gui.rect.collidepoint(pos)]
+
+    def send(self, gui, handler, *args):
+        over = gui.over
+        handler(*args)
+
+        if gui.over != over:
+            self.changed.add(gui)
+
     def keyboard_input(self, event):
-        for gui in self.gui:
-            gui.keyboard_input(event)
+        for gui in self.keys.get(event.key, ()):
+            self.send(gui, gui.keyboard_input, event)
 
     def mouse_input(self, event):
-        for gui in self.gui:
-            gui.mouse_input(event)
+        for gui in self.at(event.pos):
+            self.send(gui, gui.mouse_input, event)
 
     def mouse_motion(self, event):
-        for gui in self.gui:
-            gui.mouse_motion(event)
+        hovered = set(self.at(event.pos))
+
+        for gui in hovered ^ self.hovered:
+            self.send(gui, gui.mouse_motion, event)
+
+        self.hovered = hovered
 
     def update(self):
         for gui in self.gui:
-            gui.update()
+            self.send(gui, gui.update)
+
+    def build_layer(self):
+        self.layer_rect = self.gui[0].rect.unionall([gui.rect for gui in self.gui[1:]])
+        self.layer = Image(self.layer_rect.width, self.layer_rect.height, transparent=True)
 
-    def render(self, surface):
         for gui in self.gui:
-            gui.render(surface)
+            self.render_gui(gui)
+
+    def render_gui(self, gui):
+        # widgets draw at their screen positions: draw them into the layer shifted by its corner
+        rect = gui.rect.move(-self.layer_rect.x, -self.layer_rect.y)
+
+        self.layer.draw_rect((0, 0, 0, 0), rect)
+        gui.render(_Offset(self.layer, -self.layer_rect.x, -self.layer_rect.y))
+
+        return rect
+
+    def render(self, surface):
+        if not self.gui:
+            return
+
+        if self.layer is None:
+            self.build_layer()
+            surface.draw_image(self.layer, self.layer_rect.x, self.layer_rect.y)
+
+        elif surface.full_redraw:
+            for gui in self.changed:
+                self.render_gui(gui)
+
+            surface.draw_image(self.layer, self.layer_rect.x, self.layer_rect.y)
+
+        else:
+            for gui in self.changed:
+                rect = self.render_gui(gui)
+                surface.blit(self.layer.py_image.subsurface(rect), gui.rect.x, gui.rect.y)
+
+        self.changed.clear()
+
+
+class _Offset:
+    # what widgets draw on, moved by (dx, dy)
+    def __init__(self, image, dx, dy):
+        self.image = image
+        self.dx = dx
+        self.dy = dy
+
+    def draw_image(self, image, x, y):
+        self.image.draw_image(image, x + self.dx, y + self.dy)
+
+    def blit(self, surface, x, y):
+        self.image.py_image.blit(surface, (x + self.dx, y + self.dy))
@@ -2,16 +2,44 @@ import pygame
 
 
 class Image:
-    def __init__(self, width=0, height=0):
+    def __init__(self, width=0, height=0, transparent=False):
         self.width = width
         self.height = height
-        self.py_image = pygame.Surface((width, height))
+        self.py_image = pygame.Surface((width, height), pygame.SRCALPHA if transparent else 0)
+
+        # streaming images: bumped by every write_array()
+        self.version = 0
+        self.streaming = False
+
+    def write_array(self, array):
+        # copies a (width, height, 3) array of pixels into the image in place; the surface is only reallocated, in
+        # the pixel format of the display so that blits need no conversion, when the size changes
+        width, height = array.shape[:2]
+
+        if not self.streaming or (width, height) != (self.width, self.height):
+            py_image = pygame.Surface((width, height))
+
+            if pygame.display.get_surface() is not None:
+                py_image = py_image.convert()
+
+            self.width, self.height = width, height
+            self.py_image = py_image
+            self.streaming = True
+
+        pygame.surfarray.blit_array(self.py_image, array)
+        self.version += 1
 
     def load(self, py_image):
         self.width = py_image.get_width()
         self.height = py_image.get_height()
         self.py_image = py_image
 
+    def blit(self, py_surface, x, y):
+        self.py_image.blit(py_surface, (x, y))
+
+    def blits(self, blit_sequence):
+        self.py_image.blits(blit_sequence, doreturn=False)
+
     def draw_image(self, image, x, y):
         self.py_image.blit(image.py_image, (x, y))
 
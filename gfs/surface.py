@@ -1,4 +1,10 @@
 import pygame
+import threading
+
+# posted by request_redraw(); at most one is queued at a time, however many threads ask
+REDRAW = pygame.event.custom_type()
+
+_redraw_requested = threading.Event()
 
 
 def flip():
@@ -9,7 +15,32 @@ def events():
     return pygame.event.get()
 
 
+def wait_events(timeout_ms):
+    # blocks until an event arrives or timeout_ms passes, then returns everything queued; an empty list on timeout
+    event = pygame.event.wait(max(int(timeout_ms), 1))
+
+    if event.type == pygame.NOEVENT:
+        return []
+
+    return [event] + pygame.event.get()
+
+
+def request_redraw():
+    # safe from any thread, e.g. zenoh callbacks
+    if not _redraw_requested.is_set():
+        _redraw_requested.set()
+        pygame.event.post(pygame.event.Event(REDRAW))
+
+
+def redraw_handled():
+    # called by the main loop when it takes a REDRAW event, before rendering: changes made while it renders ask again
+    _redraw_requested.clear()
+
+
 class Surface:
+    # Draws to the window and remembers the rects it touched: present() pushes only those to the display. Until the
+    # next present() after invalidate() (first frame, window exposed, view switched), renderers are expected to draw
+    # everything, and the whole window is pushed.
     def __init__(self, width, height, title):
         pygame.init()
 
@@ -21,17 +52,42 @@ class Surface:
 
         self.py_surface = pygame.display.set_mode((width, height))
 
+        self.full_redraw = True
+        self.dirty_rects = []
+
+    def invalidate(self):
+        self.full_redraw = True
+
+    def mark_dirty(self, rect):
+        if not self.full_redraw:
+            self.dirty_rects.append(pygame.Rect(rect))
+
+    def present(self):
+        if self.full_redraw:
+            pygame.display.flip()
+        elif self.dirty_rects:
+            pygame.display.update(self.dirty_rects)
+
+        self.full_redraw = False
+        self.dirty_rects = []
+
     def clear(self, background_color):
-        self.py_surface.fill(background_color)
+        self.mark_dirty(self.py_surface.fill(background_color))
 
     def blit(self, surface, x, y):
-        self.py_surface.blit(surface, (x, y))
+        self.mark_dirty(self.py_surface.blit(surface, (x, y)))
+
+    def blits(self, blit_sequence):
+        rects = self.py_surface.blits(blit_sequence)
+
+        if rects:
+            self.mark_dirty(rects[0].unionall(rects[1:]))
 
     def draw_image(self, image, x, y):
-        self.py_surface.blit(image.py_image, (x, y))
+        self.mark_dirty(self.py_surface.blit(image.py_image, (x, y)))
 
     def draw_rect(self, color, rect):
-        self.py_surface.fill(color, rect)
+        self.mark_dirty(self.py_surface.fill(color, rect))
 
     def fill(self, color):
-        self.py_surface.fill(color)
+        self.mark_dirty(self.py_surface.fill(color))
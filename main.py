@@ -1,6 +1,8 @@
 import pygame
+import time
 
-from gfs.surface import Surface, flip, events
+from gfs.fonts import text_cache
+from gfs.surface import Surface, wait_events, redraw_handled, REDRAW
 from gfs.music import Music
 
 from ei_viewer import EiViewer
@@ -10,9 +12,18 @@ import zenoh
 
 # olivier@zettascale.tech
 
+# the view is only redrawn when something asks for it (new camera frame, lidar scan, map or input), at most this often
+MAX_FPS = 60
+
+# the control logic in update() runs on every event, and at least this often when nothing happens
+IDLE_TICK_HZ = 10
+
+# print the hit rate and memory of the rendered text cache when the viewer exits
+PRINT_TEXT_CACHE_STATS = False
+
+
 def main():
     surface = Surface(1280, 720, "ST4 EI1 - Interface!")
-    clock = pygame.time.Clock()
 
     zenoh.init_logger()
     config = zenoh.Config.from_file("config.json")
@@ -21,31 +32,56 @@ def main():
     ei_viewer = EiViewer(surface.width, surface.height, session)
 
     is_running = True
-    timer = 0
+    dirty = True
+
+    now = time.perf_counter()
+    next_tick = now
+    next_frame = now
 
     while is_running:
-        for event in events():
+        # sleep until the next idle tick, or the next frame when one is waiting for its turn
+        wake_at = min(next_tick, next_frame) if dirty else next_tick
+        changed = False
+
+        for event in wait_events((wake_at - time.perf_counter()) * 1000):
             if event.type == pygame.QUIT:
                 is_running = False
                 ei_viewer.quit()
 
+            elif event.type == REDRAW:
+                redraw_handled()
+            elif event.type == pygame.WINDOWEXPOSED:
+                surface.invalidate()
             elif event.type == pygame.KEYDOWN or event.type == pygame.KEYUP:
                 ei_viewer.keyboard_input(event)
             elif event.type == pygame.MOUSEBUTTONDOWN or event.type == pygame.MOUSEBUTTONUP:
                 ei_viewer.mouse_input(event)
             elif event.type == pygame.MOUSEMOTION:
                 ei_viewer.mouse_motion(event)
+            else:
+                continue
+
+            changed = True
+
+        now = time.perf_counter()
+
+        if changed or now >= next_tick:
+            ei_viewer.update()
+            next_tick = now + 1 / IDLE_TICK_HZ
+
+        dirty = dirty or changed
 
-        ei_viewer.update()
+        if dirty and now >= next_frame:
+            dirty = False
 
-        surface.clear((0, 0, 0))
+            ei_viewer.render(surface)
 
-        ei_viewer.render(surface)
+            surface.present()
 
-        flip()
+            next_frame = now + 1 / MAX_FPS
 
-        clock.tick(60)
-        timer = (timer + 1) % 60
+    if PRINT_TEXT_CACHE_STATS:
+        print('[INFO] Text cache: {}'.format(text_cache.stats()))
 
     pygame.quit()
 
@@ -0,0 +1,281 @@
+import collections
+import math
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# Camera streaming as a pipeline: a capture thread, a pool of encoder threads (resize + JPEG) and a publish thread,
+# connected by bounded queues that drop their oldest frame when full. Each stage runs at its own pace, so the frame
+# rate is set by the slowest stage instead of the sum of all of them, and a slow stage drops stale frames instead of
+# adding latency. cv2 releases the GIL while it resizes and encodes, so encoders do run in parallel.
+
+FRAME_WIDTH = 400
+JPEG_QUALITY = 95
+ENCODERS = 2
+QUEUE_SIZE = 2
+
+
+class FrameClock:
+    # Frame times of a free-running camera: wait() returns at the next frame after now, so a reader late for a
+    # frame misses it, as it would with the camera.
+    def __init__(self, fps):
+        self.period = 1 / fps if fps else 0
+        self.started = time.perf_counter()
+
+    def wait(self):
+        if self.period:
+            elapsed = time.perf_counter() - self.started
+            time.sleep(math.ceil(elapsed / self.period) * self.period - elapsed)
+
+
+class PicameraSource:
+    # Frames of the Raspberry Pi camera, BGR as the viewer expects them.
+    def __init__(self):
+        from picamera2 import Picamera2
+
+        self.camera = Picamera2()
+        self.camera.configure(self.camera.create_still_configuration({'format': 'BGR888'}))
+        self.camera.start()
+
+    def read(self):
+        return self.camera.capture_array()
+
+    def close(self):
+        self.camera.stop()
+
+
+class VideoFileSource:
+    # Frames of a video file, looped, at the file frame rate unless realtime is False.
+    def __init__(self, path, realtime=True):
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+
+        if not self.capture.isOpened():
+            raise ValueError(f"cannot open {path}")
+
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.clock = FrameClock(fps if realtime and fps > 0 else 0)
+
+    def read(self):
+        self.clock.wait()
+
+        ok, frame = self.capture.read()
+
+        if not ok:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.capture.read()
+
+        return frame if ok else None
+
+    def close(self):
+        self.capture.release()
+
+
+class SyntheticSource:
+    # Moving test pattern at the size of the camera still configuration, at fps frames per second or as fast as
+    # they are asked for when fps is 0.
+    def __init__(self, width=1640, height=1232, fps=0):
+        rng = np.random.default_rng(0)
+
+        # noise compresses about as badly as a real scene: tiles of it with a gradient over them
+        tile = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+        gradient = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+
+        self.pattern = (np.tile(tile, (8, 8, 1))[:height, :width] * 0.5 + gradient * 0.5).astype(np.uint8)
+        self.clock = FrameClock(fps)
+        self.count = 0
+
+    def read(self):
+        self.clock.wait()
+
+        self.count += 1
+
+        return np.roll(self.pattern, self.count * 8, axis=1)
+
+    def close(self):
+        pass
+
+
+class DropOldestQueue:
+    # Bounded queue whose put() never blocks: when full, the oldest item is dropped to make room.
+    def __init__(self, maxsize):
+        self.items = collections.deque()
+        self.maxsize = maxsize
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self.condition:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self):
+        # None once the queue is closed
+        with self.condition:
+            while not self.items and not self.closed:
+                self.condition.wait()
+
+            return self.items.popleft() if self.items else None
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class StageTimes:
+    # Count, total and worst time of each stage, safe to add to from several threads.
+    def __init__(self, stages):
+        self.lock = threading.Lock()
+        self.stages = stages
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.count = dict.fromkeys(self.stages, 0)
+            self.total = dict.fromkeys(self.stages, 0.0)
+            self.worst = dict.fromkeys(self.stages, 0.0)
+            self.started = time.perf_counter()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.count[stage] += 1
+            self.total[stage] += seconds
+            self.worst[stage] = max(self.worst[stage], seconds)
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = time.perf_counter() - self.started
+
+            return dict((stage, {"fps": self.count[stage] / elapsed,
+                                 "mean_ms": self.total[stage] / self.count[stage] * 1e3 if self.count[stage] else 0.0,
+                                 "max_ms": self.worst[stage] * 1e3}) for stage in self.stages)
+
+
+class Streamer:
+    # Captures frames from source, resizes them to width, JPEG-encodes them on a pool of encoder threads and hands
+    # them to publish(bytes), newest first: a frame encoded after a newer one was published is dropped.
+    def __init__(self, source, publish, width=FRAME_WIDTH, quality=JPEG_QUALITY, encoders=ENCODERS,
+                 queue_size=QUEUE_SIZE):
+        self.source = source
+        self.publish = publish
+        self.width = width
+        self.jpeg_opts = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+
+        self.captured = DropOldestQueue(queue_size)
+        self.encoded = DropOldestQueue(queue_size)
+
+        self.times = StageTimes(("capture", "resize", "encode", "publish"))
+        self.stale = 0
+        self.latency = 0.0
+
+        self.running = False
+        self.encoders_running = encoders
+        self.encoders_lock = threading.Lock()
+
+        self.threads = [threading.Thread(target=self.capture_loop, daemon=True)]
+        self.threads += [threading.Thread(target=self.encode_loop, daemon=True) for _ in range(encoders)]
+        self.threads += [threading.Thread(target=self.publish_loop, daemon=True)]
+
+    def start(self):
+        self.running = True
+
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+
+        # the capture thread closes the queues after its last frame, which stops the others
+        for thread in self.threads:
+            thread.join()
+
+    def capture_loop(self):
+        sequence = 0
+
+        while self.running:
+            start = time.perf_counter()
+            frame = self.source.read()
+            end = time.perf_counter()
+
+            if frame is None:
+                break
+
+            self.times.add("capture", end - start)
+
+            sequence += 1
+            self.captured.put((sequence, end, frame))
+
+        self.captured.close()
+
+    def encode_loop(self):
+        while True:
+            item = self.captured.get()
+
+            if item is None:
+                break
+
+            sequence, captured_at, frame = item
+
+            # as imutils.resize(frame, width=...) did
+            start = time.perf_counter()
+            height = int(frame.shape[0] * self.width / frame.shape[1])
+            frame = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+            resized = time.perf_counter()
+
+            _, jpeg = cv2.imencode('.jpg', frame, self.jpeg_opts)
+            end = time.perf_counter()
+
+            self.times.add("resize", resized - start)
+            self.times.add("encode", end - resized)
+
+            self.encoded.put((sequence, captured_at, jpeg.tobytes()))
+
+        # the last encoder to finish closes the publish queue
+        with self.encoders_lock:
+            self.encoders_running -= 1
+
+            if not self.encoders_running:
+                self.encoded.close()
+
+    def publish_loop(self):
+        published = 0
+
+        while True:
+            item = self.encoded.get()
+
+            if item is None:
+                break
+
+            sequence, captured_at, payload = item
+
+            if sequence < published:
+                self.stale += 1
+                continue
+
+            start = time.perf_counter()
+            self.publish(payload)
+            end = time.perf_counter()
+
+            self.times.add("publish", end - start)
+            self.latency = end - captured_at
+            published = sequence
+
+    def stats(self):
+        return {"stages": self.times.snapshot(), "dropped_captured": self.captured.dropped,
+                "dropped_encoded": self.encoded.dropped, "stale": self.stale, "latency_ms": self.latency * 1e3}
+
+    def report(self):
+        stats = self.stats()
+        stages = "  ".join(f"{stage} {times['fps']:5.1f} fps {times['mean_ms']:6.1f} ms (max {times['max_ms']:6.1f})"
+                           for stage, times in stats["stages"].items())
+
+        return f"{stages}  dropped {stats['dropped_captured']}+{stats['dropped_encoded']} " \
+               f"stale {stats['stale']}  latency {stats['latency_ms']:.1f} ms"
@@ -1,6 +1,4 @@
-import imutils
 import time
-import cv2
 import json
 import random
 import zenoh
@@ -9,6 +7,7 @@ import io
 from dataclasses import dataclass
 
 from servo import *
+from streamer import Streamer, PicameraSource
 
 from pycdr2 import IdlStruct
 from pycdr2.types import int8, int32, uint32, float64
@@ -29,6 +28,11 @@ PROTOCOL_VERSION            = 2.0
 BAUDRATE                    = 115200
 MOTOR_ID                    = 200
 
+# the motor board gets the current command this often, whatever the camera frame rate
+SERVO_PERIOD                = 0.05
+ENCODERS                    = 2
+REPORT_INTERVAL             = 5.0
+
 def listener(sample):
     global cmd
     
@@ -43,10 +47,6 @@ def listener(sample):
     else:
         print("not recnognizable")
 
-from picamera2 import Picamera2
-
-jpeg_opts = [int(cv2.IMWRITE_JPEG_QUALITY), 95]
-
 print('[INFO] Open zenoh session...')
 
 zenoh.init_logger()
@@ -55,9 +55,8 @@ z = zenoh.open(conf)
 
 print('[INFO] Start video stream - Cam #{}'.format(0))
 
-picam2 = Picamera2()
-picam2.configure (picam2.create_still_configuration({'format': 'BGR888'}))
-picam2.start ()
+source = PicameraSource()
+streamer = Streamer(source, lambda jpeg: z.put('turtle/camera', jpeg), encoders=ENCODERS)
 
 cmd = Twist(Vector3(0.0, 0.0, 0.0), Vector3(0.0, 0.0, 0.0))
 count = 0
@@ -73,14 +72,10 @@ else:
 
 time.sleep(3.0)
 
-while True:
-    raw = picam2.capture_array ()
-    frame = imutils.resize(raw, width=400)
-
-    _, jpeg = cv2.imencode('.jpg', frame, jpeg_opts)
+streamer.start()
+next_report = time.perf_counter() + REPORT_INTERVAL
 
-    z.put('turtle/camera', jpeg.tobytes())
-    
+while True:
     if servo is not None:
         servo.write1ByteTxRx(HEARTBEAT, count)
         servo.write4ByteTxRx(CMD_VELOCITY_LINEAR_X, int(cmd.linear.x))
@@ -94,6 +89,14 @@ while True:
         
         if count > 255:
             count = 0
+
+    if time.perf_counter() >= next_report:
+        print('[INFO] Camera: {}'.format(streamer.report()))
+        streamer.times.reset()
+        next_report += REPORT_INTERVAL
+
+    time.sleep(SERVO_PERIOD)
 	
-vs.stop()
+streamer.stop()
+source.close()
 z.close()
@@ -0,0 +1,46 @@
+import argparse
+import time
+
+from ei.slam_service import SlamService, SHARED_MAP_NAME
+
+import zenoh
+
+
+# Runs SLAM next to the viewer or on any other machine of the zenoh network; start the viewer with
+# MainView(..., slam_service=True) to consume its pose and map.
+
+def main():
+    parser = argparse.ArgumentParser(description="Turtle SLAM service")
+    parser.add_argument("--config", default="config.json", help="zenoh configuration file")
+    parser.add_argument("--map-size-pixels", type=int, default=600)
+    parser.add_argument("--map-size-meters", type=float, default=5)
+    parser.add_argument("--threads", type=int, default=1, help="RMHC search threads")
+    parser.add_argument("--map-file", help="keep the map in this file, and resume from it when restarted")
+    parser.add_argument("--shared-map-name", default=SHARED_MAP_NAME,
+                        help="shared-memory segment for viewers on this host")
+    parser.add_argument("--no-shared-map", action="store_true", help="do not share the map through memory")
+    parser.add_argument("--no-publish-map", action="store_true",
+                        help="do not publish the map, for viewers that all run on this host")
+    args = parser.parse_args()
+
+    zenoh.init_logger()
+    config = zenoh.Config.from_file(args.config)
+    session = zenoh.open(config)
+
+    service = SlamService(session, args.map_size_pixels, args.map_size_meters,
+                          shared_map_name=None if args.no_shared_map else args.shared_map_name,
+                          publish_map=not args.no_publish_map, num_threads=args.threads,
+                          map_file=args.map_file)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.quit()
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
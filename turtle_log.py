@@ -0,0 +1,108 @@
+import argparse
+import collections
+import time
+
+from ei.recording import LogReader, Recorder, ZenohSink, RECORD_KEYS, replay
+
+import zenoh
+
+
+# Records the turtle's zenoh traffic to a log and replays it, to reproduce a run without the robot:
+#   python turtle_log.py record run.log
+#   python turtle_log.py replay run.log --speed 4
+#   python turtle_log.py info run.log
+# To feed a MainView directly instead, replay into ei.recording.CallbackSink.
+
+def open_session(config_file):
+    zenoh.init_logger()
+
+    return zenoh.open(zenoh.Config.from_file(config_file))
+
+
+def record(args):
+    session = open_session(args.config)
+    recorder = Recorder(session, args.log, args.keys)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+        session.close()
+
+    print(f"{recorder.writer.records} records")
+
+
+def play(args):
+    reader = LogReader(args.log)
+    session = open_session(args.config)
+    sink = ZenohSink(session)
+
+    start_ns = reader.start_ns + int(args.start * 1e9) if args.start and reader.start_ns is not None else None
+    keys = set(args.key) if args.key else None
+
+    started = time.perf_counter()
+
+    try:
+        count = replay(reader, sink, args.speed, start_ns=start_ns, keys=keys)
+    except KeyboardInterrupt:
+        count = None
+    finally:
+        sink.close()
+        session.close()
+
+    if count is not None:
+        print(f"{count} records in {time.perf_counter() - started:.1f} s")
+
+
+def info(args):
+    reader = LogReader(args.log)
+
+    counts = collections.Counter()
+    sizes = collections.Counter()
+    first_ns = last_ns = None
+
+    for record in reader:
+        counts[record.key] += 1
+        sizes[record.key] += len(record.payload)
+        first_ns = record.timestamp_ns if first_ns is None else first_ns
+        last_ns = record.timestamp_ns
+
+    duration = (last_ns - first_ns) / 1e9 if counts else 0
+
+    print(f"{args.log}: {sum(counts.values())} records over {duration:.1f} s, {len(reader.index_offsets)} index entries")
+
+    for key in sorted(counts):
+        rate = counts[key] / duration if duration else 0
+        print(f"  {key:24s} {counts[key]:8d} records, {sizes[key] / 1e6:9.1f} MB, {rate:6.1f} /s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Turtle zenoh recorder and replayer")
+    parser.add_argument("--config", default="config.json", help="zenoh configuration file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="record samples until interrupted")
+    record_parser.add_argument("log")
+    record_parser.add_argument("--keys", default=RECORD_KEYS, help="key expression to record")
+    record_parser.set_defaults(run=record)
+
+    play_parser = commands.add_parser("replay", help="republish a log")
+    play_parser.add_argument("log")
+    play_parser.add_argument("--speed", type=float, default=1.0, help="replay speed; 0 for as fast as possible")
+    play_parser.add_argument("--start", type=float, default=0, help="seconds into the log to start at")
+    play_parser.add_argument("--key", action="append", help="replay only this key; may be repeated")
+    play_parser.set_defaults(run=play)
+
+    info_parser = commands.add_parser("info", help="summarize a log")
+    info_parser.add_argument("log")
+    info_parser.set_defaults(run=info)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import argparse
+import time
+
+from ei.simulation import Simulation
+
+import zenoh
+
+
+# Stands in for raspberry/turtle.py and the lidar node on a machine without the robot: publishes JPEG frames on
+# turtle/camera and CDR LaserScans on turtle/lidar, seen from a pose integrated from turtle/cmd_vel, at any rate.
+# More robots publish under turtle1/, turtle2/, ..., or all under turtle/ with --same-keys to load one viewer.
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated turtle")
+    parser.add_argument("--config", default="config.json", help="zenoh configuration file")
+    parser.add_argument("--robots", type=int, default=1)
+    parser.add_argument("--same-keys", action="store_true", help="all robots publish under turtle/")
+    parser.add_argument("--lidar-hz", type=float, default=5, help="scans per second and robot; 0 for none")
+    parser.add_argument("--camera-fps", type=float, default=10, help="frames per second and robot; 0 for none")
+    parser.add_argument("--width", type=int, default=400, help="camera frame width")
+    parser.add_argument("--height", type=int, default=300, help="camera frame height")
+    args = parser.parse_args()
+
+    zenoh.init_logger()
+    session = zenoh.open(zenoh.Config.from_file(args.config))
+
+    prefixes = ["turtle"] * args.robots if args.same_keys else None
+    simulation = Simulation(session, args.robots, args.lidar_hz, args.camera_fps, args.width, args.height,
+                            prefixes)
+    simulation.start()
+
+    try:
+        while True:
+            scans = sum(robot.scans for robot in simulation.robots)
+            frames = sum(robot.frames for robot in simulation.robots)
+            time.sleep(5)
+
+            scan_rate = (sum(robot.scans for robot in simulation.robots) - scans) / 5
+            frame_rate = (sum(robot.frames for robot in simulation.robots) - frames) / 5
+            print(f"[INFO] {scan_rate:.1f} scans/s, {frame_rate:.1f} frames/s")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulation.quit()
+        session.close()
+
+
+if __name__ == "__main__":
+    main()